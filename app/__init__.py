@@ -2,25 +2,79 @@ from flask import Flask
 from flask_cors import CORS
 from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
+from werkzeug.middleware.proxy_fix import ProxyFix
 
+from app.utils.cache import TTLCache
+from app.utils.hashing import PasswordHasher
+from app.utils.instrumentation import RequestInstrumentation
+from app.utils.json_provider import ModelJSONProvider
+from app.utils.metrics import Metrics
+from app.utils.ratelimit import RateLimiter
+from app.utils.replica import (REPLICA_BIND, RoutingSession,
+                               clear_read_replica)
+from app.utils.sqlite import set_pragmas
 from settings import BaseConfig
 
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 migrate = Migrate()
 
 
 def create_app(config=BaseConfig):
     app = Flask(__name__)
     app.config.from_object(config)
+    app.json = ModelJSONProvider(app)
+    if app.config['PROXY_HOPS']:
+        app.wsgi_app = ProxyFix(app.wsgi_app,
+                                x_for=app.config['PROXY_HOPS'])
     CORS(app, supports_credentials=True)
 
     db.init_app(app)
+    # The replica has copies of the primary tables and no models of its
+    # own, create_all and drop_all must not look for its (shared) metadata
+    db.metadatas.pop(REPLICA_BIND, None)
+    app.teardown_request(clear_read_replica)
+    with app.app_context():
+        for engine in db.engines.values():
+            set_pragmas(engine, app.config['SQLITE_PRAGMAS'])
     migrate.init_app(app, db)
+    RequestInstrumentation(app, db)
+    Metrics(app, db)
+    RateLimiter(app)
+    app.extensions['thread_cache'] = TTLCache(app.config['THREAD_CACHE_SIZE'],
+                                              app.config['THREAD_CACHE_TTL'])
+    app.extensions['user_cache'] = TTLCache(app.config['USER_CACHE_SIZE'],
+                                            app.config['USER_CACHE_TTL'])
+    app.extensions['password_hasher'] = PasswordHasher(
+        app.config['PASSWORD_HASH_METHOD'],
+        app.config['PASSWORD_HASH_WORKERS'],
+        app.config['PASSWORD_HASH_QUEUE_DEPTH'],
+        app.config['PASSWORD_HASH_TIMEOUT']
+    )
 
     from app.auth import bp as auth_bp
     app.register_blueprint(auth_bp)
     from app.main import bp as main_bp
     app.register_blueprint(main_bp)
 
+    from app.cli import comments_cli, maintenance_cli
+    app.cli.add_command(comments_cli)
+    app.cli.add_command(maintenance_cli)
+
+    if app.config['COMMENT_WRITE_MODE'] != 'sync':
+        from app.main.writer import CommentWriter
+        app.extensions['comment_writer'] = CommentWriter(
+            app,
+            app.config['WRITE_BEHIND_INTERVAL'],
+            app.config['WRITE_BEHIND_BATCH_SIZE']
+        )
+
+    if app.config['SNAPSHOT_DIR'] and app.config['SNAPSHOT_ON_WRITE']:
+        from app.main.snapshots import SnapshotWriter
+        app.extensions['snapshot_writer'] = SnapshotWriter(
+            app,
+            app.config['SNAPSHOT_DIR'],
+            app.config['SNAPSHOT_DELAY']
+        )
+
     return app
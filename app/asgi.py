@@ -0,0 +1,193 @@
+import sys
+from io import BytesIO
+
+from asgiref.wsgi import WsgiToAsgi
+from flask import current_app, jsonify, request
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.exceptions import HTTPException
+
+from app.main.routes import check_post_ids, thread_response
+from app.main.threads import (load_thread_async, load_thread_page_async,
+                              thread_etag, truncation_args)
+from app.models import PostMeta
+from app.utils.pagination import is_paginated, page_args
+from app.utils.replica import REPLICA_BIND
+from app.utils.sqlite import set_pragmas
+
+# asyncio drivers used for database URLs without an explicit driver
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite'}
+
+
+def async_database_url(url):
+    """Return the database URL with an asyncio driver, e.g. aiosqlite."""
+    url = make_url(url)
+    if url.drivername in ASYNC_DRIVERS:
+        url = url.set(drivername=ASYNC_DRIVERS[url.drivername])
+    return url
+
+
+def wsgi_environ(scope):
+    """Build the WSGI environ of a bodyless ASGI HTTP request."""
+    script_name = scope.get('root_path', '').encode().decode('latin-1')
+    path_info = scope['path'].encode().decode('latin-1')
+    if path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name,
+        'PATH_INFO': path_info,
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f'HTTP/{scope["http_version"]}',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f'HTTP_{name}'
+        value = value.decode('latin-1')
+        environ[name] = (f'{environ[name]},{value}' if name in environ
+                         else value)
+    return environ
+
+
+class AsyncReads:
+    """
+    ASGI application that serves comment thread and count reads with
+    SQLAlchemy's asyncio engine, so one worker can wait on many queries
+    at once. Every other request goes to the Flask app, run in a thread
+    pool.
+    Async views run in a request context of the Flask app with its before
+    and after request hooks (rate limits, CORS, instrumentation and
+    metrics) and build their responses with the helpers of the Flask
+    views. Reads use the "replica" bind if one is configured. Threads are
+    cached in the same thread cache as the Flask views.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.wsgi = WsgiToAsgi(app)
+        config = app.config
+        url = (config['SQLALCHEMY_BINDS'].get(REPLICA_BIND)
+               or config['SQLALCHEMY_DATABASE_URI'])
+        self.engine = create_async_engine(
+            async_database_url(url),
+            **config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+        )
+        set_pragmas(self.engine.sync_engine, config['SQLITE_PRAGMAS'])
+        if config['INSTRUMENTATION_ENABLED']:
+            app.extensions['instrumentation'].instrument(
+                self.engine.sync_engine)
+        self.urls = app.url_map.bind('localhost')
+        self.views = {
+            'main.post_comments': self.post_comments,
+            'main.comment_counts': self.comment_counts,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            try:
+                endpoint, values = self.urls.match(scope['path'], 'GET')
+            except HTTPException:
+                endpoint = None
+            if (view := self.views.get(endpoint)) is not None:
+                return await self.dispatch(scope, send, view, values)
+        return await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def dispatch(self, scope, send, view, values):
+        """Same as Flask's full_dispatch_request with an async view."""
+        app = self.app
+        with app.request_context(wsgi_environ(scope)):
+            try:
+                try:
+                    response = app.preprocess_request()
+                    if response is None:
+                        response = await view(**values)
+                except Exception as e:
+                    response = app.handle_user_exception(e)
+                response = app.finalize_request(response)
+            except Exception as e:
+                response = app.handle_exception(e)
+            body = response.get_data()
+
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': [(name.lower().encode('latin-1'),
+                         value.encode('latin-1'))
+                        for name, value in response.headers.items()],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def load_comments(self, connection, post_id, version):
+        """Same as load_cached_comments in the Flask views."""
+        cache = current_app.extensions['thread_cache']
+        key = (post_id, version, request.args.get('limit'),
+               request.args.get('cursor'))
+        cached = cache.get(key)
+        if cached is None:
+            generation = cache.generation(post_id)
+            if is_paginated():
+                limit, cursor = page_args()
+                cached = await load_thread_page_async(connection, post_id,
+                                                      limit, cursor)
+            else:
+                cached = await load_thread_async(connection, post_id), None
+            cache.set(key, cached, group=post_id, generation=generation)
+        return cached
+
+    async def post_comments(self, post_id):
+        """Get all comments for a specific post."""
+        async with self.engine.connect() as connection:
+            version = (await connection.execute(
+                select(PostMeta.version).where(PostMeta.post_id == post_id)
+            )).scalar() or 0
+            etag = thread_etag(version, request.query_string)
+            if request.if_none_match.contains_weak(etag):
+                return thread_response(etag)
+            try:
+                truncation = truncation_args()
+                page = await self.load_comments(connection, post_id,
+                                                version)
+            except ValueError as e:
+                return jsonify({'message': str(e)}), 400
+        return thread_response(etag, page, truncation)
+
+    async def comment_counts(self):
+        """Get number of comments for many posts at once."""
+        post_ids = request.args.getlist('post_id')
+        if error := check_post_ids(post_ids,
+                                   current_app.config['COUNTS_MAX_POSTS']):
+            return jsonify({'message': error}), 400
+
+        counts = dict.fromkeys(post_ids, 0)
+        async with self.engine.connect() as connection:
+            counts.update((await connection.execute(
+                select(PostMeta.post_id, PostMeta.comment_count)
+                .where(PostMeta.post_id.in_(post_ids))
+            )).all())
+        return jsonify(counts), 200
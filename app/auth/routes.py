@@ -2,15 +2,24 @@ from flask import jsonify, make_response, request
 from sqlalchemy.exc import IntegrityError
 
 from app import db
-from app.auth.tokens import decode_token, token_required
+from app.auth.tokens import invalidate_user, load_user, token_required
+from app.main.threads import thread_cache
 from app.models import User
 from app.utils.cookie import delete_cookie, set_cookie
+from app.utils.hashing import HashingOverloaded
 
 from . import bp
 from .tokens import create_token
 from .validators import validate
 
 
+@bp.app_errorhandler(HashingOverloaded)
+def hashing_overloaded(e):
+    response = jsonify({'message': 'Server is busy, try again later'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+
 @bp.route('/register', methods=['POST'])
 def register():
     """Register user"""
@@ -30,6 +39,15 @@ def register():
             'message': 'Password and password confirm must be the same'
         }), 400,
 
+    # Check before hashing the password, hashing is the expensive part
+    existing = User.query.filter(
+        (User.username == data['username']) | (User.email == data['email'])
+    ).first()
+    if existing is not None:
+        if existing.username == data['username']:
+            return jsonify({'message': 'Username is in use'}), 400
+        return jsonify({'message': 'E-mail address is in use'}), 400
+
     user = User(username=data['username'], email=data['email'])
     user.set_password(data['password'])
     db.session.add(user)
@@ -56,6 +74,10 @@ def login():
 
     if user is not None:
         if user.check_password(data.get('password')):
+            # Upgrade hashes made with old parameters
+            if user.password_needs_rehash():
+                user.set_password(data.get('password'))
+                db.session.commit()
             response = make_response()
             access_token = create_token(user.email)
             refresh_token = create_token(user.email, time_valid=(0, 12, 0, 0))
@@ -112,6 +134,7 @@ def user_update(*args, **kwargs):
             if (valid := validate('password', password)) is not None:
                 return jsonify({'message': valid}), 400
             user.set_password(password)
+        username_changed = user.username != data.get('username')
         user.username = data.get('username')
         user.about = data.get('about')
         # Set new auth tokens if user change e-mail address
@@ -125,6 +148,10 @@ def user_update(*args, **kwargs):
             set_cookie(response, 'refresh', refresh_token, (0, 12, 0, 0))
 
         db.session.commit()
+        invalidate_user(user)
+        # Cached threads contain author usernames
+        if username_changed:
+            thread_cache().clear()
 
         if response:
             return response
@@ -140,9 +167,7 @@ def refresh():
     if refresh_token is None:
         return jsonify({'message': 'Unauthorized'}), 401
 
-    payload = decode_token(refresh_token)
-
-    user = User.query.filter_by(email=payload).first()
+    user = load_user(refresh_token)
 
     if user is not None:
         response = make_response()
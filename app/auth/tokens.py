@@ -4,7 +4,9 @@ from functools import wraps
 import jwt
 
 from flask import current_app, jsonify, request
+from sqlalchemy.orm import make_transient_to_detached
 
+from app import db
 from app.models import User
 
 
@@ -34,31 +36,80 @@ def create_token(identity, time_valid=(0, 0, 0, 60)):
         return e
 
 
-def decode_token(auth_token):
+def decode_payload(auth_token):
     """
     Decodes the auth token
     :param auth_token:
-    :return: string|bool
+    :return: dict|bool
     """
     try:
-        payload = jwt.decode(auth_token, current_app.config.get('SECRET_KEY'),
-                             algorithms='HS256')
-        return payload['sub']
+        return jwt.decode(auth_token, current_app.config.get('SECRET_KEY'),
+                          algorithms='HS256')
     except jwt.ExpiredSignatureError:
         return False
     except jwt.InvalidTokenError:
         return False
 
 
+def decode_token(auth_token):
+    """
+    Decodes the auth token
+    :param auth_token:
+    :return: string|bool
+    """
+    payload = decode_payload(auth_token)
+    return payload['sub'] if payload else False
+
+
+def user_cache():
+    """Return the cache of token -> user column values, grouped by user id."""
+    return current_app.extensions['user_cache']
+
+
+def load_user(auth_token):
+    """
+    Get the user of a token.
+    Decoded tokens are cached with the user they belong to, so a cached
+    token skips both the signature check and the user query. Entries never
+    outlive the token and are invalidated by invalidate_user.
+    :param auth_token:
+    :return: User attached to the current session or None
+    """
+    if not auth_token:
+        return None
+
+    cache = user_cache()
+    values = cache.get(auth_token)
+    if values is None:
+        payload = decode_payload(auth_token)
+        if not payload:
+            return None
+        user = User.query.filter_by(email=payload['sub']).first()
+        if user is None:
+            return None
+        values = {column.key: getattr(user, column.key)
+                  for column in User.__table__.columns}
+        ttl = min(cache.ttl, payload['exp'] - datetime.datetime.now(
+            datetime.timezone.utc).timestamp())
+        cache.set(auth_token, values, group=user.id, ttl=ttl)
+        return user
+
+    user = User(**values)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def invalidate_user(user):
+    """Drop cached tokens of a user, e.g. after the user was updated."""
+    user_cache().invalidate(user.id)
+
+
 def token_required(f):
     @wraps(f)
     def wrapper(*args, **kwargs):
-        token = request.cookies.get('access')
-        decoded = decode_token(token)
-        if decoded:
-            user = User.query.filter_by(email=decoded).first()
-            if user is not None:
-                kwargs['user'] = user
-                return f(*args, **kwargs)
+        user = load_user(request.cookies.get('access'))
+        if user is not None:
+            kwargs['user'] = user
+            return f(*args, **kwargs)
         return jsonify({'message': 'Token is not valid or expired'}), 401
     return wrapper
@@ -0,0 +1,102 @@
+import json
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from app import db
+from app.main.ingest import BatchInsert
+from app.main.retention import Retention
+from app.main.snapshots import export_snapshots
+from app.utils.replica import REPLICA_BIND, refresh_replica
+
+
+comments_cli = AppGroup('comments', help='Manage blog comments.')
+maintenance_cli = AppGroup('maintenance', help='Database maintenance.')
+
+
+@comments_cli.command('import')
+@click.argument('file', type=click.File())
+@click.option('--chunk-size', type=int, default=None,
+              help='Comments inserted per transaction.')
+def import_comments(file, chunk_size):
+    """Import comments from a JSON file.
+
+    The file holds a list of comments (or an object with a "comments"
+    list) in the same format as the POST /batch endpoint.
+    """
+    data = json.load(file)
+    items = data.get('comments') if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        raise click.UsageError('File must contain a list of comments')
+
+    report = BatchInsert(items, chunk_size=chunk_size).run()
+    for error in report['errors']:
+        click.echo(f"Item {error['index']} (ref {error['ref']}): "
+                   f"{error['message']}", err=True)
+    click.echo(f"Imported {report['inserted']} of {len(items)} comments")
+
+
+@comments_cli.command('refresh-replica')
+def refresh_replica_command():
+    """Copy the primary SQLite database into the read replica file."""
+    if REPLICA_BIND not in db.engines:
+        raise click.UsageError('No replica database is configured')
+    try:
+        refresh_replica(db.engine, db.engines[REPLICA_BIND])
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    click.echo('Replica refreshed')
+
+
+@comments_cli.command('export-snapshots')
+@click.option('--directory', default=None,
+              help='Output directory, SNAPSHOT_DIR by default.')
+@click.option('--all', 'full', is_flag=True,
+              help='Write every post, not only the changed ones.')
+def export_snapshots_command(directory, full):
+    """Write static JSON snapshots of changed post threads."""
+    directory = directory or current_app.config['SNAPSHOT_DIR']
+    if not directory:
+        raise click.UsageError('No snapshot directory is configured')
+    written = export_snapshots(directory, full=full)
+    click.echo(f'Exported {written} snapshots')
+
+
+@maintenance_cli.command('run')
+@click.option('--contacts-days', type=int, default=None,
+              help='Remove read contact messages older than this.')
+@click.option('--comments-days', type=int, default=None,
+              help='Remove comments orphaned longer than this.')
+@click.option('--archive', default=None,
+              help='SQLite file to copy removed rows to.')
+@click.option('--batch-size', type=int, default=None,
+              help='Rows removed per transaction.')
+@click.option('--vacuum', is_flag=True, help='VACUUM the database file.')
+@click.option('--analyze', is_flag=True,
+              help='Refresh query planner statistics.')
+def maintenance_run(contacts_days, comments_days, archive, batch_size,
+                    vacuum, analyze):
+    """Apply the retention policies and compact the database.
+
+    Options override the RETENTION_* settings.
+    """
+    config = current_app.config
+    if contacts_days is None:
+        contacts_days = config['RETENTION_READ_CONTACTS_DAYS']
+    if comments_days is None:
+        comments_days = config['RETENTION_ORPHANED_COMMENTS_DAYS']
+    archive = archive or config['RETENTION_ARCHIVE']
+    if db.engine.dialect.name != 'sqlite':
+        raise click.UsageError('Only SQLite databases are supported')
+
+    report = Retention(
+        db.engine,
+        batch_size or config['RETENTION_BATCH_SIZE'],
+        config['RETENTION_BATCH_PAUSE'],
+        archive
+    ).run(contacts_days, comments_days, vacuum=vacuum, analyze=analyze)
+    click.echo(f"{'Archived' if archive else 'Deleted'} "
+               f"{report['contacts']} contact messages and "
+               f"{report['comments']} comments")
+    click.echo(f"Reclaimed {report['bytes']} bytes")
@@ -0,0 +1,111 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import delete, func, select, update
+
+from app import db
+from app.models import Contact
+from app.utils.pagination import keyset_page, split_page
+
+STATUSES = ('unread', 'read', 'all')
+
+
+def _parse_datetime(name, value):
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'"{name}" must be an ISO 8601 date') from None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def contact_filters(data, max_ids, status='all'):
+    """
+    Build the conditions selecting contact messages.
+    :param data: mapping with any of "ids" (list of ids), "email" (of the
+        sender), "since" and "until" (ISO 8601, from inclusive to
+        exclusive) and "status" ("unread", "read" or "all")
+    :param max_ids: maximum number of ids
+    :param status: status used if data has none
+    :return: list of conditions, empty if nothing but the status is given
+    :raises ValueError: if a filter is not valid
+    """
+    conditions = []
+    if (ids := data.get('ids')) is not None:
+        if (not isinstance(ids, list)
+                or not all(isinstance(id, int) and not isinstance(id, bool)
+                           for id in ids)):
+            raise ValueError('"ids" must be a list of integers')
+        if len(ids) > max_ids:
+            raise ValueError(f'At most {max_ids} ids are allowed')
+        conditions.append(Contact.id.in_(ids))
+    if email := data.get('email'):
+        conditions.append(Contact.email == email)
+    if since := data.get('since'):
+        conditions.append(Contact.created_at >= _parse_datetime('since',
+                                                                since))
+    if until := data.get('until'):
+        conditions.append(Contact.created_at < _parse_datetime('until',
+                                                               until))
+
+    status = data.get('status') or status
+    if status not in STATUSES:
+        raise ValueError(f'"status" must be one of {", ".join(STATUSES)}')
+    if status != 'all':
+        conditions.append(Contact.is_read == (status == 'read'))
+    return conditions
+
+
+def load_inbox(conditions, limit=None, cursor=None):
+    """
+    Load contact messages, newest first, only one page if limit is given.
+    :return: tuple (contacts, next_cursor or None)
+    """
+    if limit is None:
+        return db.session.scalars(
+            select(Contact)
+            .where(*conditions)
+            .order_by(Contact.created_at.desc(), Contact.id.desc())
+        ).all(), None
+    stmt = keyset_page(select(Contact).where(*conditions),
+                       Contact.created_at, Contact.id, limit, cursor,
+                       descending=True)
+    return split_page(db.session.scalars(stmt), limit)
+
+
+def unread_count():
+    """Count unread contact messages."""
+    return db.session.execute(
+        select(func.count())
+        .select_from(Contact)
+        .where(Contact.is_read == False)
+    ).scalar()
+
+
+def mark_read(conditions):
+    """
+    Mark all matching unread messages as read in one UPDATE.
+    :return: number of updated messages
+    """
+    result = db.session.execute(
+        update(Contact)
+        .where(Contact.is_read == False, *conditions)
+        .values(is_read=True)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def delete_contacts(conditions):
+    """
+    Delete all matching messages in one DELETE.
+    :return: number of deleted messages
+    """
+    result = db.session.execute(
+        delete(Contact)
+        .where(*conditions)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
@@ -0,0 +1,237 @@
+from collections import defaultdict, deque
+from datetime import datetime, timezone
+
+from flask import current_app
+from sqlalchemy import func, insert, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db
+from app.models import Comment, PostMeta, User, path_segment
+
+from .threads import thread_changed
+
+
+def _parse_created_at(value):
+    if value is None:
+        return datetime.now(timezone.utc).replace(tzinfo=None)
+    created_at = datetime.fromisoformat(value)
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return created_at
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _validate_item(item):
+    """Return an error message for a malformed item or None."""
+    if not isinstance(item, dict):
+        return 'Item must be an object'
+    for field in ('body', 'post_id'):
+        if not item.get(field) or not isinstance(item[field], str):
+            return f'"{field}" is required'
+    for field in ('parent_id', 'user_id'):
+        if item.get(field) is not None and not _is_int(item[field]):
+            return f'"{field}" must be an integer'
+    for field in ('ref', 'parent_ref'):
+        if item.get(field) is not None and \
+                not (isinstance(item[field], str) or _is_int(item[field])):
+            return f'"{field}" must be a string or an integer'
+    if item.get('parent_ref') is not None and \
+            item.get('parent_id') is not None:
+        return 'Only one of "parent_ref" and "parent_id" can be given'
+    try:
+        item['created_at'] = _parse_created_at(item.get('created_at'))
+    except (TypeError, ValueError):
+        return '"created_at" must be an ISO 8601 datetime'
+    return None
+
+
+def _fetch_by_id(id_column, ids, *columns):
+    """Fetch rows by id in chunks, as a dict of id -> row."""
+    ids = list(ids)
+    rows = {}
+    for start in range(0, len(ids), 500):
+        rows.update(
+            (row[0], row) for row in db.session.execute(
+                select(id_column, *columns)
+                .where(id_column.in_(ids[start:start + 500]))
+            )
+        )
+    return rows
+
+
+class BatchInsert:
+    """
+    Insert many comments at once.
+    Items are dicts with "post_id", "body" and optional "user_id",
+    "created_at", "ref" and either "parent_id" (an existing comment) or
+    "parent_ref" (the "ref" of another item in the same batch).
+    Valid items are inserted with executemany in chunked transactions,
+    invalid ones are reported by their index.
+    """
+
+    def __init__(self, items, chunk_size=None):
+        self.items = items
+        self.chunk_size = chunk_size or current_app.config['BATCH_CHUNK_SIZE']
+        self.ids = [None] * len(items)
+        self.errors = {}
+        # index of an item -> index of its parent item in the batch
+        self.parent_items = {}
+        # id of a comment -> its materialized path
+        self.paths = {}
+
+    def fail(self, index, message):
+        self.errors.setdefault(index, message)
+
+    def run(self):
+        order = self._insert_order()
+        for start in range(0, len(order), self.chunk_size):
+            chunk = order[start:start + self.chunk_size]
+            try:
+                if chunk := [index for index in chunk
+                             if not self._parent_failed(index)]:
+                    self._insert_chunk(chunk)
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                current_app.logger.exception('Batch insert chunk failed')
+                for index in chunk:
+                    self.fail(index, f'Insert failed: {e.__class__.__name__}')
+        return self.report()
+
+    def report(self):
+        return {
+            'inserted': sum(id is not None for id in self.ids),
+            'ids': self.ids,
+            'errors': [
+                {'index': index, 'ref': self._ref(index), 'message': message}
+                for index, message in sorted(self.errors.items())
+            ],
+        }
+
+    def _ref(self, index):
+        item = self.items[index]
+        return item.get('ref') if isinstance(item, dict) else None
+
+    def _insert_order(self):
+        """
+        Validate items and order them so that parents come before replies.
+        :return: list of item indices in insert order
+        """
+        refs = {}
+        for index, item in enumerate(self.items):
+            if (error := _validate_item(item)) is not None:
+                self.fail(index, error)
+            elif (ref := item.get('ref')) is not None:
+                if ref in refs:
+                    self.fail(index, f'Duplicate ref {ref!r}')
+                else:
+                    refs[ref] = index
+
+        valid = [(index, item) for index, item in enumerate(self.items)
+                 if index not in self.errors]
+        parents = _fetch_by_id(
+            Comment.id,
+            {item['parent_id'] for _, item in valid
+             if item.get('parent_id') is not None},
+            Comment.post_id, Comment.path
+        )
+        users = _fetch_by_id(
+            User.id,
+            {item['user_id'] for _, item in valid
+             if item.get('user_id') is not None}
+        )
+        self.paths.update((id, row.path) for id, row in parents.items())
+
+        roots, children = [], defaultdict(list)
+        for index, item in valid:
+            if item.get('user_id') is not None and \
+                    item['user_id'] not in users:
+                self.fail(index, 'User not found')
+            elif (parent_ref := item.get('parent_ref')) is not None:
+                if parent_ref not in refs:
+                    self.fail(index, f'Unknown parent_ref {parent_ref!r}')
+                else:
+                    self.parent_items[index] = refs[parent_ref]
+                    children[refs[parent_ref]].append(index)
+            elif (parent_id := item.get('parent_id')) is not None:
+                if parent_id not in parents:
+                    self.fail(index, 'Parent comment not found')
+                elif parents[parent_id].post_id != item['post_id']:
+                    self.fail(index, 'Parent comment belongs to another post')
+                else:
+                    roots.append(index)
+            else:
+                roots.append(index)
+
+        # Breadth-first from items with a known parent, so that a parent
+        # is always inserted before its replies
+        order = []
+        queue = deque(roots)
+        while queue:
+            index = queue.popleft()
+            order.append(index)
+            post_id = self.items[index]['post_id']
+            for child in children.pop(index, ()):
+                if self.items[child]['post_id'] != post_id:
+                    self.fail(child, 'Parent item belongs to another post')
+                else:
+                    queue.append(child)
+
+        # Whatever is left is in a parent_ref cycle or under a failed item
+        for indices in children.values():
+            for index in indices:
+                self.fail(index, 'Parent item is not valid')
+        return [index for index in order if index not in self.errors]
+
+    def _insert_chunk(self, chunk):
+        """Insert one chunk of ordered items in a single transaction."""
+        counts = defaultdict(int)
+        for index in chunk:
+            counts[self.items[index]['post_id']] += 1
+
+        # Writing post_meta first takes the SQLite write lock, so the ids
+        # reserved below cannot be taken by another writer
+        PostMeta.touch_many(counts)
+        next_id = db.session.execute(select(func.max(Comment.id))).scalar()
+        next_id = (next_id or 0) + 1
+
+        rows, ids, paths = [], {}, {}
+        for id, index in enumerate(chunk, start=next_id):
+            item = self.items[index]
+            if index in self.parent_items:
+                parent_index = self.parent_items[index]
+                parent_id = self.ids[parent_index] or ids[parent_index]
+            else:
+                parent_id = item.get('parent_id')
+            path = paths.get(parent_id) or self.paths.get(parent_id, '')
+            path += path_segment(id)
+            ids[index] = id
+            paths[id] = path
+            rows.append({
+                'id': id,
+                'post_id': item['post_id'],
+                'body': item['body'],
+                'created_at': item['created_at'],
+                'user_id': item.get('user_id'),
+                'parent_id': parent_id,
+                'path': path,
+                'depth': path.count('/') - 1,
+            })
+
+        db.session.execute(insert(Comment.__table__), rows)
+        db.session.commit()
+
+        self.paths.update(paths)
+        for index, id in ids.items():
+            self.ids[index] = id
+        for post_id in counts:
+            thread_changed(post_id)
+
+    def _parent_failed(self, index):
+        parent_index = self.parent_items.get(index)
+        if parent_index is not None and parent_index in self.errors:
+            self.fail(index, 'Parent item was not inserted')
+            return True
+        return False
@@ -0,0 +1,166 @@
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import bindparam, delete, exists, select, text, update
+from sqlalchemy.orm import aliased
+
+from app.models import Comment, Contact, PostMeta, comment_fts
+
+
+def _cutoff(days):
+    return (datetime.now(timezone.utc).replace(tzinfo=None)
+            - timedelta(days=days))
+
+
+class Retention:
+    """
+    Remove old rows from the hot tables: read contact messages and
+    comments whose author was deleted. Orphaned comments are removed only
+    once they have no replies left, so replies of other users are never
+    deleted with them.
+    Rows are removed in transactions of batch_size rows, taken with
+    BEGIN IMMEDIATE and `pause` seconds apart, so the write lock is never
+    held for long. With an archive, rows are copied to tables of the same
+    name in that SQLite file before they are deleted.
+    """
+
+    def __init__(self, engine, batch_size, pause=0, archive=None):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.pause = pause
+        self.archive = archive
+
+    def run(self, contacts_days=None, comments_days=None, vacuum=False,
+            analyze=False):
+        """
+        Apply the retention policies, None days keeps the rows forever.
+        :return: dict with the number of removed contacts and comments and
+            of bytes reclaimed in the database file
+        """
+        report = {'contacts': 0, 'comments': 0}
+        with self.engine.connect() as connection:
+            connection = connection.execution_options(
+                isolation_level='AUTOCOMMIT')
+            used_before = self._used_bytes(connection)
+            if self.archive:
+                self._attach_archive(connection)
+            try:
+                if contacts_days is not None:
+                    report['contacts'] = self._purge(
+                        connection, Contact.__table__,
+                        self._contacts_batch(_cutoff(contacts_days)))
+                if comments_days is not None:
+                    report['comments'] = self._purge(
+                        connection, Comment.__table__,
+                        self._comments_batch(_cutoff(comments_days)),
+                        self._update_post_meta)
+            finally:
+                if self.archive:
+                    connection.exec_driver_sql('DETACH DATABASE archive')
+
+            if vacuum:
+                # Merge the segments of the full-text index left by
+                # deletes before the file is rebuilt
+                connection.exec_driver_sql(
+                    f"INSERT INTO {comment_fts.name} ({comment_fts.name}) "
+                    f"VALUES ('optimize')")
+                connection.exec_driver_sql('VACUUM')
+            if analyze:
+                connection.exec_driver_sql('ANALYZE')
+            report['bytes'] = used_before - self._used_bytes(connection)
+        return report
+
+    def _contacts_batch(self, cutoff):
+        return (
+            select(Contact.id)
+            .where(Contact.is_read == True, Contact.created_at < cutoff)
+            .limit(self.batch_size)
+        )
+
+    def _comments_batch(self, cutoff):
+        reply = aliased(Comment)
+        return (
+            select(Comment.id, Comment.post_id)
+            .where(Comment.orphaned_at < cutoff,
+                   ~exists().where(reply.parent_id == Comment.id))
+            .limit(self.batch_size)
+        )
+
+    def _purge(self, connection, table, batch, after_delete=None):
+        """Delete the rows selected by batch until there are none left."""
+        removed = 0
+        while True:
+            connection.exec_driver_sql('BEGIN IMMEDIATE')
+            try:
+                rows = connection.execute(batch).all()
+                if rows:
+                    ids = [row.id for row in rows]
+                    if self.archive:
+                        self._copy_to_archive(connection, table, ids)
+                    connection.execute(
+                        delete(table).where(table.c.id.in_(ids)))
+                    if after_delete is not None:
+                        after_delete(connection, rows)
+                connection.exec_driver_sql('COMMIT')
+            except BaseException:
+                connection.exec_driver_sql('ROLLBACK')
+                raise
+            if not rows:
+                return removed
+            removed += len(rows)
+            time.sleep(self.pause)
+
+    def _update_post_meta(self, connection, rows):
+        table = PostMeta.__table__
+        counts = Counter(row.post_id for row in rows)
+        connection.execute(
+            update(table)
+            .where(table.c.post_id == bindparam('b_post_id'))
+            .values(version=table.c.version + 1,
+                    comment_count=table.c.comment_count
+                    - bindparam('b_removed')),
+            [{'b_post_id': post_id, 'b_removed': removed}
+             for post_id, removed in counts.items()]
+        )
+
+    def _attach_archive(self, connection):
+        connection.execute(text('ATTACH DATABASE :path AS archive'),
+                           {'path': self.archive})
+        for table in (Contact.__table__, Comment.__table__):
+            connection.exec_driver_sql(
+                f'CREATE TABLE IF NOT EXISTS archive.{table.name} AS '
+                f'SELECT * FROM main.{table.name} WHERE 0')
+            # Columns added by migrations since the archive was created
+            archived = self._columns(connection, 'archive', table.name)
+            for name, type_ in self._columns(connection, 'main',
+                                             table.name).items():
+                if name not in archived:
+                    connection.exec_driver_sql(
+                        f'ALTER TABLE archive.{table.name} '
+                        f'ADD COLUMN "{name}" {type_}')
+
+    def _copy_to_archive(self, connection, table, ids):
+        columns = ', '.join(table.columns.keys())
+        connection.execute(
+            text(f'INSERT INTO archive.{table.name} ({columns}) '
+                 f'SELECT {columns} FROM main.{table.name} '
+                 f'WHERE id IN :ids')
+            .bindparams(bindparam('ids', expanding=True)),
+            {'ids': ids}
+        )
+
+    @staticmethod
+    def _columns(connection, schema, table):
+        """Return a dict of column name -> declared type of a table."""
+        return {row[1]: row[2] for row in connection.exec_driver_sql(
+            f'PRAGMA {schema}.table_info({table})')}
+
+    @staticmethod
+    def _used_bytes(connection):
+        """Size of the database pages in use, free pages excluded."""
+        page_count, freelist_count, page_size = (
+            connection.exec_driver_sql(f'PRAGMA {name}').scalar()
+            for name in ('page_count', 'freelist_count', 'page_size')
+        )
+        return (page_count - freelist_count) * page_size
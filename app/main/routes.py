@@ -1,38 +1,266 @@
-from flask import abort, jsonify, request
+from flask import (abort, current_app, jsonify, make_response, request,
+                   stream_with_context)
 
 from app import db
 from app.auth.tokens import token_required
-from app.models import Comment, Contact
+from app.models import Comment, Contact, PostMeta
+from app.utils.metrics import metrics
+from app.utils.pagination import decode_rank_cursor, is_paginated, page_args
+from app.utils.replica import read_replica
 
 from . import bp
+from .contacts import (contact_filters, delete_contacts, load_inbox,
+                       mark_read, unread_count)
+from .ingest import BatchInsert
+from .search import match_query, search_comments
+from .threads import (count_comments, load_replies_page, load_thread,
+                      load_thread_page, stream_threads, thread_cache,
+                      thread_changed, thread_etag, truncate_thread,
+                      truncation_args, with_ago)
+from .writer import comment_writer
+
+
+def load_comments(post_id=None):
+    """
+    Load serialized comments, only one page if pagination is requested.
+    :return: tuple (comments, next_cursor)
+    :raises ValueError: if pagination parameters are not valid
+    """
+    if is_paginated():
+        limit, cursor = page_args()
+        return load_thread_page(post_id, limit, cursor)
+    return load_thread(post_id), None
+
+
+def load_cached_comments(post_id, version):
+    """
+    Same as load_comments, but served from the thread cache if possible.
+    Entries are keyed by the version of the post, so a change made by
+    another process or read from a lagging replica is never served from
+    an entry of another version.
+    """
+    cache = thread_cache()
+    key = (post_id, version, request.args.get('limit'),
+           request.args.get('cursor'))
+    cached = cache.get(key)
+    if cached is None:
+        generation = cache.generation(post_id)
+        cached = load_comments(post_id)
+        cache.set(key, cached, group=post_id, generation=generation)
+    return cached
+
+
+def comments_response(comments, next_cursor, empty_message):
+    comments = with_ago(comments)
+    if is_paginated():
+        return jsonify({'comments': comments, 'next_cursor': next_cursor}), 200
+    if not comments:
+        return jsonify({'message': empty_message}), 200
+    return jsonify(comments), 200
+
+
+def streamed_comments(format):
+    """
+    Stream all comments as a JSON array or as newline delimited JSON.
+    """
+    dumps = current_app.json.dumps
+    comments = stream_threads(current_app.config['STREAM_CHUNK_SIZE'])
+
+    def generate_json():
+        yield '['
+        for index, comment in enumerate(comments):
+            yield (',' if index else '') + dumps(with_ago([comment])[0])
+        yield ']'
+
+    def generate_ndjson():
+        for comment in comments:
+            yield dumps(with_ago([comment])[0]) + '\n'
+
+    if format == 'ndjson':
+        return current_app.response_class(
+            stream_with_context(generate_ndjson()),
+            mimetype='application/x-ndjson'
+        )
+    return current_app.response_class(stream_with_context(generate_json()),
+                                      mimetype='application/json')
 
 
 @bp.route('/')
 @token_required
+@read_replica
 def commetns(*args, **kwargs):
     """Get all comments"""
-    top_level_comments = Comment.query.filter(Comment.parent_id == None).all()
-    serialized_comments = [comment.to_dict() for comment in top_level_comments]
-    if not serialized_comments:
-        return jsonify(
-            {'message': 'There are no any comments yet!'}
-        ), 200
+    if stream := request.args.get('stream'):
+        if stream not in ('json', 'ndjson'):
+            return jsonify({
+                'message': '"stream" must be "json" or "ndjson"'
+            }), 400
+        return streamed_comments(stream)
+
+    try:
+        truncation = truncation_args()
+        comments, next_cursor = load_comments()
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
 
-    return jsonify(serialized_comments), 200
+    return comments_response(truncate_thread(comments, *truncation),
+                             next_cursor, 'There are no any comments yet!')
 
 
 @bp.route('/<string:post_id>')
+@read_replica
 def post_comments(post_id):
-    """Get all comments for a specific post."""
-    top_level_comments = Comment.query.filter(Comment.post_id == post_id,
-                                              Comment.parent_id == None).all()
-    serialized_comments = [comment.to_dict() for comment in top_level_comments]
-    if not serialized_comments:
-        return jsonify(
-            {'message': 'There are no any comments for this post yet!'}
-        ), 200
+    """
+    Get all comments for a specific post.
+    Deep or wide threads can be cut with "max_depth" and "max_replies",
+    see truncate_thread.
+    """
+    version = PostMeta.get_version(post_id)
+    etag = thread_etag(version, request.query_string)
+    if request.if_none_match.contains_weak(etag):
+        return thread_response(etag)
+    try:
+        truncation = truncation_args()
+        page = load_cached_comments(post_id, version)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    return thread_response(etag, page, truncation)
+
+
+def thread_response(etag, page=None, truncation=()):
+    """
+    Build the response of a post thread, also used by app.asgi.
+    :param page: tuple (comments, next_cursor), None for 304 Not Modified
+    :param truncation: arguments of truncate_thread
+    """
+    if page is None:
+        response = make_response('', 304)
+    else:
+        comments, next_cursor = page
+        if (collector := metrics()) is not None:
+            collector.observe_thread(count_comments(comments))
+        response = make_response(comments_response(
+            truncate_thread(comments, *truncation), next_cursor,
+            'There are no any comments for this post yet!'
+        ))
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@bp.route('/<int:comment_id>/replies')
+@read_replica
+def comment_replies(comment_id):
+    """
+    Get one page of replies to a comment, together with their replies.
+    Takes the "limit" and "cursor" pagination parameters and the
+    "max_depth" and "max_replies" parameters of the thread endpoints.
+    """
+    try:
+        limit, cursor = page_args()
+        truncation = truncation_args()
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    comment = db.session.get(Comment, comment_id)
+    if comment is None:
+        return jsonify({'message': 'Comment not found'}), 404
 
-    return jsonify(serialized_comments), 200
+    # Keyed by the post version like load_cached_comments
+    cache = thread_cache()
+    key = ('replies', comment_id, PostMeta.get_version(comment.post_id),
+           request.args.get('limit'), request.args.get('cursor'))
+    cached = cache.get(key)
+    if cached is None:
+        generation = cache.generation(comment.post_id)
+        cached = load_replies_page(comment, limit, cursor)
+        cache.set(key, cached, group=comment.post_id, generation=generation)
+    replies, next_cursor = cached
+
+    return jsonify({
+        'replies': with_ago(truncate_thread(replies, *truncation)),
+        'next_cursor': next_cursor
+    }), 200
+
+
+def check_post_ids(post_ids, max_posts):
+    """Return an error message if post ids of a counts request are invalid."""
+    if not post_ids or not isinstance(post_ids, list):
+        return 'At least one post_id is required'
+    if len(post_ids) > max_posts:
+        return f'At most {max_posts} post ids are allowed'
+    return None
+
+
+@bp.route('/counts', methods=['GET', 'POST'])
+@read_replica
+def comment_counts():
+    """
+    Get number of comments for many posts at once.
+    Post ids are given as repeated "post_id" query parameters or as a
+    "post_ids" list in the JSON body.
+    """
+    if request.method == 'POST':
+        post_ids = (request.get_json() or {}).get('post_ids')
+    else:
+        post_ids = request.args.getlist('post_id')
+
+    if error := check_post_ids(post_ids,
+                               current_app.config['COUNTS_MAX_POSTS']):
+        return jsonify({'message': error}), 400
+
+    return jsonify(PostMeta.get_counts([str(id) for id in post_ids])), 200
+
+
+@bp.route('/search')
+@read_replica
+def search():
+    """
+    Search comment bodies, best matches first.
+    Takes the words to search for in "q", an optional "post_id" and the
+    usual "limit" and "cursor" pagination parameters.
+    """
+    query = match_query(request.args.get('q', ''))
+    if not query:
+        return jsonify({'message': '"q" is required'}), 400
+    try:
+        limit, cursor = page_args(decode_rank_cursor)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    comments, next_cursor = search_comments(
+        query, request.args.get('post_id'), limit, cursor)
+    return jsonify({'comments': comments, 'next_cursor': next_cursor}), 200
+
+
+@bp.route('/cache-stats')
+@token_required
+def cache_stats(*args, **kwargs):
+    """Get hit/miss counters of the thread cache"""
+    if not kwargs.get('user').is_admin:
+        return jsonify({'message': 'You are not authorized'}), 401
+
+    return jsonify(thread_cache().stats()), 200
+
+
+def queue_comment(writer, data):
+    """Create a new comment through the write-behind queue."""
+    pending = writer.submit({
+        key: data.get(key) for key in ('post_id', 'body', 'parent_id',
+                                       'user_id')
+    })
+    if current_app.config['COMMENT_WRITE_MODE'] == 'wait' and pending.wait(
+            current_app.config['WRITE_BEHIND_WAIT_TIMEOUT']):
+        if pending.error:
+            return jsonify({'message': pending.error}), 400
+        comment = db.session.get(Comment, pending.id)
+        return jsonify(comment.to_dict()), 201
+
+    return jsonify({
+        'message': 'Comment accepted',
+        'provisional_id': pending.provisional_id
+    }), 202
 
 
 @bp.route('/new', methods=['POST'])
@@ -45,13 +273,61 @@ def create_new_comment():
             'message': 'Invalid request data. "body" and "post_id" are required.'
         }), 400
 
+    parent_id = data.get('parent_id')
+    if parent_id is not None and db.session.get(Comment, parent_id) is None:
+        return jsonify({'message': 'Parent comment not found'}), 400
+
+    if (writer := comment_writer()) is not None:
+        return queue_comment(writer, data)
+
     comment = Comment(**data)
     db.session.add(comment)
+    PostMeta.touch(comment.post_id, count_delta=1)
     db.session.commit()
+    thread_changed(comment.post_id)
 
     return jsonify(comment.to_dict()), 201
 
 
+@bp.route('/batch', methods=['POST'])
+@token_required
+def create_comments_batch(*args, **kwargs):
+    """
+    Create many comments at once, e.g. when importing from another blog.
+    Replies can reference their parent in the same batch by "parent_ref".
+    """
+    if not kwargs.get('user').is_admin:
+        return jsonify({'message': 'You are not authorized'}), 401
+
+    data = request.get_json()
+    items = data.get('comments') if isinstance(data, dict) else data
+    max_items = current_app.config['BATCH_MAX_ITEMS']
+    if not items or not isinstance(items, list):
+        return jsonify({'message': '"comments" list is required'}), 400
+    if len(items) > max_items:
+        return jsonify({
+            'message': f'At most {max_items} comments are allowed'
+        }), 400
+
+    report = BatchInsert(items).run()
+    return jsonify(report), 201 if report['inserted'] else 400
+
+
+@bp.route('/pending/<string:provisional_id>')
+def pending_comment(provisional_id):
+    """Get the outcome of a comment accepted by the write-behind queue."""
+    writer = comment_writer()
+    pending = writer.results.get(provisional_id) if writer else None
+    if pending is None:
+        return jsonify({'message': 'Pending comment not found'}), 404
+
+    if not pending.done:
+        return jsonify({'status': 'pending'}), 200
+    if pending.error:
+        return jsonify({'status': 'failed', 'message': pending.error}), 200
+    return jsonify({'status': 'created', 'id': pending.id}), 200
+
+
 @bp.route('/<int:comment_id>/update', methods=['PUT'])
 @token_required
 def update_comment(comment_id, *args, **kwargs):
@@ -73,7 +349,9 @@ def update_comment(comment_id, *args, **kwargs):
         return jsonify({'message': 'Comment not found'}), 404
 
     comment.body = data['body']
+    PostMeta.touch(comment.post_id)
     db.session.commit()
+    thread_changed(comment.post_id)
 
     return jsonify(comment.to_dict()), 200
 
@@ -93,8 +371,13 @@ def delete_comment(comment_id, *args, **kwargs):
     if comment is None:
         return jsonify({'message': 'Comment not found'}), 404
 
+    post_id = comment.post_id
+    # Replies are deleted together with the comment
+    removed = 1 + comment.descendants_count()
     db.session.delete(comment)
+    PostMeta.touch(post_id, count_delta=-removed)
     db.session.commit()
+    thread_changed(post_id)
 
     return jsonify({'message': 'Comment deleted successfully'}), 200
 
@@ -124,17 +407,87 @@ def contact_me():
 @bp.route('/contacts')
 @token_required
 def contacts(*args, **kwargs):
+    """
+    Get contact messages, newest first.
+    Takes the "status" (unread by default), "email", "since" and "until"
+    filters. With the "limit" and "cursor" pagination parameters, one
+    page is returned together with the number of unread messages.
+    """
     is_admin_user = kwargs.get('user').is_admin
     if not is_admin_user:
         return jsonify({'message': 'You are not authorized'}), 401
 
-    contacts = Contact.query.filter_by(is_read=False).order_by(
-        Contact.created_at.desc()).all()
-    return jsonify(contacts), 200
+    filters = {key: request.args.get(key)
+               for key in ('status', 'email', 'since', 'until')}
+    try:
+        limit, cursor = page_args() if is_paginated() else (None, None)
+        conditions = contact_filters(
+            filters, current_app.config['CONTACTS_MAX_IDS'], 'unread')
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    contacts, next_cursor = load_inbox(conditions, limit, cursor)
+    if not is_paginated():
+        return jsonify(contacts), 200
+    return jsonify({
+        'contacts': contacts,
+        'next_cursor': next_cursor,
+        'unread_count': unread_count()
+    }), 200
+
+
+def bulk_contact_filters():
+    """
+    Read the filters of a bulk contact request from the JSON body.
+    :return: tuple (conditions, error message or None)
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return None, 'JSON object with "ids" or filters is required'
+    try:
+        conditions = contact_filters(data,
+                                     current_app.config['CONTACTS_MAX_IDS'])
+    except ValueError as e:
+        return None, str(e)
+    # A request without filters would change every message, empty ones
+    # and status "all" included
+    if not conditions:
+        return None, 'At least one of "ids" or the filters is required'
+    return conditions, None
+
+
+@bp.route('/contacts/read', methods=['POST'])
+@token_required
+def mark_contacts_as_read(*args, **kwargs):
+    """Mark the messages selected by ids or filters as read."""
+    if not kwargs.get('user').is_admin:
+        return jsonify({'message': 'You are not authorized'}), 401
+
+    conditions, error = bulk_contact_filters()
+    if error:
+        return jsonify({'message': error}), 400
+    return jsonify({'updated': mark_read(conditions)}), 200
+
+
+@bp.route('/contacts/delete', methods=['POST'])
+@token_required
+def delete_contacts_bulk(*args, **kwargs):
+    """Delete the messages selected by ids or filters."""
+    if not kwargs.get('user').is_admin:
+        return jsonify({'message': 'You are not authorized'}), 401
+
+    conditions, error = bulk_contact_filters()
+    if error:
+        return jsonify({'message': error}), 400
+    return jsonify({'deleted': delete_contacts(conditions)}), 200
 
 
 @bp.route('/read-contact/<int:contact_id>')
-def mark_contact_as_read(contact_id):
+@token_required
+def mark_contact_as_read(contact_id, *args, **kwargs):
+    if not kwargs.get('user').is_admin:
+        return jsonify({'message': 'You are not authorized'}), 401
+
     contact = Contact.query.filter_by(id=contact_id).first()
 
     if contact:
@@ -145,12 +498,16 @@ def mark_contact_as_read(contact_id):
     return jsonify({'message': 'Contact not found'}), 404
 
 
-@bp.route('/delete-contact/<int:contact_id>')
-def delete_contact(contact_id):
+@bp.route('/delete-contact/<int:contact_id>', methods=['DELETE'])
+@token_required
+def delete_contact(contact_id, *args, **kwargs):
+    if not kwargs.get('user').is_admin:
+        return jsonify({'message': 'You are not authorized'}), 401
+
     contact = Contact.query.filter_by(id=contact_id).first()
 
     if contact:
-        contact.is_read = True
+        db.session.delete(contact)
         db.session.commit()
         return jsonify({'message': 'Success!'}), 200
 
@@ -0,0 +1,78 @@
+from sqlalchemy import and_, func, literal_column, or_
+
+from app import db
+from app.models import Comment, comment_fts
+from app.utils.pagination import encode_rank_cursor
+from app.utils.timesince import timesince
+
+from .threads import comments_statement
+
+
+def match_query(text):
+    """
+    Build an FTS5 query that matches comments containing all given words.
+    Every word is quoted, so the FTS5 query syntax can not be used (or
+    broken) by clients. A trailing "*" makes a word a prefix.
+    :return: str, empty if there are no words
+    """
+    terms = []
+    for word in text.split():
+        prefix = word.endswith('*')
+        word = word.rstrip('*').replace('"', '""')
+        if word:
+            terms.append(f'"{word}"' + ('*' if prefix else ''))
+    return ' '.join(terms)
+
+
+def search_statement(query, post_id=None):
+    """
+    Select comments matching an FTS5 query, best matches first.
+    :return: tuple (select statement, rank expression)
+    """
+    fts = literal_column(comment_fts.name)
+    rank = func.bm25(fts)
+    stmt = (
+        comments_statement()
+        .add_columns(rank.label('rank'))
+        .join(comment_fts, comment_fts.c.rowid == Comment.id)
+        .where(fts.op('MATCH')(query))
+    )
+    if post_id is not None:
+        stmt = stmt.where(Comment.post_id == post_id)
+    return stmt, rank
+
+
+def search_comments(query, post_id=None, limit=20, cursor=None):
+    """
+    Load one page of comments matching an FTS5 query.
+    Pages are ordered by (rank, id) and continue after the cursor, like
+    keyset_page does for threads.
+    :return: tuple (serialized comments, next_cursor or None)
+    """
+    stmt, rank = search_statement(query, post_id)
+    if cursor is not None:
+        last_rank, last_id = cursor
+        stmt = stmt.where(or_(
+            rank > last_rank,
+            and_(rank == last_rank, Comment.id > last_id)
+        ))
+    stmt = stmt.order_by(rank, Comment.id).limit(limit + 1)
+    rows = db.session.execute(stmt).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_rank_cursor(rows[-1].rank, rows[-1].id)
+    return [
+        {
+            'id': row.id,
+            'post_id': row.post_id,
+            'parent_id': row.parent_id,
+            'body': row.body,
+            'created_at': row.created_at,
+            'user': row.username or 'Anonymous',
+            'ago': timesince(row.created_at),
+            'rank': row.rank,
+        }
+        for row in rows
+    ], next_cursor
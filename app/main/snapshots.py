@@ -0,0 +1,187 @@
+import atexit
+import gzip
+import os
+import queue
+import tempfile
+import threading
+import time
+from urllib.parse import quote
+
+from flask import current_app
+from sqlalchemy import bindparam, or_, select, update
+
+from app import db
+from app.models import PostMeta
+
+from .threads import load_thread
+
+# Longest file name of a snapshot without the extensions
+MAX_NAME_LENGTH = 200
+
+
+def snapshot_name(post_id):
+    """
+    Return the file name of a post snapshot without the extension, or
+    None if the post id is too long for a file name. Characters other
+    than letters, digits and "-_.~" are percent-encoded.
+    """
+    name = quote(post_id, safe='-_.~')
+    if name.startswith('.'):
+        name = '%2E' + name[1:]
+    return name if len(name) <= MAX_NAME_LENGTH else None
+
+
+def _write_atomic(path, data):
+    # A temporary file of its own, exports of other threads and processes
+    # may write the same snapshot at the same time
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path),
+                                     suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def write_snapshot(directory, post_id, version):
+    """
+    Write the thread of a post to <name>.json and <name>.json.gz.
+    Files are replaced atomically, readers never see a partial file.
+    The gzip copy has no timestamp, so unchanged threads give the same
+    bytes (and ETags).
+    :return: True if the snapshot was written
+    """
+    name = snapshot_name(post_id)
+    if name is None:
+        current_app.logger.warning('Post id too long for a snapshot: %s',
+                                   post_id)
+        return False
+    comments = load_thread(post_id)
+    data = current_app.json.dumps({
+        'post_id': post_id,
+        'version': version,
+        'comments': comments,
+    }).encode()
+    path = os.path.join(directory, f'{name}.json')
+    _write_atomic(path, data)
+    _write_atomic(f'{path}.gz', gzip.compress(data, mtime=0))
+    return True
+
+
+def export_snapshots(directory, post_ids=None, full=False, chunk_size=500):
+    """
+    Write snapshots of the posts whose comments changed since their last
+    snapshot, per the version of PostMeta, or of every post if `full`.
+    The version is read before the thread, so a write in between only
+    makes the next export write the snapshot again. The recorded version
+    never goes back, when exports overlap the newest one wins.
+    :param post_ids: only consider these posts
+    :return: number of written snapshots
+    """
+    os.makedirs(directory, exist_ok=True)
+    stmt = select(PostMeta.post_id, PostMeta.version)
+    if not full:
+        stmt = stmt.where(or_(PostMeta.snapshot_version == None,
+                              PostMeta.snapshot_version != PostMeta.version))
+    if post_ids is not None:
+        stmt = stmt.where(PostMeta.post_id.in_(post_ids))
+    posts = db.session.execute(stmt.order_by(PostMeta.post_id)).all()
+
+    written = 0
+    for start in range(0, len(posts), chunk_size):
+        exported = []
+        for post_id, version in posts[start:start + chunk_size]:
+            if write_snapshot(directory, post_id, version):
+                exported.append({'b_post_id': post_id, 'b_version': version})
+        if exported:
+            table = PostMeta.__table__
+            db.session.execute(
+                update(table)
+                .where(table.c.post_id == bindparam('b_post_id'),
+                       or_(table.c.snapshot_version == None,
+                           table.c.snapshot_version
+                           < bindparam('b_version')))
+                .values(snapshot_version=bindparam('b_version')),
+                exported
+            )
+        db.session.commit()
+        written += len(exported)
+    return written
+
+
+class SnapshotWriter:
+    """
+    Regenerate snapshots of posts after comment writes.
+    Changed posts are queued and exported by a background thread `delay`
+    seconds later, so a burst of writes on one post writes its snapshot
+    once. Queued posts are exported before the process exits.
+    """
+
+    def __init__(self, app, directory, delay):
+        self.app = app
+        self.directory = directory
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._stopped = False
+
+    def _start(self):
+        # Started by the first write of every process, threads of a
+        # process that created the app do not survive a fork into workers
+        self._pid = os.getpid()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='snapshot-writer')
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def submit(self, post_id):
+        with self._lock:
+            if self._stopped:
+                return
+            if self._pid != os.getpid():
+                self._start()
+            self._queue.put(post_id)
+
+    def stop(self):
+        """Export queued posts and stop the background thread."""
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            running = self._pid == os.getpid()
+        if running:
+            self._queue.put(None)
+            self._thread.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            post_id = self._queue.get()
+            if post_id is None:
+                break
+            post_ids = {post_id}
+            deadline = time.monotonic() + self.delay
+            while True:
+                timeout = deadline - time.monotonic()
+                try:
+                    post_id = self._queue.get(timeout=max(timeout, 0))
+                except queue.Empty:
+                    break
+                if post_id is None:
+                    stopping = True
+                    break
+                post_ids.add(post_id)
+            self._export(post_ids)
+
+    def _export(self, post_ids):
+        try:
+            with self.app.app_context():
+                export_snapshots(self.directory, post_ids=list(post_ids))
+        except Exception:
+            self.app.logger.exception('Writing snapshots failed')
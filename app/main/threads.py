@@ -0,0 +1,286 @@
+import zlib
+
+from flask import current_app, request
+from sqlalchemy import and_, or_, select, union_all
+
+from app import db
+from app.models import Comment, User, path_range
+from app.utils.pagination import encode_cursor, keyset_page, split_page
+from app.utils.timesince import timesince
+
+# Most path ranges ORed in one SELECT of descendants_statement
+MAX_PATH_RANGES = 500
+
+
+def comments_statement():
+    """Select comment columns together with the author name."""
+    return (
+        select(Comment.id, Comment.post_id, Comment.body, Comment.created_at,
+               Comment.parent_id, Comment.path, Comment.depth,
+               User.username)
+        .outerjoin(User, Comment.user_id == User.id)
+    )
+
+
+def thread_statement(post_id=None):
+    """
+    Select every comment of a post (or of all posts if post_id is None).
+    Rows come back flat, the reply tree is built in memory.
+    """
+    stmt = comments_statement()
+    if post_id is not None:
+        stmt = stmt.where(Comment.post_id == post_id)
+    return stmt.order_by(Comment.created_at, Comment.id)
+
+
+def roots_statement(post_id=None):
+    """Select top-level comments of a post (or of all posts)."""
+    stmt = comments_statement().where(Comment.parent_id == None)
+    if post_id is not None:
+        stmt = stmt.where(Comment.post_id == post_id)
+    return stmt
+
+
+def replies_statement(parent_id):
+    """Select direct replies of a comment."""
+    return comments_statement().where(Comment.parent_id == parent_id)
+
+
+def descendants_statement(paths):
+    """
+    Select all replies, on any level, of the comments with given paths.
+    Every subtree is one range of the path index. SQLite parses a chain
+    of ORs as a tree it only allows to be 1000 deep, so more than
+    MAX_PATH_RANGES subtrees are selected by a UNION ALL of SELECTs.
+    """
+    selects = []
+    for start in range(0, len(paths), MAX_PATH_RANGES):
+        ranges = []
+        for path in paths[start:start + MAX_PATH_RANGES]:
+            lower, upper = path_range(path)
+            ranges.append(and_(Comment.path > lower, Comment.path < upper))
+        selects.append(comments_statement().where(or_(*ranges)))
+    if len(selects) == 1:
+        return selects[0].order_by(Comment.created_at, Comment.id)
+    subtrees = union_all(*selects).subquery()
+    return (
+        select(*subtrees.c)
+        .order_by(subtrees.c.created_at, subtrees.c.id)
+    )
+
+
+def serialize_row(row):
+    """
+    Serialize a single comment row the same way as Comment.to_dict,
+    except for the relative "ago" field which is added by with_ago.
+    """
+    return {
+        'id': row.id,
+        'post_id': row.post_id,
+        'body': row.body,
+        'created_at': row.created_at,
+        'user': row.username or 'Anonymous',
+        'replies': [],
+    }
+
+
+def with_ago(comments):
+    """
+    Return a copy of serialized comments with the "ago" field computed now.
+    Serialized threads are cached without it, so it never gets stale.
+    """
+    return [
+        {**comment, 'ago': timesince(comment['created_at']),
+         'replies': with_ago(comment['replies'])}
+        for comment in comments
+    ]
+
+
+def count_comments(comments):
+    """Count serialized comments together with their nested replies."""
+    return sum(1 + count_comments(comment['replies'])
+               for comment in comments)
+
+
+def truncation_args(args=None):
+    """
+    Read and validate the "max_depth" and "max_replies" query parameters.
+    :param args: query parameters, by default those of the current request
+    :return: tuple (max_depth or None, max_replies or None)
+    :raises ValueError: if a parameter is not valid
+    """
+    args = request.args if args is None else args
+    values = []
+    for name in ('max_depth', 'max_replies'):
+        value = args.get(name)
+        if value is not None:
+            try:
+                value = int(value)
+            except ValueError:
+                raise ValueError(f'"{name}" must be an integer') from None
+            if value < 0:
+                raise ValueError(f'"{name}" must not be negative')
+        values.append(value)
+    return tuple(values)
+
+
+def truncate_thread(comments, max_depth=None, max_replies=None, depth=0):
+    """
+    Return a copy of serialized comments with at most max_depth levels of
+    replies and at most max_replies replies per comment.
+    Every comment gets "reply_count", the number of its direct replies,
+    and "has_more", true if some of them were left out. The rest can be
+    loaded from /<comment_id>/replies, starting at "replies_cursor".
+    Comments are returned as they are if there are no limits.
+    """
+    if max_depth is None and max_replies is None:
+        return comments
+    truncated = []
+    for comment in comments:
+        replies = comment['replies']
+        if max_depth is not None and depth >= max_depth:
+            shown = []
+        else:
+            shown = replies[:max_replies]
+        has_more = len(shown) < len(replies)
+        if has_more and shown:
+            cursor = encode_cursor(shown[-1]['created_at'], shown[-1]['id'])
+        else:
+            cursor = None
+        truncated.append({
+            **comment,
+            'replies': truncate_thread(shown, max_depth, max_replies,
+                                       depth + 1),
+            'reply_count': len(replies),
+            'has_more': has_more,
+            'replies_cursor': cursor,
+        })
+    return truncated
+
+
+def build_thread(rows, parent_id=None):
+    """
+    Build the nested reply tree from flat comment rows.
+    :param rows: iterable of rows selected by one of the statements above
+    :param parent_id: id of the comment whose replies are the top level
+        of the tree, None for top-level comments of posts
+    :return: list of serialized top-level comments with nested replies
+    """
+    nodes = {}
+    parents = []
+    for row in rows:
+        nodes[row.id] = serialize_row(row)
+        parents.append((row.id, row.parent_id))
+
+    roots = []
+    for comment_id, comment_parent_id in parents:
+        if comment_parent_id == parent_id:
+            roots.append(nodes[comment_id])
+        elif comment_parent_id in nodes:
+            nodes[comment_parent_id]['replies'].append(nodes[comment_id])
+    return roots
+
+
+def thread_cache():
+    """Return the cache of serialized threads, grouped by post_id."""
+    return current_app.extensions['thread_cache']
+
+
+def thread_changed(post_id):
+    """
+    Drop the cached thread of a post after a committed comment write and
+    queue its snapshot, if snapshots are regenerated on writes.
+    """
+    thread_cache().invalidate(post_id)
+    if (writer := current_app.extensions.get('snapshot_writer')) is not None:
+        writer.submit(post_id)
+
+
+def load_thread(post_id=None):
+    """Load and serialize the whole comment thread of a post in one query."""
+    rows = db.session.execute(thread_statement(post_id))
+    return build_thread(rows)
+
+
+def load_thread_page(post_id=None, limit=None, cursor=None):
+    """
+    Load one page of top-level comments with all of their replies.
+    Uses two queries regardless of the page number or thread size.
+    :return: tuple (serialized comments, next_cursor or None)
+    """
+    stmt = keyset_page(roots_statement(post_id), Comment.created_at,
+                       Comment.id, limit, cursor)
+    roots, next_cursor = split_page(db.session.execute(stmt), limit)
+    if not roots:
+        return [], next_cursor
+
+    replies = db.session.execute(
+        descendants_statement([root.path for root in roots])
+    )
+    return build_thread([*roots, *replies]), next_cursor
+
+
+def load_replies_page(comment, limit, cursor=None):
+    """
+    Load one page of direct replies to a comment with all of their
+    replies, in two queries like load_thread_page.
+    :return: tuple (serialized replies, next_cursor or None)
+    """
+    stmt = keyset_page(replies_statement(comment.id), Comment.created_at,
+                       Comment.id, limit, cursor)
+    replies, next_cursor = split_page(db.session.execute(stmt), limit)
+    if not replies:
+        return [], next_cursor
+
+    descendants = db.session.execute(
+        descendants_statement([reply.path for reply in replies])
+    )
+    return (build_thread([*replies, *descendants], parent_id=comment.id),
+            next_cursor)
+
+
+async def load_thread_async(connection, post_id=None):
+    """Same as load_thread, on an asyncio connection."""
+    return build_thread(await connection.execute(thread_statement(post_id)))
+
+
+async def load_thread_page_async(connection, post_id=None, limit=None,
+                                 cursor=None):
+    """Same as load_thread_page, on an asyncio connection."""
+    stmt = keyset_page(roots_statement(post_id), Comment.created_at,
+                       Comment.id, limit, cursor)
+    roots, next_cursor = split_page(await connection.execute(stmt), limit)
+    if not roots:
+        return [], next_cursor
+
+    replies = await connection.execute(
+        descendants_statement([root.path for root in roots])
+    )
+    return build_thread([*roots, *replies]), next_cursor
+
+
+def thread_etag(version, query_string):
+    """
+    Build the ETag of a post thread from the post version.
+    The query string is part of it, since every page is a different
+    representation.
+    """
+    return f'{version}-{zlib.crc32(query_string):08x}'
+
+
+def stream_threads(chunk_size):
+    """
+    Yield every top-level comment with its replies, across all posts.
+    Top-level comments are read in chunks from an open cursor and replies
+    are loaded per chunk, so memory use does not grow with the database.
+    """
+    result = db.session.execute(
+        roots_statement()
+        .order_by(Comment.created_at, Comment.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    for roots in result.partitions():
+        replies = db.session.execute(
+            descendants_statement([root.path for root in roots])
+        )
+        yield from build_thread([*roots, *replies])
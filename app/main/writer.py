@@ -0,0 +1,143 @@
+import atexit
+import os
+import queue
+import threading
+import time
+import uuid
+
+from flask import current_app
+
+from app.utils.cache import TTLCache
+
+from .ingest import BatchInsert
+
+
+class PendingComment:
+    """A comment waiting in the write-behind queue."""
+
+    def __init__(self, item):
+        self.item = item
+        self.provisional_id = uuid.uuid4().hex
+        self.id = None
+        self.error = None
+        self._done = threading.Event()
+
+    def resolve(self, id=None, error=None):
+        self.id = id
+        self.error = error
+        self._done.set()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Wait until the batch with this comment was committed."""
+        return self._done.wait(timeout)
+
+
+class CommentWriter:
+    """
+    Write-behind queue for new comments.
+    A background thread collects queued comments and inserts them in one
+    transaction every `interval` seconds or every `batch_size` comments,
+    so that many comments share one commit.
+    Queued comments are flushed before the process exits.
+    """
+
+    def __init__(self, app, interval, batch_size):
+        self.app = app
+        self.interval = interval
+        self.batch_size = batch_size
+        # provisional id -> PendingComment, kept to report the outcome
+        self.results = TTLCache(10000, 3600)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._stopped = False
+
+    def _start(self):
+        # Started by the first write of every process, threads of a
+        # process that created the app do not survive a fork into workers
+        self._pid = os.getpid()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='comment-writer')
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def submit(self, item):
+        pending = PendingComment(item)
+        # Under the lock, nothing is queued after the stop sentinel
+        with self._lock:
+            if self._stopped:
+                raise RuntimeError('Comment writer is stopped')
+            if self._pid != os.getpid():
+                self._start()
+            self.results.set(pending.provisional_id, pending)
+            self._queue.put(pending)
+        return pending
+
+    def stop(self):
+        """Flush queued comments and stop the background thread."""
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            running = self._pid == os.getpid()
+            if running:
+                self._queue.put(None)
+        if running:
+            self._thread.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            pending = self._queue.get()
+            if pending is None:
+                break
+            batch = [pending]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    pending = self._queue.get(timeout=max(timeout, 0))
+                except queue.Empty:
+                    break
+                if pending is None:
+                    stopping = True
+                    break
+                batch.append(pending)
+            self._flush(batch)
+
+        # Comments queued while stopping
+        batch = []
+        while not self._queue.empty():
+            if (pending := self._queue.get()) is not None:
+                batch.append(pending)
+        if batch:
+            self._flush(batch)
+
+    def _flush(self, batch):
+        try:
+            with self.app.app_context():
+                report = BatchInsert([pending.item for pending in batch],
+                                     chunk_size=len(batch)).run()
+        except Exception:
+            self.app.logger.exception('Write-behind flush failed')
+            for pending in batch:
+                pending.resolve(error='Insert failed')
+            return
+
+        errors = {error['index']: error['message']
+                  for error in report['errors']}
+        for index, pending in enumerate(batch):
+            if index in errors:
+                self.app.logger.warning('Queued comment %s rejected: %s',
+                                        pending.provisional_id, errors[index])
+            pending.resolve(report['ids'][index], errors.get(index))
+
+
+def comment_writer():
+    return current_app.extensions.get('comment_writer')
@@ -1,9 +1,12 @@
 from datetime import datetime, timezone
 from dataclasses import dataclass
 
-from werkzeug.security import check_password_hash, generate_password_hash
+from sqlalchemy import (DDL, and_, bindparam, column, event, func, insert,
+                        select, table, update)
+from sqlalchemy.orm.attributes import set_committed_value
 
 from app import db
+from app.utils.hashing import password_hasher
 from app.utils.timesince import timesince
 
 
@@ -27,10 +30,13 @@ class User(db.Model):
         return f"<User <{self.username}>"
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher().hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher().check(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        return password_hasher().needs_rehash(self.password_hash)
 
     def to_dict(self):
         user = {
@@ -44,6 +50,19 @@ class User(db.Model):
         return user
 
 
+def path_segment(comment_id):
+    """Materialized path segment of a comment, fixed width for ordering."""
+    return f'{comment_id:010d}/'
+
+
+def path_range(path):
+    """
+    Return the (lower, upper) bounds of every path under the given one.
+    Paths contain only digits and slashes, so "~" sorts after all of them.
+    """
+    return path, path + '~'
+
+
 @dataclass
 class Comment(db.Model):
     id: int
@@ -53,13 +72,24 @@ class Comment(db.Model):
     user_id: int
     parent_id: int
 
+    # Threads are read per post in creation order, top-level comments
+    # (parent_id IS NULL) per post or across all posts, and replies by
+    # their parent, so each of them is one ordered index range.
+    __table_args__ = (
+        db.Index('ix_comment_post_id_created_at', 'post_id', 'created_at'),
+        db.Index('ix_comment_post_id_parent_id_created_at',
+                 'post_id', 'parent_id', 'created_at'),
+        db.Index('ix_comment_parent_id_created_at',
+                 'parent_id', 'created_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    post_id = db.Column(db.String(500), nullable=False, index=True)
+    post_id = db.Column(db.String(500), nullable=False)
     body = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.now(timezone.utc))
     user_id = db.Column(db.Integer,
                         db.ForeignKey('user.id', ondelete='SET NULL'),
-                        nullable=True)
+                        nullable=True, index=True)
     # Self-referencing foreign key
     parent_id = db.Column(db.Integer,
                           db.ForeignKey('comment.id', ondelete='CASCADE'),
@@ -71,10 +101,45 @@ class Comment(db.Model):
         remote_side=[id],
         backref=db.backref('replies', cascade="all, delete-orphan")
     )
+    # Materialized path of ids from the root comment down to this one,
+    # e.g. "0000000001/0000000005/", and the nesting level (0 for roots).
+    # Both are set after insert, see set_comment_path.
+    path = db.Column(db.Text, nullable=True, index=True)
+    depth = db.Column(db.Integer, nullable=False, default=0,
+                      server_default='0')
+    # When the author was deleted, set by the comment_orphaned trigger for
+    # both ORM and ON DELETE SET NULL updates. Anonymous comments have no
+    # author either, but are never orphaned.
+    orphaned_at = db.Column(db.DateTime, nullable=True, index=True)
 
     def __repr__(self):
         return f"<Comment> {self.id}: {self.created_at}"
 
+    def subtree(self, max_depth=None):
+        """
+        Query this comment and all of its replies, ordered by path.
+        :param max_depth: optional number of reply levels to include
+        """
+        lower, upper = path_range(self.path)
+        query = Comment.query.filter(Comment.path >= lower,
+                                     Comment.path < upper)
+        if max_depth is not None:
+            query = query.filter(Comment.depth <= self.depth + max_depth)
+        return query.order_by(Comment.path)
+
+    def descendants_count(self):
+        """Count replies of this comment on all levels."""
+        lower, upper = path_range(self.path)
+        return db.session.execute(
+            select(func.count())
+            .select_from(Comment)
+            .where(and_(Comment.path > lower, Comment.path < upper))
+        ).scalar()
+
+    def ancestor_ids(self):
+        """Return ids of the parent comments, starting from the root."""
+        return [int(segment) for segment in self.path.split('/')[:-2]]
+
     def to_dict(self, include_replies=True):
         """
         Convert the Comment object to a dictionary.
@@ -100,6 +165,76 @@ class Comment(db.Model):
         return comment
 
 
+@event.listens_for(Comment, 'after_insert')
+def set_comment_path(mapper, connection, target):
+    """
+    Set path and depth of a new comment once its id is known.
+    Rows inserted without the ORM (bulk inserts) must set them themselves.
+    """
+    parent = target.__dict__.get('parent')
+    if target.parent_id is None:
+        parent_path, depth = '', 0
+    elif parent is not None and parent.path is not None:
+        parent_path, depth = parent.path, parent.depth + 1
+    else:
+        parent_path, parent_depth = connection.execute(
+            select(Comment.path, Comment.depth)
+            .where(Comment.id == target.parent_id)
+        ).one()
+        depth = parent_depth + 1
+
+    path = parent_path + path_segment(target.id)
+    connection.execute(
+        update(Comment.__table__)
+        .where(Comment.__table__.c.id == target.id)
+        .values(path=path, depth=depth)
+    )
+    set_committed_value(target, 'path', path)
+    set_committed_value(target, 'depth', depth)
+
+
+# Full-text index of comment bodies. It is an FTS5 table with external
+# content, so it only stores the index and reads bodies from the comment
+# table. Triggers keep it in sync with every insert, update and delete,
+# including bulk inserts and cascading deletes.
+comment_fts = table('comment_fts', column('rowid'), column('body'))
+
+COMMENT_FTS_DDL = (
+    "CREATE VIRTUAL TABLE comment_fts USING fts5("
+    "body, content='comment', content_rowid='id')",
+    "CREATE TRIGGER comment_fts_insert AFTER INSERT ON comment BEGIN "
+    "INSERT INTO comment_fts (rowid, body) VALUES (new.id, new.body); "
+    "END",
+    "CREATE TRIGGER comment_fts_delete AFTER DELETE ON comment BEGIN "
+    "INSERT INTO comment_fts (comment_fts, rowid, body) "
+    "VALUES ('delete', old.id, old.body); "
+    "END",
+    "CREATE TRIGGER comment_fts_update AFTER UPDATE OF body ON comment BEGIN "
+    "INSERT INTO comment_fts (comment_fts, rowid, body) "
+    "VALUES ('delete', old.id, old.body); "
+    "INSERT INTO comment_fts (rowid, body) VALUES (new.id, new.body); "
+    "END",
+)
+
+for statement in COMMENT_FTS_DDL:
+    event.listen(Comment.__table__, 'after_create',
+                 DDL(statement).execute_if(dialect='sqlite'))
+event.listen(Comment.__table__, 'after_drop',
+             DDL('DROP TABLE IF EXISTS comment_fts').execute_if(
+                 dialect='sqlite'))
+
+
+COMMENT_ORPHANED_DDL = (
+    "CREATE TRIGGER comment_orphaned AFTER UPDATE OF user_id ON comment "
+    "WHEN old.user_id IS NOT NULL AND new.user_id IS NULL BEGIN "
+    "UPDATE comment SET orphaned_at = CURRENT_TIMESTAMP WHERE id = new.id; "
+    "END"
+)
+
+event.listen(Comment.__table__, 'after_create',
+             DDL(COMMENT_ORPHANED_DDL).execute_if(dialect='sqlite'))
+
+
 @dataclass
 class Contact(db.Model):
     id: int
@@ -118,5 +253,91 @@ class Contact(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.now(timezone.utc))
     is_read = db.Column(db.Boolean, default=False)
 
+    # The inbox lists unread messages, newest first
+    __table_args__ = (
+        db.Index('ix_contact_is_read_created_at', 'is_read', 'created_at'),
+    )
+
     def __repr__(self):
         return f"<Contact> {self.id}: {self.email}"
+
+
+@dataclass
+class PostMeta(db.Model):
+    post_id: str
+    version: int
+    comment_count: int
+
+    post_id = db.Column(db.String(500), primary_key=True)
+    # Incremented by every comment write on the post
+    version = db.Column(db.Integer, nullable=False, default=0)
+    # Denormalized number of comments, including replies
+    comment_count = db.Column(db.Integer, nullable=False, default=0,
+                              server_default='0')
+    # Version of the post when its static snapshot was last written
+    snapshot_version = db.Column(db.Integer, nullable=True)
+
+    def __repr__(self):
+        return f"<PostMeta> {self.post_id}: {self.version}"
+
+    @classmethod
+    def touch(cls, post_id, count_delta=0):
+        """
+        Increment the version of a post in the current transaction.
+        Must be called before committing every comment write on the post.
+        :param count_delta: number of comments added (or removed if negative)
+        """
+        result = db.session.execute(
+            update(cls)
+            .where(cls.post_id == post_id)
+            .values(version=cls.version + 1,
+                    comment_count=cls.comment_count + count_delta)
+        )
+        if result.rowcount == 0:
+            db.session.add(cls(post_id=post_id, version=1,
+                               comment_count=max(count_delta, 0)))
+
+    @classmethod
+    def touch_many(cls, counts):
+        """
+        Same as touch for many posts with one statement per kind of write.
+        :param counts: dict of post_id -> count_delta
+        """
+        table = cls.__table__
+        existing = set(db.session.execute(
+            select(cls.post_id).where(cls.post_id.in_(counts))
+        ).scalars())
+        if existing:
+            db.session.execute(
+                update(table)
+                .where(table.c.post_id == bindparam('b_post_id'))
+                .values(version=table.c.version + 1,
+                        comment_count=table.c.comment_count
+                        + bindparam('b_delta')),
+                [{'b_post_id': post_id, 'b_delta': counts[post_id]}
+                 for post_id in existing]
+            )
+        missing = [
+            {'post_id': post_id, 'version': 1, 'comment_count': max(delta, 0)}
+            for post_id, delta in counts.items() if post_id not in existing
+        ]
+        if missing:
+            db.session.execute(insert(table), missing)
+
+    @classmethod
+    def get_version(cls, post_id):
+        """Return the version of a post with a primary key lookup."""
+        version = db.session.execute(
+            select(cls.version).where(cls.post_id == post_id)
+        ).scalar()
+        return version or 0
+
+    @classmethod
+    def get_counts(cls, post_ids):
+        """Return a dict of post_id -> number of comments."""
+        counts = dict.fromkeys(post_ids, 0)
+        counts.update(db.session.execute(
+            select(cls.post_id, cls.comment_count)
+            .where(cls.post_id.in_(post_ids))
+        ).all())
+        return counts
@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+
+class TTLCache:
+    """
+    Thread-safe in-process LRU cache with per-entry expiration.
+    Entries can belong to a group, so that every entry of a group can be
+    invalidated at once (e.g. all cached variants of one post).
+    A cache with maxsize 0 is disabled and never stores anything.
+    """
+
+    def __init__(self, maxsize, ttl, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._timer = timer
+        self._lock = threading.Lock()
+        # key -> (expires_at, group, value), least recently used first
+        self._data = OrderedDict()
+        self._groups = defaultdict(set)
+        self._generations = defaultdict(int)
+        self._epoch = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, group, value = entry
+            if expires_at <= self._timer():
+                self._remove(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def generation(self, group):
+        """
+        Return the current generation of a group.
+        Pass it to set() to avoid storing a value that was loaded before
+        the group was invalidated.
+        """
+        with self._lock:
+            return self._epoch, self._generations.get(group, 0)
+
+    def set(self, key, value, group=None, ttl=None, generation=None):
+        if self.maxsize <= 0:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            current = self._epoch, self._generations.get(group, 0)
+            if generation is not None and generation != current:
+                return
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (self._timer() + ttl, group, value)
+            self._groups[group].add(key)
+            while len(self._data) > self.maxsize:
+                self._remove(next(iter(self._data)))
+
+    def pop(self, key):
+        with self._lock:
+            if key in self._data:
+                return self._remove(key)
+
+    def invalidate(self, group):
+        """Remove every entry of a group."""
+        with self._lock:
+            if len(self._generations) >= max(self.maxsize, 1):
+                # Forget the generations of the groups, a new epoch keeps
+                # values loaded before from being stored
+                self._epoch += 1
+                self._generations.clear()
+            self._generations[group] += 1
+            for key in self._groups.pop(group, ()):
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._data.clear()
+            self._groups.clear()
+            self._generations.clear()
+
+    def stats(self):
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def _remove(self, key):
+        _, group, value = self._data.pop(key)
+        keys = self._groups[group]
+        keys.discard(key)
+        if not keys:
+            del self._groups[group]
+        return value
@@ -0,0 +1,69 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from functools import cached_property
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HashingOverloaded(Exception):
+    """
+    Raised when too many passwords are already waiting to be hashed, or
+    when a hash is not done within the timeout.
+    """
+
+
+class PasswordHasher:
+    """
+    Hash and check passwords on a dedicated, size-limited thread pool.
+    At most `workers` hashes run at once and at most `queue_depth` more
+    wait for a worker, any request above that fails fast with
+    HashingOverloaded instead of tying up a request worker.
+    :param method: werkzeug hash method with its work factor,
+        e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000"
+    """
+
+    def __init__(self, method, workers, queue_depth, timeout=None):
+        self.method = method
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + queue_depth)
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='password-hasher'
+        )
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingOverloaded()
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise HashingOverloaded() from None
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def check(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    @cached_property
+    def _method_prefix(self):
+        # Method with the parameters werkzeug fills in, e.g. "scrypt" is
+        # stored as "scrypt:32768:8:1"
+        return generate_password_hash('', self.method).split('$', 1)[0]
+
+    def needs_rehash(self, pwhash):
+        """Return True if the hash was not made with the current method."""
+        return pwhash.split('$', 1)[0] != self._method_prefix
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+def password_hasher():
+    return current_app.extensions['password_hasher']
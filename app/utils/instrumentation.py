@@ -0,0 +1,132 @@
+import json
+import logging
+import re
+import time
+from collections import Counter
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+
+# IN lists expand to one placeholder per value, they are collapsed so that
+# the same query with other values is counted as a repeat
+_IN_LIST = re.compile(r'\(\?(?:, \?)*\)')
+
+
+class RequestTimings:
+    """SQL statements and timings of the current request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = Counter()
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+
+    def repeated(self, threshold):
+        """Return [(statement, count)] run at least `threshold` times."""
+        return [(statement, count)
+                for statement, count in self.statements.most_common()
+                if count >= threshold]
+
+
+def request_timings():
+    """Return the timings of the current request, or None."""
+    return g.get('request_timings') if has_app_context() else None
+
+
+class RequestInstrumentation:
+    """
+    Measure SQL statements and time, JSON serialization time and handler
+    time of every request. They are sent in a Server-Timing header and
+    logged as one JSON line per request. Statements that run at least
+    INSTRUMENTATION_REPEAT_THRESHOLD times in one request, with any
+    parameters, are logged as a warning: that is how lazy loads in a loop
+    (N+1 queries) show up.
+    Lines go to the "<app>.instrumentation" logger at
+    INSTRUMENTATION_LOG_LEVEL, so they are emitted without debug mode,
+    where the level of the app logger is WARNING.
+    Nothing is hooked in when INSTRUMENTATION_ENABLED is off.
+    """
+
+    def __init__(self, app, db):
+        app.extensions['instrumentation'] = self
+        if not app.config['INSTRUMENTATION_ENABLED']:
+            return
+        self.logger = logging.getLogger(f'{app.name}.instrumentation')
+        self.logger.setLevel(app.config['INSTRUMENTATION_LOG_LEVEL'])
+        self.repeat_threshold = app.config['INSTRUMENTATION_REPEAT_THRESHOLD']
+
+        with app.app_context():
+            for engine in db.engines.values():
+                self.instrument(engine)
+        self._wrap_json(app.json)
+        app.before_request(self.start)
+        app.after_request(self.finish)
+
+    def instrument(self, engine):
+        """Measure the statements of another engine, e.g. an asyncio one."""
+        event.listen(engine, 'before_cursor_execute',
+                     self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute',
+                     self._after_cursor_execute)
+
+    def _wrap_json(self, provider):
+        dumps = provider.dumps
+
+        def timed_dumps(obj, **kwargs):
+            started = time.perf_counter()
+            try:
+                return dumps(obj, **kwargs)
+            finally:
+                if (timings := request_timings()) is not None:
+                    timings.serialize += time.perf_counter() - started
+
+        provider.dumps = timed_dumps
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters,
+                               context, executemany):
+        if request_timings() is not None:
+            context._instrumentation_started = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters,
+                              context, executemany):
+        timings = request_timings()
+        started = getattr(context, '_instrumentation_started', None)
+        if timings is None or started is None:
+            return
+        timings.db += time.perf_counter() - started
+        timings.queries += 1
+        timings.statements[_IN_LIST.sub('(?)', statement)] += 1
+
+    def start(self):
+        g.request_timings = RequestTimings()
+
+    def finish(self, response):
+        timings = g.pop('request_timings', None)
+        if timings is None:
+            return response
+
+        handler = time.perf_counter() - timings.started
+        response.headers['Server-Timing'] = (
+            f'db;dur={timings.db * 1000:.2f};desc="{timings.queries} queries"'
+            f', serialize;dur={timings.serialize * 1000:.2f}'
+            f', handler;dur={handler * 1000:.2f}'
+        )
+
+        repeated = timings.repeated(self.repeat_threshold)
+        self.logger.info('request %s', json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'queries': timings.queries,
+            'db_ms': round(timings.db * 1000, 2),
+            'serialize_ms': round(timings.serialize * 1000, 2),
+            'handler_ms': round(handler * 1000, 2),
+            'repeated_queries': len(repeated),
+        }))
+        for statement, count in repeated:
+            self.logger.warning('Statement ran %d times in %s %s: %s',
+                                count, request.method, request.path,
+                                statement)
+        return response
@@ -0,0 +1,59 @@
+import dataclasses
+from datetime import datetime, timezone
+from operator import attrgetter
+
+from flask.json.provider import DefaultJSONProvider
+
+
+_WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+_MONTHS = (None, 'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+           'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def http_date(dt):
+    """
+    Format a datetime as an RFC 822 date, the same as werkzeug's http_date.
+    Naive datetimes are assumed to be in UTC.
+    """
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc)
+    return (f'{_WEEKDAYS[dt.weekday()]}, {dt.day:02d} {_MONTHS[dt.month]} '
+            f'{dt.year:04d} {dt.hour:02d}:{dt.minute:02d}:{dt.second:02d} GMT')
+
+
+def _compile_dataclass(cls):
+    """
+    Build an encoder for a dataclass model from its field names once,
+    instead of reflecting over the fields for every object.
+    """
+    fields = tuple(field.name for field in dataclasses.fields(cls))
+    if len(fields) == 1:
+        return lambda obj: {fields[0]: getattr(obj, fields[0])}
+    getter = attrgetter(*fields)
+    return lambda obj: dict(zip(fields, getter(obj)))
+
+
+class ModelJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider with fast encoders for datetimes and dataclass models
+    (Comment, User, Contact, ...). Encoders are looked up by exact type.
+    Output is the same as with Flask's default provider.
+
+    Set JSON_COMPACT to True to never pretty-print responses, or to False
+    to always do it. By default responses are pretty-printed in debug mode.
+    """
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.compact = app.config.get('JSON_COMPACT')
+        self.sort_keys = app.config.get('JSON_SORT_KEYS', True)
+        self._encoders = {datetime: http_date}
+
+    def default(self, obj):
+        encoder = self._encoders.get(type(obj))
+        if encoder is None:
+            if not dataclasses.is_dataclass(obj) or isinstance(obj, type):
+                return super().default(obj)
+            encoder = self._encoders[type(obj)] = _compile_dataclass(
+                type(obj))
+        return encoder(obj)
@@ -0,0 +1,327 @@
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+
+from flask import current_app, g, request
+
+# Buckets of the number of comments in served threads
+THREAD_SIZE_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+
+HELP = {
+    'blog_requests_total': (
+        'counter', 'Requests by endpoint, method and status code.'),
+    'blog_request_duration_seconds': (
+        'histogram', 'Request latency by endpoint.'),
+    'blog_thread_comments': (
+        'histogram', 'Number of comments in served threads.'),
+    'blog_cache_hits_total': ('counter', 'Cache hits.'),
+    'blog_cache_misses_total': ('counter', 'Cache misses.'),
+    'blog_cache_entries': ('gauge', 'Entries in a cache.'),
+    'blog_db_pool_connections': (
+        'gauge', 'Database pool connections by state.'),
+}
+
+
+class _Shard:
+    """Metrics written by a single thread."""
+
+    def __init__(self):
+        self.counters = {}
+        # key -> [count per bucket..., count above the last bucket, sum]
+        self.histograms = {}
+
+    def merge(self, other):
+        """Add the metrics of another shard to this one."""
+        for key, value in other.counters.copy().items():
+            self.counters[key] = self.counters.get(key, 0) + value
+        for key, values in other.histograms.copy().items():
+            total = self.histograms.setdefault(key, [0] * len(values))
+            for index, value in enumerate(list(values)):
+                total[index] += value
+
+
+class Metrics:
+    """
+    Prometheus metrics served at /metrics when METRICS_ENABLED is on.
+
+    Every thread records into its own shard, so recording takes no lock.
+    Shards are summed when metrics are collected. With several worker
+    processes, set METRICS_DIR to a directory shared by the workers of
+    one host: each process writes its totals there every
+    METRICS_FLUSH_INTERVAL seconds and /metrics adds up the files of all
+    processes. Counters of exited processes are kept, their gauges are
+    dropped.
+    """
+
+    def __init__(self, app, db):
+        self.enabled = app.config['METRICS_ENABLED']
+        app.extensions['metrics'] = self
+        if not self.enabled:
+            return
+        self.app = app
+        self.latency_buckets = tuple(app.config['METRICS_LATENCY_BUCKETS'])
+        self.directory = app.config['METRICS_DIR']
+        self._local = threading.local()
+        # (thread, shard) of live threads, shards of exited threads are
+        # merged into _retired
+        self._shards = []
+        self._retired = _Shard()
+        self._shards_lock = threading.Lock()
+        with app.app_context():
+            self.engines = dict(db.engines)
+
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.add_url_rule('/metrics', 'metrics', self.view)
+
+        self.flush_interval = app.config['METRICS_FLUSH_INTERVAL']
+        self._flusher_pid = None
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            with self._shards_lock:
+                self._retire_shards()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _retire_shards(self):
+        # Called with _shards_lock held. Servers that run every request
+        # on a new thread would otherwise leave one shard per request.
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                self._retired.merge(shard)
+        self._shards = live
+
+    def inc(self, name, labels, value=1):
+        counters = self._shard().counters
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, labels, value, buckets):
+        histograms = self._shard().histograms
+        key = (name, labels)
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [0] * (len(buckets) + 2)
+        histogram[bisect.bisect_left(buckets, value)] += 1
+        histogram[-1] += value
+
+    def observe_thread(self, size):
+        self.observe('blog_thread_comments', (), size, THREAD_SIZE_BUCKETS)
+
+    def _start(self):
+        g.metrics_started = time.perf_counter()
+
+    def _start_flusher(self):
+        # Started by the first request of every process, threads of a
+        # process that created the app do not survive a fork into workers
+        self._flusher_pid = os.getpid()
+        threading.Thread(target=self._flush_periodically, daemon=True,
+                         name='metrics-flusher').start()
+        atexit.register(self._flush_at_exit)
+
+    def _finish(self, response):
+        if self.directory and self._flusher_pid != os.getpid():
+            self._start_flusher()
+        started = g.pop('metrics_started', None)
+        if started is None or request.endpoint == 'metrics':
+            return response
+        endpoint = request.endpoint or 'unmatched'
+        self.inc('blog_requests_total',
+                 (('endpoint', endpoint), ('method', request.method),
+                  ('status', str(response.status_code))))
+        self.observe('blog_request_duration_seconds',
+                     (('endpoint', endpoint),),
+                     time.perf_counter() - started, self.latency_buckets)
+        return response
+
+    def snapshot(self):
+        """
+        Sum the shards of this process and read current cache and pool
+        stats.
+        :return: JSON serializable dict
+        """
+        # dict.copy() in merge is atomic, writers may keep adding keys
+        total = _Shard()
+        with self._shards_lock:
+            self._retire_shards()
+            total.merge(self._retired)
+            for _, shard in self._shards:
+                total.merge(shard)
+        counters = total.counters
+        histograms = total.histograms
+
+        gauges = {}
+        for cache in ('thread_cache', 'user_cache'):
+            stats = self.app.extensions[cache].stats()
+            labels = (('cache', cache),)
+            counters[('blog_cache_hits_total', labels)] = stats['hits']
+            counters[('blog_cache_misses_total', labels)] = stats['misses']
+            gauges[('blog_cache_entries', labels)] = stats['size']
+        for bind, engine in self.engines.items():
+            pool = engine.pool
+            if not hasattr(pool, 'checkedout'):
+                continue
+            for state, value in (('checked_out', pool.checkedout()),
+                                 ('checked_in', pool.checkedin()),
+                                 ('overflow', pool.overflow())):
+                labels = (('bind', bind or 'default'), ('state', state))
+                gauges[('blog_db_pool_connections', labels)] = value
+
+        return {
+            'pid': os.getpid(),
+            'buckets': {
+                'blog_request_duration_seconds': self.latency_buckets,
+                'blog_thread_comments': THREAD_SIZE_BUCKETS,
+            },
+            'counters': [[name, labels, value]
+                         for (name, labels), value in counters.items()],
+            'histograms': [
+                [name, labels, values]
+                for (name, labels), values in histograms.items()
+            ],
+            'gauges': [[name, labels, value]
+                       for (name, labels), value in gauges.items()],
+        }
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f'metrics-{pid}.json')
+
+    def flush(self):
+        """Write the snapshot of this process to METRICS_DIR."""
+        path = self._path(os.getpid())
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(self.snapshot(), file)
+        os.replace(temporary, path)
+
+    def _flush_at_exit(self):
+        try:
+            self.flush()
+        except OSError as e:
+            self.app.logger.warning('Writing metrics failed: %s', e)
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception('Writing metrics failed')
+
+    def _snapshots(self):
+        """Snapshots of this process and of other processes on the host."""
+        snapshots = [self.snapshot()]
+        if not self.directory:
+            return snapshots
+        own = os.path.basename(self._path(os.getpid()))
+        for name in os.listdir(self.directory):
+            if name == own or not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as file:
+                    snapshot = json.load(file)
+            except (OSError, ValueError):
+                continue
+            if not _is_alive(snapshot['pid']):
+                snapshot['gauges'] = []
+            snapshots.append(snapshot)
+        return snapshots
+
+    def render(self):
+        """Aggregate all processes into the Prometheus text format."""
+        counters = {}
+        histograms = {}
+        gauges = {}
+        buckets = {}
+        for snapshot in self._snapshots():
+            buckets.update(snapshot['buckets'])
+            for name, labels, value in snapshot['counters']:
+                key = (name, _labels(labels))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, values in snapshot['histograms']:
+                key = (name, _labels(labels))
+                total = histograms.setdefault(key, [0] * len(values))
+                for index, value in enumerate(values):
+                    total[index] += value
+            for name, labels, value in snapshot['gauges']:
+                labels = (*_labels(labels), ('pid', str(snapshot['pid'])))
+                gauges[(name, labels)] = value
+
+        samples = {}
+        for (name, labels), value in sorted(counters.items()):
+            samples.setdefault(name, []).append(
+                f'{name}{_format(labels)} {_number(value)}')
+        for (name, labels), value in sorted(gauges.items()):
+            samples.setdefault(name, []).append(
+                f'{name}{_format(labels)} {_number(value)}')
+        for (name, labels), values in sorted(histograms.items()):
+            lines = samples.setdefault(name, [])
+            cumulative = 0
+            bounds = [*map(_number, buckets[name]), '+Inf']
+            for bound, count in zip(bounds, values[:-1]):
+                cumulative += count
+                lines.append(f'{name}_bucket'
+                             f'{_format((*labels, ("le", bound)))} '
+                             f'{cumulative}')
+            lines.append(f'{name}_sum{_format(labels)} '
+                         f'{_number(values[-1])}')
+            lines.append(f'{name}_count{_format(labels)} {cumulative}')
+
+        output = []
+        for name in sorted(samples):
+            type_, help_ = HELP[name]
+            output.append(f'# HELP {name} {help_}')
+            output.append(f'# TYPE {name} {type_}')
+            output.extend(samples[name])
+        return '\n'.join(output) + '\n'
+
+    def view(self):
+        return current_app.response_class(
+            self.render(), mimetype='text/plain; version=0.0.4')
+
+
+def _labels(labels):
+    return tuple(tuple(label) for label in labels)
+
+
+def _escape(value):
+    return (value.replace('\\', '\\\\').replace('\n', '\\n')
+            .replace('"', '\\"'))
+
+
+def _format(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"'
+                          for name, value in labels) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def metrics():
+    """Return the metrics of the current app if they are enabled, or None."""
+    collector = current_app.extensions['metrics']
+    return collector if collector.enabled else None
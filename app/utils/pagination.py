@@ -0,0 +1,137 @@
+import base64
+import binascii
+from datetime import datetime
+
+from flask import current_app, request
+from sqlalchemy import and_, or_
+
+
+def _encode(raw):
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def _decode(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    return base64.urlsafe_b64decode(padded.encode()).decode()
+
+
+def encode_cursor(created_at, id):
+    """
+    Encode the sort key of the last row of a page into an opaque cursor.
+    :param created_at: datetime of the last row
+    :param id: primary key of the last row
+    :return: str
+    """
+    return _encode(f'{created_at.isoformat()}|{id}')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor created by encode_cursor.
+    :param cursor: str
+    :return: tuple (created_at, id)
+    :raises ValueError: if the cursor is malformed
+    """
+    try:
+        created_at, id = _decode(cursor).split('|')
+        return datetime.fromisoformat(created_at), int(id)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def encode_rank_cursor(rank, id):
+    """
+    Encode the sort key of the last search result of a page.
+    :param rank: search rank of the last row
+    :param id: primary key of the last row
+    :return: str
+    """
+    return _encode(f'{rank!r}|{id}')
+
+
+def decode_rank_cursor(cursor):
+    """
+    Decode a cursor created by encode_rank_cursor.
+    :return: tuple (rank, id)
+    :raises ValueError: if the cursor is malformed
+    """
+    try:
+        rank, id = _decode(cursor).split('|')
+        return float(rank), int(id)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def is_paginated(args=None):
+    """Return True if the request asks for a paginated response."""
+    args = request.args if args is None else args
+    return 'limit' in args or 'cursor' in args
+
+
+def page_args(decode=decode_cursor, args=None, config=None):
+    """
+    Read and validate the "limit" and "cursor" query parameters.
+    :param decode: function decoding the cursor
+    :param args: query parameters, by default those of the current request
+    :param config: app config, by default that of the current app
+    :return: tuple (limit, decoded cursor or None)
+    :raises ValueError: if a parameter is not valid
+    """
+    args = request.args if args is None else args
+    config = current_app.config if config is None else config
+    max_limit = config['PAGE_SIZE_MAX']
+    limit = args.get('limit', config['PAGE_SIZE'])
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise ValueError('"limit" must be an integer') from None
+    if not 1 <= limit <= max_limit:
+        raise ValueError(f'"limit" must be between 1 and {max_limit}')
+
+    cursor = args.get('cursor')
+    if cursor:
+        cursor = decode(cursor)
+    return limit, cursor or None
+
+
+def keyset_page(stmt, created_at, id, limit, cursor=None, descending=False):
+    """
+    Restrict a select to one page ordered by (created_at, id).
+    Rows after the cursor are selected with a range condition instead of
+    OFFSET, so every page costs the same.
+    One extra row is selected to find out if there is a next page.
+    :param stmt: select statement
+    :param created_at: created_at column to sort by
+    :param id: id column used as the tie breaker
+    :param limit: page size
+    :param cursor: decoded cursor (created_at, id) or None
+    :param descending: newest rows first
+    :return: select statement
+    """
+    if cursor is not None:
+        last_created_at, last_id = cursor
+        if descending:
+            stmt = stmt.where(or_(
+                created_at < last_created_at,
+                and_(created_at == last_created_at, id < last_id)
+            ))
+        else:
+            stmt = stmt.where(or_(
+                created_at > last_created_at,
+                and_(created_at == last_created_at, id > last_id)
+            ))
+    order = (created_at.desc(), id.desc()) if descending else (created_at, id)
+    return stmt.order_by(None).order_by(*order).limit(limit + 1)
+
+
+def split_page(rows, limit):
+    """
+    Split rows selected by keyset_page into the page and the next cursor.
+    :return: tuple (rows, next_cursor or None)
+    """
+    rows = list(rows)
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(last.created_at, last.id)
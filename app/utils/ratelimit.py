@@ -0,0 +1,169 @@
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, jsonify, request
+
+
+UNITS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+def parse_limit(limit):
+    """
+    Parse a limit like "10/minute" into a token bucket.
+    :return: tuple (tokens added per second, bucket size)
+    """
+    count, unit = limit.split('/')
+    count = int(count)
+    return count / UNITS[unit.strip().rstrip('s')], count
+
+
+def _refill(tokens, updated, now, rate, burst):
+    return min(burst, tokens + max(now - updated, 0) * rate)
+
+
+class MemoryBucketStore:
+    """
+    Token buckets kept in the memory of the current process.
+    At most max_keys buckets are kept, the least recently used one is
+    dropped to make room for a new one.
+    """
+
+    max_keys = 10000
+
+    def __init__(self):
+        # key -> (tokens, updated), least recently used first
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        """
+        Take one token from a bucket.
+        :return: 0 if a token was taken, else seconds until one is available
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = _refill(tokens, updated, now, rate, burst)
+            retry_after = 0 if tokens >= 1 else (1 - tokens) / rate
+            if not retry_after:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+
+class SQLiteBucketStore:
+    """
+    Token buckets kept in a local SQLite file, shared by every worker
+    process on the host.
+    Every sweep_interval seconds, buckets not used for max_idle seconds
+    are deleted. They are full by then, so deleting them changes nothing.
+    """
+
+    sweep_interval = 60
+    # Seconds to wait for the lock of the file
+    timeout = 1
+
+    def __init__(self, path, max_idle=86400):
+        self.path = path
+        self.max_idle = max_idle
+        self._next_sweep = time.monotonic() + self.sweep_interval
+        self._local = threading.local()
+        with self._connect() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS bucket ('
+                'key TEXT PRIMARY KEY, tokens REAL, updated REAL)'
+            )
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            self._local.connection = connection
+        return connection
+
+    def take(self, key, rate, burst):
+        now = time.time()
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                'SELECT tokens, updated FROM bucket WHERE key = ?', (key,)
+            ).fetchone()
+            tokens, updated = row or (burst, now)
+            tokens = _refill(tokens, updated, now, rate, burst)
+            retry_after = 0 if tokens >= 1 else (1 - tokens) / rate
+            if not retry_after:
+                tokens -= 1
+            connection.execute(
+                'INSERT OR REPLACE INTO bucket (key, tokens, updated) '
+                'VALUES (?, ?, ?)', (key, tokens, now)
+            )
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        if time.monotonic() >= self._next_sweep:
+            self._next_sweep = time.monotonic() + self.sweep_interval
+            self.sweep(now)
+        return retry_after
+
+    def sweep(self, now=None):
+        """Delete the buckets not used for max_idle seconds."""
+        now = time.time() if now is None else now
+        self._connect().execute('DELETE FROM bucket WHERE updated < ?',
+                                (now - self.max_idle,))
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter keyed by client IP address and endpoint.
+    Limits are set per endpoint in RATELIMITS, e.g.
+    {'main.create_new_comment': '10/minute'}. Buckets are kept in process
+    memory, or in the SQLite file given by RATELIMIT_STORAGE so that all
+    workers on one host share them.
+    """
+
+    def __init__(self, app):
+        self.limits = {}
+        self.store = None
+        app.extensions['rate_limiter'] = self
+        if not app.config['RATELIMIT_ENABLED']:
+            return
+        self.limits = {endpoint: parse_limit(limit)
+                       for endpoint, limit in app.config['RATELIMITS'].items()}
+        storage = app.config['RATELIMIT_STORAGE']
+        if storage == 'memory':
+            self.store = MemoryBucketStore()
+        else:
+            # Time an empty bucket of the slowest limit takes to refill
+            max_idle = max((burst / rate for rate, burst
+                            in self.limits.values()), default=0)
+            self.store = SQLiteBucketStore(storage, max_idle)
+        app.before_request(self.check)
+
+    def check(self):
+        """Reject the request with 429 if its bucket is empty."""
+        limit = self.limits.get(request.endpoint)
+        if limit is None:
+            return None
+
+        key = f'{request.endpoint}:{request.remote_addr}'
+        try:
+            retry_after = self.store.take(key, *limit)
+        except sqlite3.OperationalError as e:
+            # A busy bucket file must not fail the request, let it through
+            current_app.logger.warning('Rate limit store unavailable: %s', e)
+            return None
+        if retry_after:
+            response = jsonify({'message': 'Too many requests'})
+            response.headers['Retry-After'] = str(math.ceil(retry_after))
+            return response, 429
+        return None
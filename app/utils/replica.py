@@ -0,0 +1,81 @@
+import functools
+import sqlite3
+
+from flask import g, has_app_context, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import Select
+
+
+# Key of the read replica in SQLALCHEMY_BINDS
+REPLICA_BIND = 'replica'
+
+
+class RoutingSession(Session):
+    """
+    Session that runs the SELECTs of views marked with `read_replica` on
+    the "replica" bind, when one is configured.
+    Everything else goes to the primary database. Once a view flushes or
+    runs any other statement, the rest of the request stays on the
+    primary, so that it reads its own writes.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._reads_replica(clause):
+            return self._db.engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind,
+                                **kwargs)
+
+    def _reads_replica(self, clause):
+        if not has_app_context() or not g.get('read_replica'):
+            return False
+        if (self._flushing or not isinstance(clause, Select)
+                or clause._for_update_arg is not None):
+            g.read_replica = False
+            return False
+        return REPLICA_BIND in self._db.engines
+
+
+def read_replica(view):
+    """
+    Serve the reads of a view from the replica bind, if there is one.
+    In a request, the reads of a streamed response body are served from
+    it as well, clear_read_replica ends it when the request is torn down.
+    """
+
+    @functools.wraps(view)
+    def decorated(*args, **kwargs):
+        g.read_replica = True
+        if has_request_context():
+            return view(*args, **kwargs)
+        try:
+            return view(*args, **kwargs)
+        finally:
+            g.pop('read_replica', None)
+
+    return decorated
+
+
+def clear_read_replica(exception=None):
+    """Teardown handler sending the next requests to the primary again."""
+    g.pop('read_replica', None)
+
+
+def refresh_replica(primary, replica):
+    """
+    Copy a SQLite primary database into the replica file with the SQLite
+    online backup API. Readers of the replica wait while it is copied.
+    :param primary: primary SQLAlchemy engine
+    :param replica: replica SQLAlchemy engine
+    """
+    for engine in (primary, replica):
+        if engine.dialect.name != 'sqlite' or not engine.url.database:
+            raise ValueError('Only SQLite database files can be copied')
+
+    replica.dispose()
+    source = primary.raw_connection()
+    target = sqlite3.connect(replica.url.database)
+    try:
+        source.driver_connection.backup(target)
+    finally:
+        target.close()
+        source.close()
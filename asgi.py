@@ -0,0 +1,9 @@
+import os
+
+from app import create_app
+from app.asgi import AsyncReads
+from settings import config
+
+
+app = create_app(config[os.environ.get('APP_CONFIG', 'default')])
+application = AsyncReads(app)
@@ -0,0 +1,123 @@
+"""
+Compare requests per second of the sync Flask read views, served by a
+pool of threads, with the async read path of app.asgi at the same number
+of concurrent requests.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_async --concurrency 64 --duration 5
+"""
+import argparse
+import asyncio
+import random
+import tempfile
+import threading
+import time
+
+from app import create_app, db
+from app.asgi import AsyncReads
+from settings import ProductionConfig
+
+from .data import seed
+
+
+def make_config(directory):
+    return type('BenchAsyncConfig', (ProductionConfig,), {
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{directory}/bench.db',
+        'RATELIMIT_ENABLED': False,
+        # Measure the database, not the thread cache
+        'THREAD_CACHE_SIZE': 0,
+    })
+
+
+def make_paths(posts, count, rng):
+    paths = []
+    for _ in range(count):
+        post_id = f'post-{rng.randrange(posts)}'
+        if rng.random() < 0.9:
+            paths.append((f'/{post_id}', b'limit=20'))
+        else:
+            paths.append(('/counts', f'post_id={post_id}'.encode()))
+    return paths
+
+
+def run_sync(app, paths, concurrency, duration):
+    done = [0] * concurrency
+    deadline = time.monotonic() + duration
+
+    def worker(index):
+        client = app.test_client()
+        for path, query in paths[index::concurrency] * 1000:
+            if time.monotonic() >= deadline:
+                break
+            client.get(path, query_string=query.decode()).get_data()
+            done[index] += 1
+
+    threads = [threading.Thread(target=worker, args=(index,))
+               for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(done)
+
+
+async def run_async(application, paths, concurrency, duration):
+    done = 0
+    deadline = time.monotonic() + duration
+
+    async def request(path, query):
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            pass
+
+        await application({
+            'type': 'http', 'asgi': {'version': '3.0'},
+            'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'query_string': query,
+            'root_path': '', 'headers': [(b'host', b'localhost')],
+            'server': ('localhost', 80), 'client': ('127.0.0.1', 1234),
+        }, receive, send)
+
+    async def worker(index):
+        nonlocal done
+        for path, query in paths[index::concurrency] * 1000:
+            if time.monotonic() >= deadline:
+                break
+            await request(path, query)
+            done += 1
+
+    await asyncio.gather(*(worker(index) for index in range(concurrency)))
+    await application.engine.dispose()
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--posts', type=int, default=20)
+    parser.add_argument('--comments-per-post', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    paths = make_paths(args.posts, 10000, rng)
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_app(make_config(directory))
+        with app.app_context():
+            db.create_all()
+            seed(args.posts, args.comments_per_post, depth=3, fanout=3)
+
+        requests = run_sync(app, paths, args.concurrency, args.duration)
+        print(f'sync  (threads) {requests / args.duration:8.1f} requests/s')
+        requests = asyncio.run(run_async(AsyncReads(app), paths,
+                                         args.concurrency, args.duration))
+        print(f'async (asyncio) {requests / args.duration:8.1f} requests/s')
+        with app.app_context():
+            db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,363 @@
+"""
+Benchmark every route on a seeded database and compare with a baseline.
+
+Records p50/p95 latency, SQL queries per request and peak Python memory
+per request for each route. Results are written as JSON; pass a previous
+result as --baseline to fail (exit status 1) on regressions.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_endpoints --posts 10 --comments-per-post 500 \\
+        --output before.json
+    python -m benchmarks.bench_endpoints --baseline before.json
+"""
+import argparse
+import itertools
+import json
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from sqlalchemy import event
+
+from app import create_app, db
+from app.models import Comment, User
+from settings import BaseConfig, ProductionConfig
+
+from .data import make_body, seed
+
+CONFIGS = {'default': BaseConfig, 'production': ProductionConfig}
+ADMIN = {'email': 'admin@example.com', 'password': 'admin-password'}
+
+
+def make_config(base, directory, thread_cache):
+    return type(f'Bench{base.__name__}', (base,), {
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{directory}/bench.db',
+        'RATELIMIT_ENABLED': False,
+        'THREAD_CACHE_SIZE': 1024 if thread_cache else 0,
+        'BATCH_MAX_ITEMS': 100000,
+    })
+
+
+class Bench:
+    """State shared by the requests of all scenarios."""
+
+    def __init__(self, app, posts, rng):
+        self.app = app
+        self.posts = posts
+        self.rng = rng
+        self.anonymous = app.test_client()
+        self.admin = self.login()
+        self.created = []
+        self.counter = itertools.count()
+        with app.app_context():
+            self.max_comment_id = db.session.query(
+                db.func.max(Comment.id)).scalar()
+
+    def login(self):
+        client = self.app.test_client()
+        response = client.post('/login', json=ADMIN)
+        assert response.status_code == 200, response.get_json()
+        return client
+
+    def post_id(self):
+        return f'post-{self.rng.randrange(self.posts)}'
+
+    def comment_id(self):
+        return self.rng.randint(1, self.max_comment_id)
+
+
+def post_comments_not_modified(bench):
+    post_id = bench.post_id()
+    etag = bench.anonymous.get(f'/{post_id}?limit=20').headers['ETag']
+    return bench.anonymous, 'GET', f'/{post_id}?limit=20', {
+        'headers': {'If-None-Match': etag}}
+
+
+def create_comment(bench):
+    return bench.anonymous, 'POST', '/new', {'json': {
+        'post_id': bench.post_id(), 'body': make_body(bench.rng)}}
+
+
+def create_reply(bench):
+    with bench.app.app_context():
+        parent = db.session.get(Comment, bench.comment_id())
+        post_id = parent.post_id
+    return bench.anonymous, 'POST', '/new', {'json': {
+        'post_id': post_id, 'parent_id': parent.id,
+        'body': make_body(bench.rng)}}
+
+
+def create_batch(bench):
+    batch = next(bench.counter)
+    return bench.admin, 'POST', '/batch', {'json': {'comments': [
+        {'ref': i, 'post_id': f'batch-{batch}', 'body': make_body(bench.rng),
+         **({'parent_ref': i // 5} if i >= 5 else {})}
+        for i in range(100)
+    ]}}
+
+
+def register(bench):
+    user = f'bench{next(bench.counter)}'
+    return bench.anonymous, 'POST', '/register', {'json': {
+        'username': user, 'email': f'{user}@example.com',
+        'password': 'bench-password1',
+        'password_confirm': 'bench-password1'}}
+
+
+def logout(bench):
+    return bench.login(), 'GET', '/logout', {}
+
+
+# name -> function returning (client, method, url, request kwargs).
+# Scenarios run in this order, deletes remove the comments created before.
+SCENARIOS = {
+    'post_comments': lambda bench: (
+        bench.anonymous, 'GET', f'/{bench.post_id()}', {}),
+    'post_comments_page': lambda bench: (
+        bench.anonymous, 'GET', f'/{bench.post_id()}?limit=20', {}),
+    'post_comments_not_modified': post_comments_not_modified,
+    'post_comments_truncated': lambda bench: (
+        bench.anonymous, 'GET',
+        f'/{bench.post_id()}?limit=20&max_depth=1&max_replies=3', {}),
+    'comment_replies': lambda bench: (
+        bench.anonymous, 'GET',
+        f'/{bench.comment_id()}/replies?max_depth=1&max_replies=3', {}),
+    'all_comments_page': lambda bench: (
+        bench.admin, 'GET', '/?limit=20', {}),
+    'all_comments_stream': lambda bench: (
+        bench.admin, 'GET', '/?stream=ndjson', {}),
+    'comment_counts': lambda bench: (
+        bench.anonymous, 'GET',
+        '/counts?' + '&'.join(f'post_id=post-{i}'
+                              for i in range(min(bench.posts, 100))), {}),
+    'search': lambda bench: (
+        bench.anonymous, 'GET',
+        f'/search?q={bench.rng.choice(["sqlite", "flask", "cach*"])}'
+        f'&limit=20', {}),
+    'create_comment': create_comment,
+    'create_reply': create_reply,
+    'update_comment': lambda bench: (
+        bench.admin, 'PUT', f'/{bench.comment_id()}/update',
+        {'json': {'body': make_body(bench.rng)}}),
+    'delete_comment': lambda bench: (
+        bench.admin, 'DELETE', f'/{bench.created.pop()}/delete', {}),
+    'create_batch': create_batch,
+    'cache_stats': lambda bench: (bench.admin, 'GET', '/cache-stats', {}),
+    'contact_me': lambda bench: (
+        bench.anonymous, 'POST', '/new-contact', {'json': {
+            'name': 'Reader', 'email': 'reader@example.com',
+            'subject': 'Hello', 'message': make_body(bench.rng)}}),
+    'contacts': lambda bench: (bench.admin, 'GET', '/contacts', {}),
+    'mark_contact_as_read': lambda bench: (
+        bench.admin, 'GET', f'/read-contact/{bench.rng.randint(1, 100)}', {}),
+    'mark_contacts_as_read': lambda bench: (
+        bench.admin, 'POST', '/contacts/read',
+        {'json': {'ids': bench.rng.sample(range(1, 201), 50)}}),
+    'register': register,
+    'login': lambda bench: (bench.anonymous, 'POST', '/login',
+                            {'json': ADMIN}),
+    'user_info': lambda bench: (bench.admin, 'GET', '/user', {}),
+    'refresh': lambda bench: (bench.admin, 'GET', '/refresh', {}),
+    'logout': logout,
+}
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of a list of numbers."""
+    values = sorted(values)
+    index = max(0, -(-len(values) * percent // 100) - 1)
+    return values[int(index)]
+
+
+def run_scenario(bench, engine, factory, requests, memory_requests):
+    queries = 0
+
+    def before_cursor_execute(*args):
+        nonlocal queries
+        queries += 1
+
+    latencies = []
+    statuses = set()
+    request_queries = 0
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        for _ in range(requests):
+            client, method, url, kwargs = factory(bench)
+            before = queries
+            started = time.perf_counter()
+            response = client.open(url, method=method, **kwargs)
+            response.get_data()
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses.add(response.status_code)
+            request_queries += queries - before
+            if url == '/new' and response.status_code == 201:
+                bench.created.append(response.get_json()['id'])
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+    # Memory is measured separately, tracing slows down every allocation
+    peak = 0
+    tracemalloc.start()
+    try:
+        for _ in range(memory_requests):
+            client, method, url, kwargs = factory(bench)
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            response = client.open(url, method=method, **kwargs)
+            response.get_data()
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - baseline)
+            if url == '/new' and response.status_code == 201:
+                bench.created.append(response.get_json()['id'])
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'requests': requests,
+        'statuses': sorted(statuses),
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'queries_per_request': round(request_queries / requests, 2),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def compare(results, baseline, max_slowdown, min_slowdown_ms,
+            max_extra_queries, max_memory_growth):
+    """
+    Compare results with a baseline run.
+    :return: list of regression messages
+    """
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result['statuses'] != before['statuses']:
+            regressions.append(f"{name}: statuses {before['statuses']} -> "
+                               f"{result['statuses']}")
+        for metric in ('p50_ms', 'p95_ms'):
+            if (result[metric] > before[metric] * max_slowdown
+                    and result[metric] - before[metric] > min_slowdown_ms):
+                regressions.append(
+                    f'{name}: {metric} {before[metric]} -> {result[metric]}')
+        if (result['queries_per_request']
+                > before['queries_per_request'] + max_extra_queries):
+            regressions.append(
+                f"{name}: queries {before['queries_per_request']} -> "
+                f"{result['queries_per_request']}")
+        if (result['peak_memory_kb']
+                > before['peak_memory_kb'] * max_memory_growth):
+            regressions.append(
+                f"{name}: peak memory {before['peak_memory_kb']} KiB -> "
+                f"{result['peak_memory_kb']} KiB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().splitlines()[0])
+    data = parser.add_argument_group('data')
+    data.add_argument('--posts', type=int, default=10)
+    data.add_argument('--comments-per-post', type=int, default=500)
+    data.add_argument('--depth', type=int, default=3,
+                      help='Maximum reply depth.')
+    data.add_argument('--fanout', type=int, default=3,
+                      help='Replies per comment.')
+    data.add_argument('--users', type=int, default=100)
+    data.add_argument('--seed', type=int, default=0)
+    run = parser.add_argument_group('run')
+    run.add_argument('--config', choices=CONFIGS, default='production')
+    run.add_argument('--thread-cache', action='store_true',
+                     help='Keep the thread cache enabled.')
+    run.add_argument('--requests', type=int, default=50,
+                     help='Timed requests per route.')
+    run.add_argument('--memory-requests', type=int, default=3,
+                     help='Requests per route run with memory tracing.')
+    run.add_argument('--only', nargs='+', choices=SCENARIOS,
+                     help='Routes to run.')
+    run.add_argument('--output', help='Write results to this JSON file.')
+    compare_group = parser.add_argument_group('regression thresholds')
+    compare_group.add_argument('--baseline',
+                               help='JSON results of a previous run.')
+    compare_group.add_argument('--max-slowdown', type=float, default=1.25,
+                               help='Allowed latency ratio to the baseline.')
+    compare_group.add_argument('--min-slowdown-ms', type=float, default=1,
+                               help='Latency changes below this are noise.')
+    compare_group.add_argument('--max-extra-queries', type=float, default=0)
+    compare_group.add_argument('--max-memory-growth', type=float,
+                               default=1.5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_app(make_config(CONFIGS[args.config], directory,
+                                     args.thread_cache))
+        with app.app_context():
+            db.create_all()
+            admin = User(username='admin', email=ADMIN['email'],
+                         is_admin=True)
+            admin.set_password(ADMIN['password'])
+            db.session.add(admin)
+            db.session.commit()
+            started = time.perf_counter()
+            seeded = seed(args.posts, args.comments_per_post, args.depth,
+                          args.fanout, users=args.users,
+                          password_hash=admin.password_hash, seed=args.seed)
+            print(f"Seeded {seeded['comments']} comments in "
+                  f'{time.perf_counter() - started:.1f} s')
+            engine = db.engine
+
+        bench = Bench(app, args.posts, random.Random(args.seed))
+        results = {}
+        for name, factory in SCENARIOS.items():
+            if args.only and name not in args.only:
+                continue
+            results[name] = result = run_scenario(
+                bench, engine, factory, args.requests, args.memory_requests)
+            print(f"{name:<28} p50 {result['p50_ms']:8.2f} ms  "
+                  f"p95 {result['p95_ms']:8.2f} ms  "
+                  f"queries {result['queries_per_request']:6.1f}  "
+                  f"memory {result['peak_memory_kb']:9.1f} KiB  "
+                  f"status {','.join(map(str, result['statuses']))}")
+        with app.app_context():
+            db.engine.dispose()
+
+    report = {
+        'meta': {
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'args': {key: value for key, value in vars(args).items()
+                     if key not in ('output', 'baseline')},
+            'seeded': seeded,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline['meta']['args'] != report['meta']['args']:
+            print('Warning: the baseline was run with other arguments',
+                  file=sys.stderr)
+        regressions = compare(results, baseline['results'],
+                              args.max_slowdown, args.min_slowdown_ms,
+                              args.max_extra_queries, args.max_memory_growth)
+        for regression in regressions:
+            print(f'REGRESSION {regression}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print('No regressions against the baseline')
+
+
+if __name__ == '__main__':
+    main()
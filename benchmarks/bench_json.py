@@ -0,0 +1,78 @@
+"""
+Compare Flask's default JSON provider with ModelJSONProvider.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_json --comments 10000
+"""
+import argparse
+import timeit
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from flask.json.provider import DefaultJSONProvider
+
+from app import create_app
+from app.main.threads import build_thread, with_ago
+from app.models import Comment
+from app.utils.json_provider import ModelJSONProvider
+from settings import TestConfig
+
+
+def make_thread(size, fanout=5):
+    """Build a serialized thread of `size` comments, `fanout` per parent."""
+    started = datetime(2024, 1, 1)
+    rows = [
+        SimpleNamespace(
+            id=id, post_id='benchmark-post', body=f'Comment body {id} ' * 5,
+            created_at=started + timedelta(minutes=id),
+            parent_id=None if id <= fanout else (id - 1) // fanout,
+            username=f'user{id % 50}' if id % 3 else None
+        )
+        for id in range(1, size + 1)
+    ]
+    return with_ago(build_thread(rows))
+
+
+def make_models(size):
+    started = datetime(2024, 1, 1)
+    return [
+        Comment(id=id, post_id='benchmark-post', body=f'Comment body {id}',
+                created_at=started + timedelta(minutes=id), user_id=id % 50,
+                parent_id=None)
+        for id in range(1, size + 1)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--comments', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app = create_app(TestConfig)
+    providers = {
+        'default': DefaultJSONProvider(app),
+        'model': ModelJSONProvider(app),
+        'model (unsorted)': ModelJSONProvider(app),
+    }
+    providers['model (unsorted)'].sort_keys = False
+
+    with app.app_context():
+        payloads = {
+            'thread': make_thread(args.comments),
+            'models': make_models(args.comments),
+        }
+        for name, payload in payloads.items():
+            expected = providers['default'].dumps(payload)
+            assert providers['model'].dumps(payload) == expected
+            for provider_name, provider in providers.items():
+                best = min(timeit.repeat(
+                    lambda: provider.dumps(payload, separators=(',', ':')),
+                    number=1, repeat=args.repeat
+                ))
+                print(f'{name:<8} {provider_name:<18} {best * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
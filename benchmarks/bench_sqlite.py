@@ -0,0 +1,100 @@
+"""
+Compare concurrent read/write throughput of the default SQLite setup
+with the production profile (WAL, pragmas and pool options).
+
+Run from the repository root:
+
+    python -m benchmarks.bench_sqlite --readers 8 --writers 2 --duration 5
+"""
+import argparse
+import random
+import tempfile
+import threading
+import time
+
+from app import create_app, db
+from app.main.ingest import BatchInsert
+from settings import BaseConfig, ProductionConfig
+
+
+def make_config(base, directory):
+    return type(f'Bench{base.__name__}', (base,), {
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{directory}/bench.db',
+        'RATELIMIT_ENABLED': False,
+        # Measure the database, not the thread cache
+        'THREAD_CACHE_SIZE': 0,
+    })
+
+
+def seed(app, posts, comments):
+    with app.app_context():
+        db.create_all()
+        items = [{'ref': i, 'post_id': f'post-{i % posts}',
+                  'body': f'Comment {i} ' * 10}
+                 for i in range(comments)]
+        for item in items[posts:]:
+            if random.random() < 0.7:
+                item['parent_ref'] = item['ref'] - posts * random.randint(
+                    1, min(5, item['ref'] // posts))
+        BatchInsert(items).run()
+
+
+def run(app, posts, readers, writers, duration):
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(write):
+        client = app.test_client()
+        done = errors = 0
+        while time.monotonic() < deadline:
+            post_id = f'post-{random.randrange(posts)}'
+            if write:
+                response = client.post('/new', json={'post_id': post_id,
+                                                     'body': 'New comment'})
+            else:
+                response = client.get(f'/{post_id}')
+            if response.status_code < 400:
+                done += 1
+            else:
+                errors += 1
+        with lock:
+            counts['writes' if write else 'reads'] += done
+            counts['errors'] += errors
+
+    threads = [threading.Thread(target=worker, args=(False,))
+               for _ in range(readers)]
+    threads += [threading.Thread(target=worker, args=(True,))
+                for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--posts', type=int, default=50)
+    parser.add_argument('--comments', type=int, default=20000)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=5)
+    args = parser.parse_args()
+
+    for name, base in (('default', BaseConfig),
+                       ('production', ProductionConfig)):
+        with tempfile.TemporaryDirectory() as directory:
+            app = create_app(make_config(base, directory))
+            seed(app, args.posts, args.comments)
+            counts = run(app, args.posts, args.readers, args.writers,
+                         args.duration)
+            with app.app_context():
+                db.engine.dispose()
+        print(f"{name:<11} reads/s {counts['reads'] / args.duration:8.1f}  "
+              f"writes/s {counts['writes'] / args.duration:8.1f}  "
+              f"errors {counts['errors']}")
+
+
+if __name__ == '__main__':
+    main()
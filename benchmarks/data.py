@@ -0,0 +1,88 @@
+"""
+Synthetic data for benchmarks, inserted with bulk inserts.
+"""
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from app import db
+from app.main.ingest import BatchInsert
+from app.models import Contact, User
+
+WORDS = ('sqlite', 'flask', 'python', 'thread', 'comment', 'reply', 'index',
+         'query', 'cache', 'great', 'post', 'thanks', 'agree', 'question',
+         'answer', 'database', 'fast', 'slow', 'page', 'blog')
+
+
+def make_body(rng, words=20):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def make_thread(post_id, size, depth, fanout, started, rng, users=0):
+    """
+    Build the comments of one post as BatchInsert items.
+    Replies are spread breadth-first, every comment gets up to `fanout`
+    replies and threads are at most `depth` replies deep. The number of
+    top-level comments is chosen so that the tree holds `size` comments.
+    """
+    per_root = sum(fanout ** level for level in range(depth + 1))
+    roots = max(1, -(-size // per_root))
+    items = []
+    level = []
+    for _ in range(roots):
+        if len(items) == size:
+            break
+        items.append({'ref': f'{post_id}:{len(items)}'})
+        level.append(items[-1]['ref'])
+    for _ in range(depth):
+        next_level = []
+        for parent_ref in level:
+            for _ in range(fanout):
+                if len(items) == size:
+                    break
+                items.append({'ref': f'{post_id}:{len(items)}',
+                              'parent_ref': parent_ref})
+                next_level.append(items[-1]['ref'])
+        level = next_level
+
+    for index, item in enumerate(items):
+        item['post_id'] = post_id
+        item['body'] = make_body(rng)
+        item['created_at'] = (started + timedelta(seconds=index)).isoformat()
+        if users and rng.random() < 0.7:
+            item['user_id'] = rng.randint(1, users)
+    return items
+
+
+def seed(posts, comments_per_post, depth, fanout, users=100, contacts=200,
+         password_hash='', seed=0):
+    """
+    Fill the database of the current app with users, comments and contact
+    messages. Must be called within an app context.
+    :return: dict with the number of inserted rows
+    """
+    rng = random.Random(seed)
+    started = datetime(2024, 1, 1)
+    db.session.execute(insert(User), [
+        {'username': f'user{i}', 'email': f'user{i}@example.com',
+         'password_hash': password_hash, 'is_admin': False}
+        for i in range(1, users + 1)
+    ])
+    db.session.execute(insert(Contact), [
+        {'name': f'Reader {i}', 'email': f'reader{i}@example.com',
+         'subject': 'Hello', 'message': make_body(rng, 40),
+         'created_at': started + timedelta(minutes=i), 'is_read': i % 2 == 0}
+        for i in range(contacts)
+    ])
+    db.session.commit()
+
+    inserted = 0
+    for post in range(posts):
+        items = make_thread(f'post-{post}', comments_per_post, depth, fanout,
+                            started, rng, users)
+        report = BatchInsert(items).run()
+        if report['errors']:
+            raise RuntimeError(f"Seeding failed: {report['errors'][:3]}")
+        inserted += report['inserted']
+    return {'users': users, 'contacts': contacts, 'comments': inserted}
@@ -0,0 +1,33 @@
+"""Add post_meta table
+
+Revision ID: 3f9a1c2e7b54
+Revises: c7452416d018
+Create Date: 2026-10-18 09:12:41.208614
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a1c2e7b54'
+down_revision = 'c7452416d018'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('post_meta',
+    sa.Column('post_id', sa.String(length=500), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('post_id')
+    )
+    # Backfill posts that already have comments
+    op.execute(
+        'INSERT INTO post_meta (post_id, version) '
+        'SELECT DISTINCT post_id, 1 FROM comment'
+    )
+
+
+def downgrade():
+    op.drop_table('post_meta')
@@ -0,0 +1,33 @@
+"""Add post_meta comment_count
+
+Revision ID: 5b7c0e9d2a14
+Revises: 8d2e4b61a0f3
+Create Date: 2026-10-18 10:41:52.106338
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b7c0e9d2a14'
+down_revision = '8d2e4b61a0f3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('post_meta', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('comment_count', sa.Integer(),
+                                      nullable=False, server_default='0'))
+
+    op.execute(
+        'UPDATE post_meta SET comment_count = ('
+        'SELECT COUNT(*) FROM comment '
+        'WHERE comment.post_id = post_meta.post_id)'
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('post_meta', schema=None) as batch_op:
+        batch_op.drop_column('comment_count')
@@ -0,0 +1,66 @@
+"""Add comment path and depth
+
+Revision ID: 8d2e4b61a0f3
+Revises: 3f9a1c2e7b54
+Create Date: 2026-10-18 10:03:17.554920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2e4b61a0f3'
+down_revision = '3f9a1c2e7b54'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+
+def upgrade():
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('path', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('depth', sa.Integer(), nullable=False,
+                                      server_default='0'))
+
+    # Backfill path and depth of existing comments
+    connection = op.get_bind()
+    parents = dict(connection.execute(
+        sa.text('SELECT id, parent_id FROM comment')
+    ).all())
+    paths = {}
+
+    def get_path(comment_id):
+        # Walk up to the first ancestor with a known path
+        chain = []
+        while comment_id is not None and comment_id not in paths:
+            chain.append(comment_id)
+            comment_id = parents.get(comment_id)
+        path, depth = paths.get(comment_id, ('', -1))
+        for ancestor_id in reversed(chain):
+            path, depth = f'{path}{ancestor_id:010d}/', depth + 1
+            paths[ancestor_id] = path, depth
+        return paths[chain[0]] if chain else paths[comment_id]
+
+    rows = []
+    update = sa.text('UPDATE comment SET path = :path, depth = :depth '
+                     'WHERE id = :id')
+    for comment_id in sorted(parents):
+        path, depth = get_path(comment_id)
+        rows.append({'id': comment_id, 'path': path, 'depth': depth})
+        if len(rows) == BATCH_SIZE:
+            connection.execute(update, rows)
+            rows = []
+    if rows:
+        connection.execute(update, rows)
+
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_comment_path'), ['path'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_comment_path'))
+        batch_op.drop_column('depth')
+        batch_op.drop_column('path')
@@ -0,0 +1,44 @@
+"""Add composite indexes for thread and inbox queries
+
+Revision ID: a6c3d8f15e92
+Revises: e41f6a9c3d27
+Create Date: 2026-10-18 15:22:08.934117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6c3d8f15e92'
+down_revision = 'e41f6a9c3d27'
+branch_labels = None
+depends_on = None
+
+
+# Indexes are created without batch mode, which would recreate the comment
+# table and drop the full-text index triggers.
+def upgrade():
+    op.create_index('ix_comment_post_id_created_at', 'comment',
+                    ['post_id', 'created_at'], unique=False)
+    op.create_index('ix_comment_post_id_parent_id_created_at', 'comment',
+                    ['post_id', 'parent_id', 'created_at'], unique=False)
+    op.create_index('ix_comment_parent_id_created_at', 'comment',
+                    ['parent_id', 'created_at'], unique=False)
+    op.create_index(op.f('ix_comment_user_id'), 'comment', ['user_id'],
+                    unique=False)
+    # Covered by ix_comment_post_id_created_at
+    op.drop_index('ix_comment_post_id', table_name='comment')
+    op.create_index('ix_contact_is_read_created_at', 'contact',
+                    ['is_read', 'created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_contact_is_read_created_at', table_name='contact')
+    op.create_index('ix_comment_post_id', 'comment', ['post_id'],
+                    unique=False)
+    op.drop_index(op.f('ix_comment_user_id'), table_name='comment')
+    op.drop_index('ix_comment_parent_id_created_at', table_name='comment')
+    op.drop_index('ix_comment_post_id_parent_id_created_at',
+                  table_name='comment')
+    op.drop_index('ix_comment_post_id_created_at', table_name='comment')
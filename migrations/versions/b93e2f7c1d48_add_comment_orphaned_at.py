@@ -0,0 +1,40 @@
+"""Add comment orphaned_at and its trigger
+
+Revision ID: b93e2f7c1d48
+Revises: a6c3d8f15e92
+Create Date: 2026-10-18 17:48:21.305517
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b93e2f7c1d48'
+down_revision = 'a6c3d8f15e92'
+branch_labels = None
+depends_on = None
+
+
+# Added without batch mode, which would recreate the comment table and
+# drop the full-text index triggers. Comments of authors deleted before
+# this migration can not be told apart from anonymous ones and stay
+# unmarked.
+def upgrade():
+    op.add_column('comment', sa.Column('orphaned_at', sa.DateTime(),
+                                       nullable=True))
+    op.create_index(op.f('ix_comment_orphaned_at'), 'comment',
+                    ['orphaned_at'], unique=False)
+    op.execute(
+        "CREATE TRIGGER comment_orphaned AFTER UPDATE OF user_id ON comment "
+        "WHEN old.user_id IS NOT NULL AND new.user_id IS NULL BEGIN "
+        "UPDATE comment SET orphaned_at = CURRENT_TIMESTAMP "
+        "WHERE id = new.id; "
+        "END"
+    )
+
+
+def downgrade():
+    op.execute('DROP TRIGGER IF EXISTS comment_orphaned')
+    op.drop_index(op.f('ix_comment_orphaned_at'), table_name='comment')
+    op.drop_column('comment', 'orphaned_at')
@@ -0,0 +1,27 @@
+"""Add post_meta snapshot_version
+
+Revision ID: c5d1e8a7f230
+Revises: b93e2f7c1d48
+Create Date: 2026-10-18 19:12:40.118362
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5d1e8a7f230'
+down_revision = 'b93e2f7c1d48'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('post_meta', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('snapshot_version', sa.Integer(),
+                                      nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('post_meta', schema=None) as batch_op:
+        batch_op.drop_column('snapshot_version')
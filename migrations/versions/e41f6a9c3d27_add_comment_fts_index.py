@@ -0,0 +1,65 @@
+"""Add comment full-text search index
+
+Revision ID: e41f6a9c3d27
+Revises: 5b7c0e9d2a14
+Create Date: 2026-10-18 14:05:37.512904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e41f6a9c3d27'
+down_revision = '5b7c0e9d2a14'
+branch_labels = None
+depends_on = None
+
+# Number of comments indexed per statement
+CHUNK_SIZE = 5000
+
+
+def upgrade():
+    op.execute(
+        "CREATE VIRTUAL TABLE comment_fts USING fts5("
+        "body, content='comment', content_rowid='id')"
+    )
+    op.execute(
+        "CREATE TRIGGER comment_fts_insert AFTER INSERT ON comment BEGIN "
+        "INSERT INTO comment_fts (rowid, body) VALUES (new.id, new.body); "
+        "END"
+    )
+    op.execute(
+        "CREATE TRIGGER comment_fts_delete AFTER DELETE ON comment BEGIN "
+        "INSERT INTO comment_fts (comment_fts, rowid, body) "
+        "VALUES ('delete', old.id, old.body); "
+        "END"
+    )
+    op.execute(
+        "CREATE TRIGGER comment_fts_update AFTER UPDATE OF body ON comment "
+        "BEGIN "
+        "INSERT INTO comment_fts (comment_fts, rowid, body) "
+        "VALUES ('delete', old.id, old.body); "
+        "INSERT INTO comment_fts (rowid, body) VALUES (new.id, new.body); "
+        "END"
+    )
+
+    # Index existing comments in id ranges, so that no single statement
+    # has to hold every body at once
+    connection = op.get_bind()
+    max_id = connection.execute(
+        sa.text('SELECT MAX(id) FROM comment')).scalar() or 0
+    for start in range(0, max_id, CHUNK_SIZE):
+        connection.execute(
+            sa.text('INSERT INTO comment_fts (rowid, body) '
+                    'SELECT id, body FROM comment '
+                    'WHERE id > :start AND id <= :end'),
+            {'start': start, 'end': start + CHUNK_SIZE}
+        )
+
+
+def downgrade():
+    op.execute('DROP TRIGGER comment_fts_update')
+    op.execute('DROP TRIGGER comment_fts_delete')
+    op.execute('DROP TRIGGER comment_fts_insert')
+    op.execute('DROP TABLE comment_fts')
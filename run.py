@@ -1,10 +1,14 @@
+import os
+
 from app import create_app, db
-from app.models import Comment, Contact, User
+from app.models import Comment, Contact, PostMeta, User
+from settings import config
 
 
-app = create_app()
+app = create_app(config[os.environ.get('APP_CONFIG', 'default')])
 
 
 @app.shell_context_processor
 def make_shell_context():
-    return {'db': db, 'User': User, 'Comment': Comment, 'Contact': Contact}
+    return {'db': db, 'User': User, 'Comment': Comment, 'Contact': Contact,
+            'PostMeta': PostMeta}
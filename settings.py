@@ -9,8 +9,141 @@ class BaseConfig:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE') or \
                               f"sqlite:///{BASE_DIR}/database.db"
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Read-only views (comment threads and counts) read from the "replica"
+    # bind if REPLICA_DATABASE is set, e.g. a SQLite copy refreshed with
+    # `flask comments refresh-replica`. Threads cached while the replica
+    # lags stay stale until THREAD_CACHE_TTL.
+    SQLALCHEMY_BINDS = {'replica': os.environ['REPLICA_DATABASE']} \
+        if os.environ.get('REPLICA_DATABASE') else {}
+    # PRAGMAs run on every new SQLite connection, e.g. {'foreign_keys': 'ON'}
+    SQLITE_PRAGMAS = {}
+    # JSON responses: True never pretty-prints, False always does,
+    # None pretty-prints only in debug mode. Sorting keys can be disabled
+    # for faster encoding.
+    JSON_COMPACT = None
+    JSON_SORT_KEYS = True
+    # Default and maximum number of top-level comments per page
+    PAGE_SIZE = 20
+    PAGE_SIZE_MAX = 100
+    # Serialized threads cache: number of cached responses (0 disables it)
+    # and seconds after which an entry expires. The expiration bounds how
+    # long other worker processes may serve a thread after it changed.
+    THREAD_CACHE_SIZE = 1024
+    THREAD_CACHE_TTL = 300
+    # Authenticated users cache: number of cached tokens (0 disables it)
+    # and seconds after which an entry expires. User updates invalidate
+    # entries only in the process that served them, so keep it short.
+    USER_CACHE_SIZE = 1024
+    USER_CACHE_TTL = 30
+    # Password hashing: werkzeug method with its work factor, number of
+    # hashing threads and number of hashes allowed to wait for a thread.
+    # Requests above that get 503 right away. Hashes made with another
+    # method are replaced on the next successful login.
+    PASSWORD_HASH_METHOD = 'scrypt:32768:8:1'
+    PASSWORD_HASH_WORKERS = 2
+    PASSWORD_HASH_QUEUE_DEPTH = 8
+    PASSWORD_HASH_TIMEOUT = 30
+    # Per client IP rate limits of anonymous write endpoints, on with
+    # RATELIMIT=1. Behind a reverse proxy set PROXY_HOPS as well, or every
+    # client shares the proxy's address. Buckets are kept in process
+    # memory, or in a local SQLite file (give its path) shared by every
+    # worker on the host.
+    RATELIMIT_ENABLED = os.environ.get('RATELIMIT') == '1'
+    RATELIMIT_STORAGE = 'memory'
+    RATELIMITS = {
+        'main.create_new_comment': '10/minute',
+        'main.contact_me': '3/minute',
+    }
+    # Number of trusted reverse proxies (nginx, a CDN) in front of the app.
+    # Client addresses are then read from the X-Forwarded-For header they
+    # set. Keep 0 without a proxy, clients could forge the header.
+    PROXY_HOPS = int(os.environ.get('PROXY_HOPS', 0))
+    # Maximum number of posts in one comment counts request
+    COUNTS_MAX_POSTS = 100
+    # Maximum number of comments in one batch request and number of
+    # comments inserted per transaction
+    BATCH_MAX_ITEMS = 10000
+    BATCH_CHUNK_SIZE = 2000
+    # Maximum number of ids in one bulk contact message request
+    CONTACTS_MAX_IDS = 1000
+    # Retention policies of "flask maintenance run": read contact messages
+    # and comments whose author was deleted are removed once they are older
+    # than that many days, None keeps them. Rows are removed (and copied to
+    # the RETENTION_ARCHIVE SQLite file first, if set) in transactions of
+    # RETENTION_BATCH_SIZE rows, RETENTION_BATCH_PAUSE seconds apart, so
+    # other writers get the lock in between.
+    RETENTION_READ_CONTACTS_DAYS = None
+    RETENTION_ORPHANED_COMMENTS_DAYS = None
+    RETENTION_ARCHIVE = None
+    RETENTION_BATCH_SIZE = 500
+    RETENTION_BATCH_PAUSE = 0.05
+    # Static thread snapshots: "flask comments export-snapshots" writes the
+    # thread of every post changed since its last snapshot to
+    # SNAPSHOT_DIR/<post_id>.json and .json.gz, for a web server or CDN to
+    # serve. With SNAPSHOT_ON_WRITE, a background thread also writes them
+    # SNAPSHOT_DELAY seconds after comment writes.
+    SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR')
+    SNAPSHOT_ON_WRITE = os.environ.get('SNAPSHOT_ON_WRITE') == '1'
+    SNAPSHOT_DELAY = 1.0
+    # How new comments are written: "sync" commits each one in the request,
+    # "async" queues it and answers 202 with a provisional id, "wait" queues
+    # it and answers once its batch was committed. Queued comments are
+    # inserted every WRITE_BEHIND_INTERVAL seconds or every
+    # WRITE_BEHIND_BATCH_SIZE comments, whichever comes first.
+    COMMENT_WRITE_MODE = 'sync'
+    WRITE_BEHIND_INTERVAL = 0.005
+    WRITE_BEHIND_BATCH_SIZE = 500
+    WRITE_BEHIND_WAIT_TIMEOUT = 5
+    # Number of top-level comments read at once when streaming all comments
+    STREAM_CHUNK_SIZE = 500
+    # Per request instrumentation: number and time of SQL statements, JSON
+    # serialization and handler time in a Server-Timing header and an INFO
+    # log line. Statements run at least INSTRUMENTATION_REPEAT_THRESHOLD
+    # times in one request (N+1 queries) are logged as warnings. Both go
+    # to the "app.instrumentation" logger, set to INSTRUMENTATION_LOG_LEVEL.
+    INSTRUMENTATION_ENABLED = os.environ.get('INSTRUMENTATION') == '1'
+    INSTRUMENTATION_REPEAT_THRESHOLD = 5
+    INSTRUMENTATION_LOG_LEVEL = os.environ.get('INSTRUMENTATION_LOG_LEVEL',
+                                               'INFO')
+    # Prometheus metrics at /metrics. With several worker processes set
+    # METRICS_DIR to a directory shared by the workers of the host, each
+    # one writes its metrics there every METRICS_FLUSH_INTERVAL seconds.
+    # Empty the directory when the service is restarted.
+    METRICS_ENABLED = os.environ.get('METRICS') == '1'
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = 5
+    METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                               1, 2.5, 5, 10)
+
+
+class ProductionConfig(BaseConfig):
+    # WAL lets readers run while a write is in progress, synchronous=NORMAL
+    # is durable with WAL except for the last commits on power loss.
+    # foreign_keys makes SQLite run the ON DELETE CASCADE/SET NULL rules.
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64 * 1024,
+        'foreign_keys': 'ON',
+    }
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': 10,
+        'max_overflow': 20,
+        'pool_timeout': 10,
+        'pool_recycle': 3600,
+    }
 
 
 class TestConfig(BaseConfig):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+
+
+config = {
+    'default': BaseConfig,
+    'production': ProductionConfig,
+    'testing': TestConfig,
+}
@@ -0,0 +1,46 @@
+import os
+import tempfile
+import unittest
+
+from app import create_app, db
+from settings import TestConfig
+
+
+class AppTestCase(unittest.TestCase):
+    """
+    Run the app of `config` on a SQLite database file in a temporary
+    directory, with an app context pushed and the tables created.
+    Test cases with a config of None call create_app themselves.
+    """
+
+    config = TestConfig
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.app = None
+        if self.config is not None:
+            self.create_app(self.config)
+
+    def tearDown(self):
+        if self.app is not None:
+            db.session.remove()
+            db.drop_all()
+            self.app_context.pop()
+
+    def path(self, name):
+        """Return the path of a file in the temporary directory."""
+        return os.path.join(self.directory.name, name)
+
+    def settings(self):
+        """Settings that depend on the temporary directory."""
+        database = self.path('test.db')
+        return {'SQLALCHEMY_DATABASE_URI': f'sqlite:///{database}'}
+
+    def create_app(self, config):
+        self.app = create_app(type(config.__name__, (config,),
+                                   self.settings()))
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
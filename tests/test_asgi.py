@@ -0,0 +1,129 @@
+import asyncio
+import json
+
+from app.asgi import AsyncReads
+from settings import TestConfig
+from tests.base import AppTestCase
+
+
+class AsyncConfig(TestConfig):
+    INSTRUMENTATION_ENABLED = True
+    METRICS_ENABLED = True
+
+
+class TestAsyncReads(AppTestCase):
+    config = AsyncConfig
+
+    def setUp(self):
+        super().setUp()
+        self.asgi = AsyncReads(self.app)
+
+    def tearDown(self):
+        asyncio.run(self.asgi.engine.dispose())
+        super().tearDown()
+
+    def _request(self, method, path, query=b'', headers=(), body=b''):
+        """Run one request through the ASGI app."""
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': body,
+                    'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': method, 'scheme': 'http', 'path': path,
+            'raw_path': path.encode(), 'query_string': query,
+            'root_path': '', 'server': ('localhost', 80),
+            'client': ('127.0.0.1', 1234),
+            'headers': [(b'host', b'localhost'), *headers],
+        }
+        asyncio.run(self.asgi(scope, receive, send))
+        headers = {name.decode(): value.decode()
+                   for name, value in messages[0]['headers']}
+        body = b''.join(message.get('body', b'')
+                        for message in messages[1:])
+        return messages[0]['status'], headers, body
+
+    def _create_comment(self, body, parent_id=None):
+        payload = json.dumps({'post_id': 'test-post-id', 'body': body,
+                              'parent_id': parent_id}).encode()
+        status, _, body = self._request(
+            'POST', '/new', body=payload,
+            headers=[(b'content-type', b'application/json'),
+                     (b'content-length', str(len(payload)).encode())])
+        self.assertEqual(status, 201)
+        return json.loads(body)
+
+    def test_post_comments(self):
+        # Writes go to the Flask app
+        comment = self._create_comment('Test comment')
+        self._create_comment('Reply', comment['id'])
+        self._create_comment('Second comment')
+
+        status, headers, body = self._request('GET', '/test-post-id')
+        self.assertEqual(status, 200)
+        data = json.loads(body)
+        self.assertEqual([comment['body'] for comment in data],
+                         ['Test comment', 'Second comment'])
+        self.assertEqual(data[0]['replies'][0]['body'], 'Reply')
+        self.assertIn('ago', data[0])
+        self.assertEqual(
+            data, self.app.test_client().get('/test-post-id').get_json())
+
+        status, _, _ = self._request(
+            'GET', '/test-post-id',
+            headers=[(b'if-none-match', headers['etag'].encode())])
+        self.assertEqual(status, 304)
+
+        status, _, body = self._request('GET', '/test-post-id',
+                                        query=b'limit=1')
+        page = json.loads(body)
+        self.assertEqual(len(page['comments']), 1)
+        self.assertEqual(len(page['comments'][0]['replies']), 1)
+        status, _, body = self._request(
+            'GET', '/test-post-id',
+            query=f"limit=1&cursor={page['next_cursor']}".encode())
+        self.assertEqual(json.loads(body)['comments'][0]['body'],
+                         'Second comment')
+
+        status, _, body = self._request('GET', '/test-post-id',
+                                        query=b'max_depth=0')
+        self.assertEqual(
+            json.loads(body),
+            self.app.test_client().get('/test-post-id?max_depth=0').get_json())
+
+        status, _, _ = self._request('GET', '/test-post-id',
+                                     query=b'limit=0')
+        self.assertEqual(status, 400)
+
+    def test_comment_counts(self):
+        self._create_comment('Test comment')
+        status, _, body = self._request(
+            'GET', '/counts', query=b'post_id=test-post-id&post_id=other')
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body), {'test-post-id': 1, 'other': 0})
+        status, _, _ = self._request('GET', '/counts')
+        self.assertEqual(status, 400)
+
+    def test_hooks_of_the_flask_app(self):
+        self._create_comment('Test comment')
+        status, headers, _ = self._request(
+            'GET', '/test-post-id',
+            headers=[(b'origin', b'https://blog.example.com')])
+        self.assertEqual(status, 200)
+        self.assertIn('db;dur=', headers['server-timing'])
+        self.assertIn('desc="2 queries"', headers['server-timing'])
+        self.assertEqual(headers['access-control-allow-origin'],
+                         'https://blog.example.com')
+        self._request('GET', '/counts', query=b'post_id=test-post-id')
+
+        metrics = self.app.test_client().get('/metrics').get_data(True)
+        self.assertIn('blog_requests_total{endpoint="main.post_comments",'
+                      'method="GET",status="200"} 1', metrics)
+        self.assertIn('blog_requests_total{endpoint="main.comment_counts",'
+                      'method="GET",status="200"} 1', metrics)
+        self.assertIn('blog_thread_comments_count 1', metrics)
@@ -1,7 +1,21 @@
+import json
+import os
+import sqlite3
+import tempfile
+import time
 import unittest
+from datetime import datetime
+
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import event
 
 from app import create_app, db
-from app.models import Comment, User
+from app.main.ingest import BatchInsert
+from app.main.threads import load_thread, thread_cache, with_ago
+from app.models import Comment, Contact, PostMeta, User
+from app.utils.cache import TTLCache
+from app.utils.ratelimit import (MemoryBucketStore, SQLiteBucketStore,
+                                 parse_limit)
 from settings import TestConfig
 
 
@@ -59,6 +73,13 @@ class TestCommentsAPI(unittest.TestCase):
         self.assertEqual(Comment.query.count(), 2)
         self.assertEqual(len(self.comment.replies), 1)
 
+    def test_create_new_comment_reply_parent_not_found(self):
+        payload = {'post_id': self.post_id, 'body': 'Test comment 2',
+                   'parent_id': 1000}
+        response = self.client.post('/new', json=payload)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Comment.query.count(), 1)
+
     def test_update_comment(self):
         self._login_user()
         payload = {'body': 'Test comment updated'}
@@ -73,3 +94,709 @@ class TestCommentsAPI(unittest.TestCase):
             f'{self.base_url}/{self.comment.id}/delete',)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(Comment.query.count(), 0)
+
+    def _count_queries(self, url, headers=None):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        thread_cache().clear()
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            response = self.client.get(url, headers=headers)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute',
+                         before_cursor_execute)
+        return response, len(statements)
+
+    def _add_replies(self, parent, count):
+        replies = [Comment(post_id=self.post_id, body=f'Reply {i}',
+                           parent=parent, user=self.user)
+                   for i in range(count)]
+        db.session.add_all(replies)
+        db.session.commit()
+        return replies
+
+    def test_post_comments_nested_replies(self):
+        reply = self._add_replies(self.comment, 1)[0]
+        self._add_replies(reply, 1)
+        response = self.client.get(f'/{self.post_id}')
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['user'], 'Anonymous')
+        self.assertEqual(data[0]['replies'][0]['user'], 'admin')
+        self.assertEqual(len(data[0]['replies'][0]['replies']), 1)
+
+    def test_post_comments_query_count_is_fixed(self):
+        replies = self._add_replies(self.comment, 2)
+        _, small_thread_queries = self._count_queries(f'/{self.post_id}')
+
+        for reply in replies:
+            for nested in self._add_replies(reply, 5):
+                self._add_replies(nested, 3)
+        response, large_thread_queries = self._count_queries(
+            f'/{self.post_id}')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(small_thread_queries, large_thread_queries)
+        self.assertLessEqual(large_thread_queries, 2)
+
+    def test_post_comments_pagination(self):
+        for i in range(4):
+            comment = Comment(post_id=self.post_id, body=f'Comment {i}')
+            db.session.add(comment)
+            db.session.commit()
+            self._add_replies(comment, 2)
+
+        ids, cursor = [], None
+        while True:
+            url = f'/{self.post_id}?limit=2'
+            if cursor:
+                url += f'&cursor={cursor}'
+            response = self.client.get(url)
+            data = response.get_json()
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(data['comments']), 2)
+            ids.extend(comment['id'] for comment in data['comments'])
+            cursor = data['next_cursor']
+            if cursor is None:
+                break
+
+        roots = Comment.query.filter_by(post_id=self.post_id,
+                                        parent_id=None).order_by(Comment.id)
+        self.assertEqual(ids, [comment.id for comment in roots])
+        self.assertEqual(len(data['comments'][-1]['replies']), 2)
+
+    def test_post_comments_pagination_invalid_params(self):
+        response = self.client.get(f'/{self.post_id}?limit=0')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(f'/{self.post_id}?cursor=invalid')
+        self.assertEqual(response.status_code, 400)
+
+    def test_post_comments_truncated(self):
+        replies = self._add_replies(self.comment, 3)
+        self._add_replies(replies[0], 2)
+        response = self.client.get(
+            f'/{self.post_id}?max_depth=1&max_replies=2')
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        root = data[0]
+        self.assertEqual(root['reply_count'], 3)
+        self.assertTrue(root['has_more'])
+        self.assertEqual([reply['id'] for reply in root['replies']],
+                         [replies[0].id, replies[1].id])
+        # Replies below max_depth are only counted
+        self.assertEqual(root['replies'][0]['replies'], [])
+        self.assertEqual(root['replies'][0]['reply_count'], 2)
+        self.assertTrue(root['replies'][0]['has_more'])
+        self.assertIsNone(root['replies'][0]['replies_cursor'])
+        self.assertEqual(root['replies'][1]['reply_count'], 0)
+        self.assertFalse(root['replies'][1]['has_more'])
+
+        # The rest of the replies continue at the cursor
+        response = self.client.get(f'/{self.comment.id}/replies?cursor='
+                                   f'{root["replies_cursor"]}')
+        data = response.get_json()
+        self.assertEqual([reply['id'] for reply in data['replies']],
+                         [replies[2].id])
+        self.assertIsNone(data['next_cursor'])
+
+        response = self.client.get(f'/{self.post_id}?max_depth=-1')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(f'/{self.post_id}')
+        self.assertNotIn('reply_count', response.get_json()[0])
+
+    def test_comment_replies(self):
+        replies = self._add_replies(self.comment, 3)
+        nested = self._add_replies(replies[0], 1)
+        self._add_replies(nested[0], 1)
+
+        response = self.client.get(f'/{self.comment.id}/replies?limit=2')
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([reply['id'] for reply in data['replies']],
+                         [replies[0].id, replies[1].id])
+        self.assertEqual(data['replies'][0]['replies'][0]['id'],
+                         nested[0].id)
+        self.assertEqual(
+            len(data['replies'][0]['replies'][0]['replies']), 1)
+        self.assertIn('ago', data['replies'][0])
+
+        response = self.client.get(f'/{replies[0].id}/replies?max_depth=0')
+        data = response.get_json()
+        self.assertEqual(data['replies'][0]['replies'], [])
+        self.assertEqual(data['replies'][0]['reply_count'], 1)
+
+        response = self.client.get('/12345/replies')
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(f'/{self.comment.id}/replies?limit=0')
+        self.assertEqual(response.status_code, 400)
+
+    def test_all_comments_pagination(self):
+        self._login_user()
+        db.session.add(Comment(post_id='other-post', body='Other comment'))
+        db.session.commit()
+        response = self.client.get('/?limit=1')
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data['comments']), 1)
+        response = self.client.get(f'/?limit=1&cursor={data["next_cursor"]}')
+        data = response.get_json()
+        self.assertEqual(data['comments'][0]['post_id'], 'other-post')
+        self.assertIsNone(data['next_cursor'])
+
+    def test_post_comments_cache(self):
+        response, queries = self._count_queries(f'/{self.post_id}')
+        self.assertGreater(queries, 0)
+        self.assertIn('ago', response.get_json()[0])
+        cached, _ = thread_cache().get((self.post_id, 0, None, None))
+        self.assertNotIn('ago', cached[0])
+
+        statements = []
+        event.listen(db.engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args:
+                     statements.append(statement))
+        response = self.client.get(f'/{self.post_id}')
+        # Only the post version lookup for the ETag
+        self.assertEqual(len(statements), 1)
+        self.assertIn('post_meta', statements[0])
+        self.assertIn('ago', response.get_json()[0])
+        self.assertEqual(thread_cache().stats()['hits'], 2)
+
+        payload = {'post_id': self.post_id, 'body': 'Test comment 2'}
+        self.client.post('/new', json=payload)
+        response = self.client.get(f'/{self.post_id}')
+        self.assertEqual(len(response.get_json()), 2)
+
+    def test_cache_invalidation_is_per_post(self):
+        db.session.add(Comment(post_id='other-post', body='Other comment'))
+        db.session.commit()
+        self.client.get(f'/{self.post_id}')
+        self.client.get('/other-post')
+
+        payload = {'post_id': 'other-post', 'body': 'Test comment 2'}
+        self.client.post('/new', json=payload)
+        self.assertIsNotNone(
+            thread_cache().get((self.post_id, 0, None, None)))
+        self.assertEqual(len(thread_cache()), 1)
+
+    def test_cache_follows_post_version(self):
+        response = self.client.get(f'/{self.post_id}')
+        etag = response.headers['ETag']
+        replies_url = f'/{self.comment.id}/replies'
+        self.assertEqual(self.client.get(replies_url).get_json()['replies'],
+                         [])
+        # A write that does not invalidate this process's cache, as made
+        # by another worker or the maintenance commands
+        db.session.add(Comment(post_id=self.post_id, body='Elsewhere'))
+        db.session.add(Comment(post_id=self.post_id, body='Reply',
+                               parent=self.comment))
+        PostMeta.touch(self.post_id, 2)
+        db.session.commit()
+        response = self.client.get(f'/{self.post_id}',
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.get_json()), 2)
+        self.assertEqual(
+            len(self.client.get(replies_url).get_json()['replies']), 1)
+
+    def test_cache_generations_are_bounded(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        generation = cache.generation('first')
+        for group in range(10):
+            cache.invalidate(group)
+        self.assertLessEqual(len(cache._generations), 2)
+        # Values loaded before an invalidation are still not stored
+        cache.invalidate('first')
+        cache.set('key', 'stale', group='first', generation=generation)
+        self.assertIsNone(cache.get('key'))
+        cache.clear()
+        self.assertEqual(len(cache._generations), 0)
+
+    def test_post_comments_etag(self):
+        response = self.client.get(f'/{self.post_id}')
+        etag = response.headers['ETag']
+        self.assertFalse(etag.startswith('W/'))
+
+        headers = {'If-None-Match': etag}
+        response, queries = self._count_queries(f'/{self.post_id}',
+                                                headers=headers)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(queries, 1)
+
+        payload = {'post_id': self.post_id, 'body': 'Test comment 2'}
+        self.client.post('/new', json=payload)
+        response = self.client.get(f'/{self.post_id}', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(PostMeta.get_version(self.post_id), 1)
+
+    def test_comment_path(self):
+        reply = self._add_replies(self.comment, 1)[0]
+        nested = Comment(post_id=self.post_id, body='Nested',
+                         parent_id=reply.id)
+        db.session.add(nested)
+        db.session.commit()
+        self.assertEqual(self.comment.depth, 0)
+        self.assertEqual(nested.depth, 2)
+        self.assertTrue(nested.path.startswith(reply.path))
+        self.assertEqual(nested.ancestor_ids(), [self.comment.id, reply.id])
+
+    def test_comment_subtree(self):
+        replies = self._add_replies(self.comment, 2)
+        self._add_replies(replies[0], 3)
+        other = Comment(post_id=self.post_id, body='Other')
+        db.session.add(other)
+        db.session.commit()
+
+        self.assertEqual(self.comment.subtree().count(), 6)
+        self.assertEqual(self.comment.subtree(max_depth=1).count(), 3)
+        self.assertEqual(self.comment.descendants_count(), 5)
+        self.assertEqual(replies[0].descendants_count(), 3)
+        self.assertEqual(other.descendants_count(), 0)
+
+    def test_comment_counts(self):
+        response = self.client.post(
+            '/new', json={'post_id': 'counted-post', 'body': 'Comment'})
+        parent_id = response.get_json()['id']
+        for payload in (
+            {'post_id': 'counted-post', 'body': 'Reply',
+             'parent_id': parent_id},
+            {'post_id': 'other-post', 'body': 'Other comment'},
+        ):
+            self.client.post('/new', json=payload)
+
+        response = self.client.get('/counts?post_id=counted-post'
+                                   '&post_id=other-post&post_id=no-comments')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {
+            'counted-post': 2, 'other-post': 1, 'no-comments': 0
+        })
+
+        self._login_user()
+        self.client.delete(f'/{parent_id}/delete')
+        response = self.client.post('/counts',
+                                    json={'post_ids': ['counted-post']})
+        self.assertEqual(response.get_json(), {'counted-post': 0})
+
+    def test_comment_counts_requires_post_ids(self):
+        response = self.client.get('/counts')
+        self.assertEqual(response.status_code, 400)
+
+    def test_create_comments_batch(self):
+        self._login_user()
+        payload = {'comments': [
+            {'ref': 'b', 'parent_ref': 'a', 'post_id': 'imported',
+             'body': 'Reply'},
+            {'ref': 'a', 'post_id': 'imported', 'body': 'Comment',
+             'created_at': '2020-01-01T10:00:00+00:00'},
+            {'ref': 'c', 'parent_ref': 'b', 'post_id': 'imported',
+             'body': 'Nested reply', 'user_id': self.user.id},
+            {'parent_id': self.comment.id, 'post_id': self.post_id,
+             'body': 'Reply to existing'},
+            {'post_id': 'imported'},
+            {'parent_ref': 'missing', 'post_id': 'imported', 'body': 'Lost'},
+            {'ref': 'd', 'parent_ref': 'e', 'post_id': 'imported',
+             'body': 'Cycle'},
+            {'ref': 'e', 'parent_ref': 'd', 'post_id': 'imported',
+             'body': 'Cycle'},
+        ]}
+        response = self.client.post('/batch', json=payload)
+        data = response.get_json()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(data['inserted'], 4)
+        self.assertEqual([error['index'] for error in data['errors']],
+                         [4, 5, 6, 7])
+
+        root = db.session.get(Comment, data['ids'][1])
+        self.assertEqual(root.created_at.year, 2020)
+        self.assertEqual(root.descendants_count(), 2)
+        nested = db.session.get(Comment, data['ids'][2])
+        self.assertEqual(nested.depth, 2)
+        self.assertEqual(nested.user, self.user)
+        self.assertEqual(db.session.get(Comment, data['ids'][3]).parent,
+                         self.comment)
+        self.assertEqual(PostMeta.get_counts(['imported']), {'imported': 3})
+
+        response = self.client.get('/imported')
+        self.assertEqual(len(response.get_json()[0]['replies']), 1)
+
+    def test_create_comments_batch_chunks(self):
+        items = [{'ref': 0, 'post_id': 'imported', 'body': 'Comment'}]
+        items += [{'ref': i, 'parent_ref': i - 1, 'post_id': 'imported',
+                   'body': f'Reply {i}'} for i in range(1, 10)]
+        report = BatchInsert(items, chunk_size=3).run()
+        self.assertEqual(report['inserted'], 10)
+        last = db.session.get(Comment, report['ids'][-1])
+        self.assertEqual(last.ancestor_ids(), report['ids'][:-1])
+
+    def test_create_comments_batch_field_types(self):
+        items = [{'post_id': 'imported', 'body': 'Comment', field: value}
+                 for field, value in [('ref', ['a']), ('parent_ref', {}),
+                                      ('parent_id', '1'), ('user_id', [1]),
+                                      ('user_id', True)]]
+        report = BatchInsert(items).run()
+        self.assertEqual(report['inserted'], 0)
+        self.assertEqual([error['index'] for error in report['errors']],
+                         [0, 1, 2, 3, 4])
+
+    def test_create_comments_batch_requires_admin(self):
+        self.user.is_admin = False
+        db.session.commit()
+        self._login_user()
+        response = self.client.post('/batch', json=[
+            {'post_id': 'imported', 'body': 'Comment'}
+        ])
+        self.assertEqual(response.status_code, 401)
+
+    def test_import_comments_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as file:
+            json.dump([{'ref': 1, 'post_id': 'imported', 'body': 'Comment'},
+                       {'parent_ref': 1, 'post_id': 'imported',
+                        'body': 'Reply'}], file)
+            file.flush()
+            result = self.app.test_cli_runner().invoke(
+                args=['comments', 'import', file.name])
+        self.assertIn('Imported 2 of 2 comments', result.output)
+        self.assertEqual(Comment.query.filter_by(post_id='imported').count(),
+                         2)
+
+    def test_all_comments_stream(self):
+        self._login_user()
+        self._add_replies(self.comment, 2)
+        db.session.add(Comment(post_id='other-post', body='Other comment'))
+        db.session.commit()
+        self.app.config['STREAM_CHUNK_SIZE'] = 1
+
+        response = self.client.get('/?stream=json')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.get_data(as_text=True))
+        self.assertEqual(len(data), 2)
+        self.assertEqual(len(data[0]['replies']), 2)
+
+        response = self.client.get('/?stream=ndjson')
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line)['post_id'] for line in lines],
+                         [self.post_id, 'other-post'])
+
+    def test_all_comments_stream_large_chunks(self):
+        self._login_user()
+        items = [{'ref': i, 'post_id': 'imported', 'body': f'Comment {i}'}
+                 for i in range(1200)]
+        items.append({'parent_ref': 1199, 'post_id': 'imported',
+                      'body': 'Reply'})
+        self.assertEqual(BatchInsert(items).run()['inserted'], 1201)
+        self.app.config['STREAM_CHUNK_SIZE'] = 2000
+
+        response = self.client.get('/?stream=ndjson')
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 1201)
+        self.assertEqual(json.loads(lines[-1])['replies'][0]['body'],
+                         'Reply')
+
+    def _add_contacts(self, count, email='reader@email.com', **kwargs):
+        contacts = [Contact(name='Reader', email=email, subject='Hello',
+                            message=f'Message {i}', **kwargs)
+                    for i in range(count)]
+        db.session.add_all(contacts)
+        db.session.commit()
+        return contacts
+
+    def test_contacts_inbox(self):
+        self._login_user()
+        contacts = self._add_contacts(3)
+        self._add_contacts(1, is_read=True)
+
+        response = self.client.get('/contacts?limit=2')
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['unread_count'], 3)
+        self.assertEqual([contact['id'] for contact in data['contacts']],
+                         [contacts[2].id, contacts[1].id])
+        response = self.client.get(
+            f'/contacts?limit=2&cursor={data["next_cursor"]}')
+        data = response.get_json()
+        self.assertEqual([contact['id'] for contact in data['contacts']],
+                         [contacts[0].id])
+        self.assertIsNone(data['next_cursor'])
+
+        # Without pagination, the list of all matching messages
+        response = self.client.get('/contacts')
+        self.assertEqual([contact['id'] for contact in response.get_json()],
+                         [contacts[2].id, contacts[1].id, contacts[0].id])
+        response = self.client.get('/contacts?status=all')
+        self.assertEqual(len(response.get_json()), 4)
+        response = self.client.get('/contacts?status=spam')
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_contacts(self):
+        self._login_user()
+        old = self._add_contacts(
+            2, email='spam@email.com', created_at=datetime(2024, 1, 1))
+        spam = {contact.id for contact in self._add_contacts(
+            3, email='spam@email.com', created_at=datetime(2024, 6, 1))}
+        other = self._add_contacts(2)
+
+        response = self.client.post('/contacts/read',
+                                    json={'ids': [other[0].id, old[0].id]})
+        self.assertEqual(response.get_json(), {'updated': 2})
+        response = self.client.post('/contacts/read',
+                                    json={'ids': [other[0].id]})
+        self.assertEqual(response.get_json(), {'updated': 0})
+
+        response = self.client.post('/contacts/delete', json={
+            'email': 'spam@email.com', 'since': '2024-03-01'})
+        self.assertEqual(response.get_json(), {'deleted': 3})
+        remaining = {contact.id for contact in Contact.query}
+        self.assertFalse(remaining & spam)
+        self.assertEqual(len(remaining), 4)
+
+        response = self.client.post('/contacts/delete', json={
+            'status': 'read', 'until': '2025-01-01T00:00:00+00:00'})
+        self.assertEqual(response.get_json(), {'deleted': 1})
+
+        for payload in ({}, {'ids': 'all'}, {'since': 'yesterday'},
+                        {'email': ''}, {'status': 'all'}, {'ids': [True]}):
+            response = self.client.post('/contacts/delete', json=payload)
+            self.assertEqual(response.status_code, 400, payload)
+        self.assertEqual(Contact.query.count(), 3)
+
+    def test_delete_contact(self):
+        contact = self._add_contacts(1)[0]
+        response = self.client.delete(f'/delete-contact/{contact.id}')
+        self.assertEqual(response.status_code, 401)
+        self._login_user()
+        # A link or image must not be able to delete messages
+        response = self.client.get(f'/delete-contact/{contact.id}')
+        self.assertEqual(response.status_code, 405)
+        response = self.client.delete(f'/delete-contact/{contact.id}')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(db.session.get(Contact, contact.id))
+
+    def test_search(self):
+        for post_id, body in [(self.post_id, 'Great post about SQLite'),
+                              (self.post_id, 'SQLite and SQLite again'),
+                              ('other-post', 'I prefer Postgres to SQLite'),
+                              (self.post_id, 'Nothing relevant')]:
+            self.client.post('/new', json={'post_id': post_id, 'body': body})
+
+        response = self.client.get('/search?q=sqlite')
+        results = response.get_json()['comments']
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0]['body'], 'SQLite and SQLite again')
+
+        response = self.client.get(f'/search?q=sqlite&post_id={self.post_id}')
+        self.assertEqual(len(response.get_json()['comments']), 2)
+        response = self.client.get('/search?q=sql*')
+        self.assertEqual(len(response.get_json()['comments']), 3)
+        response = self.client.get('/search?q="unbalanced AND')
+        self.assertEqual(response.get_json()['comments'], [])
+
+        # Pages follow the ranking without gaps or duplicates
+        ids, cursor = [], ''
+        while cursor is not None:
+            data = self.client.get(
+                f'/search?q=sqlite&limit=1&cursor={cursor}').get_json()
+            ids.extend(comment['id'] for comment in data['comments'])
+            cursor = data['next_cursor']
+        self.assertEqual(ids, [comment['id'] for comment in results])
+
+    def test_search_index_follows_changes(self):
+        comment = Comment.query.first()
+        comment.body = 'Edited body'
+        db.session.commit()
+        search = lambda q: self.client.get(f'/search?q={q}').get_json()
+        self.assertEqual(search('test')['comments'], [])
+        self.assertEqual(len(search('edited')['comments']), 1)
+
+        db.session.delete(comment)
+        db.session.commit()
+        self.assertEqual(search('edited')['comments'], [])
+        self.assertEqual(self.client.get('/search?q=').status_code, 400)
+
+    def _query_plans(self, requests):
+        """
+        Make the requests and return the query plan of every SELECT, UPDATE
+        and DELETE they ran, as tuples (statement, plan lines).
+        """
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters,
+                                  context, executemany):
+            if not executemany and statement.split()[0].upper() in (
+                    'SELECT', 'UPDATE', 'DELETE'):
+                statements.append((statement, parameters))
+
+        thread_cache().clear()
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            for method, url, payload in requests:
+                response = self.client.open(url, method=method, json=payload)
+                self.assertLess(response.status_code, 400, url)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute',
+                         before_cursor_execute)
+
+        connection = db.session.connection()
+        return [
+            (statement, [row[-1] for row in connection.exec_driver_sql(
+                f'EXPLAIN QUERY PLAN {statement}', parameters)])
+            for statement, parameters in statements
+        ]
+
+    def test_query_plans_use_indexes(self):
+        self._login_user()
+        reply = self._add_replies(self.comment, 2)[0]
+        self._add_replies(reply, 1)
+        db.session.add(Comment(post_id=self.post_id, body='Second comment'))
+        db.session.commit()
+        self.client.post('/new-contact', json={
+            'name': 'Test', 'email': 'test@email.com', 'subject': 'Test',
+            'message': 'Test message'})
+        cursor = self.client.get(
+            f'/{self.post_id}?limit=1').get_json()['next_cursor']
+        page = self.client.get('/?limit=1').get_json()['next_cursor']
+
+        # GET / without pagination reads every comment, a table scan
+        # followed by a sort is the cheapest way to do that.
+        plans = self._query_plans([
+            ('GET', f'/{self.post_id}', None),
+            ('GET', f'/{self.post_id}?limit=1&cursor={cursor}', None),
+            ('GET', f'/{self.comment.id}/replies?limit=1', None),
+            ('GET', f'/?limit=1&cursor={page}', None),
+            ('GET', '/?stream=ndjson', None),
+            ('GET', f'/counts?post_id={self.post_id}', None),
+            ('GET', '/search?q=reply', None),
+            ('POST', '/new', {'post_id': self.post_id, 'body': 'Reply',
+                              'parent_id': reply.id}),
+            ('PUT', f'/{reply.id}/update', {'body': 'Edited'}),
+            ('DELETE', f'/{reply.id}/delete', None),
+            ('GET', '/contacts', None),
+            ('GET', '/read-contact/1', None),
+            ('POST', '/contacts/read', {'ids': [1]}),
+            ('POST', '/contacts/delete', {'email': 'test@email.com'}),
+        ])
+        self.assertGreater(len(plans), 15)
+        for statement, plan in plans:
+            with self.subTest(statement=statement):
+                for line in plan:
+                    self.assertFalse(
+                        line.startswith('SCAN ') and 'USING' not in line
+                        and 'VIRTUAL TABLE' not in line, plan)
+                # Replies of a page come from several path index ranges
+                # and search results are ordered by their computed rank,
+                # both sort only the rows they return.
+                if ('comment.path > ?' not in statement
+                        and 'bm25' not in statement):
+                    self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan)
+
+    def test_json_provider_matches_default(self):
+        default = DefaultJSONProvider(self.app)
+        payload = {'comment': self.comment, 'user': self.user,
+                   'thread': with_ago(load_thread(self.post_id))}
+        self.assertEqual(self.app.json.dumps(payload),
+                         default.dumps(payload))
+
+
+class RateLimitConfig(TestConfig):
+    RATELIMIT_ENABLED = True
+    RATELIMITS = {'main.create_new_comment': '2/minute'}
+
+
+class ProxyRateLimitConfig(RateLimitConfig):
+    PROXY_HOPS = 1
+
+
+class TestRateLimit(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(RateLimitConfig)
+        self.client = self.app.test_client()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _create_comments(self, count, client=None):
+        payload = {'post_id': 'test-post-id', 'body': 'Test comment'}
+        return [(client or self.client).post('/new', json=payload)
+                for _ in range(count)]
+
+    def test_rate_limit(self):
+        responses = self._create_comments(3)
+        self.assertEqual([response.status_code for response in responses],
+                         [201, 201, 429])
+        self.assertEqual(responses[-1].headers['Retry-After'], '30')
+        self.assertEqual(Comment.query.count(), 2)
+
+        # Other clients and endpoints have their own buckets
+        other = self.app.test_client()
+        other.environ_base['REMOTE_ADDR'] = '10.0.0.2'
+        self.assertEqual(self._create_comments(1, other)[0].status_code, 201)
+        self.assertEqual(self.client.get('/test-post-id').status_code, 200)
+
+    def test_rate_limit_shared_sqlite_store(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'ratelimit.db')
+            first = SQLiteBucketStore(path)
+            second = SQLiteBucketStore(path)
+            rate, burst = parse_limit('2/minute')
+            self.assertEqual(first.take('key', rate, burst), 0)
+            self.assertEqual(second.take('key', rate, burst), 0)
+            self.assertGreater(first.take('key', rate, burst), 0)
+            self.assertEqual(second.take('other-key', rate, burst), 0)
+
+            # Buckets idle for longer than a refill are swept
+            third = SQLiteBucketStore(path, max_idle=burst / rate)
+            third.sweep(time.time() + 31)
+            self.assertGreater(first.take('key', rate, burst), 0)
+            third.sweep(time.time() + 61)
+            self.assertEqual(first._connect().execute(
+                'SELECT count(*) FROM bucket').fetchone(), (0,))
+
+    def test_rate_limit_behind_proxy(self):
+        app = create_app(ProxyRateLimitConfig)
+        with app.app_context():
+            db.create_all()
+            responses = [app.test_client().post(
+                '/new', json={'post_id': 'test-post-id', 'body': 'Test'},
+                headers={'X-Forwarded-For': f'10.0.0.{i % 2}'})
+                for i in range(4)]
+            db.session.remove()
+            db.drop_all()
+        # Clients behind the proxy have their own buckets
+        self.assertEqual([response.status_code for response in responses],
+                         [201] * 4)
+
+    def test_rate_limit_store_busy(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'ratelimit.db')
+            store = type('BusyStore', (SQLiteBucketStore,),
+                         {'timeout': 0.01})(path)
+            self.app.extensions['rate_limiter'].store = store
+            locker = sqlite3.connect(path, isolation_level=None)
+            locker.execute('BEGIN IMMEDIATE')
+            try:
+                # Let through instead of failing
+                self.assertEqual(self._create_comments(1)[0].status_code,
+                                 201)
+            finally:
+                locker.execute('ROLLBACK')
+                locker.close()
+
+    def test_rate_limit_memory_store_is_bounded(self):
+        store = MemoryBucketStore()
+        store.max_keys = 2
+        rate, burst = parse_limit('1/minute')
+        for key in ('first', 'second', 'first', 'third'):
+            store.take(key, rate, burst)
+        # The least recently used bucket made room for the new one
+        self.assertEqual(list(store._buckets), ['first', 'third'])
+        self.assertGreater(store.take('first', rate, burst), 0)
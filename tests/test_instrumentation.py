@@ -0,0 +1,74 @@
+import json
+from logging.handlers import BufferingHandler
+
+from app import create_app, db
+from app.models import Comment, User
+from settings import TestConfig
+from tests.base import AppTestCase
+
+
+class InstrumentationConfig(TestConfig):
+    INSTRUMENTATION_ENABLED = True
+    INSTRUMENTATION_REPEAT_THRESHOLD = 3
+
+
+class TestInstrumentation(AppTestCase):
+    config = InstrumentationConfig
+
+    def setUp(self):
+        super().setUp()
+        self.user = User(username='admin', email='admin@email.com',
+                         is_admin=True)
+        self.user.set_password('admin_password')
+        self.comment = Comment(post_id='test-post-id', body='Test comment')
+        db.session.add_all([self.user, self.comment])
+        db.session.commit()
+        self.logger = self.app.extensions['instrumentation'].logger
+
+    def test_server_timing(self):
+        with self.assertLogs(self.logger, 'INFO') as logs:
+            response = self.client.get('/test-post-id')
+        self.assertEqual(response.status_code, 200)
+        timing = response.headers['Server-Timing']
+        self.assertIn('desc="2 queries"', timing)
+        self.assertIn('serialize;dur=', timing)
+        self.assertIn('handler;dur=', timing)
+
+        line = json.loads(logs.records[0].args[0])
+        self.assertEqual(line['endpoint'], 'main.post_comments')
+        self.assertEqual(line['queries'], 2)
+        self.assertEqual(line['repeated_queries'], 0)
+
+    def test_logged_without_debug(self):
+        self.assertFalse(self.app.debug)
+        handler = BufferingHandler(10)
+        self.app.logger.addHandler(handler)
+        try:
+            self.client.get('/test-post-id')
+        finally:
+            self.app.logger.removeHandler(handler)
+        self.assertEqual([record.name for record in handler.buffer],
+                         ['app.instrumentation'])
+        self.assertEqual(handler.buffer[0].levelname, 'INFO')
+
+    def test_repeated_statements(self):
+        replies = [Comment(post_id='test-post-id', body=f'Reply {i}',
+                           parent=self.comment) for i in range(3)]
+        db.session.add_all(replies)
+        db.session.commit()
+        db.session.expire_all()
+
+        self.client.post('/login', json={'email': 'admin@email.com',
+                                         'password': 'admin_password'})
+        with self.assertLogs(self.logger, 'WARNING') as logs:
+            # to_dict lazy loads the replies of the comment and of every
+            # reply with the same statement
+            self.client.put(f'/{self.comment.id}/update',
+                            json={'body': 'Edited'})
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(logs.records[0].args[0], 4)
+
+    def test_disabled(self):
+        app = create_app(TestConfig)
+        response = app.test_client().get('/search?q=')
+        self.assertNotIn('Server-Timing', response.headers)
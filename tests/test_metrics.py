@@ -0,0 +1,83 @@
+import atexit
+import json
+import os
+import threading
+
+from app import db
+from app.models import Comment
+from settings import TestConfig
+from tests.base import AppTestCase
+
+
+class MetricsConfig(TestConfig):
+    METRICS_ENABLED = True
+
+
+class TestMetrics(AppTestCase):
+    config = MetricsConfig
+
+    def settings(self):
+        return {**super().settings(), 'METRICS_DIR': self.path('metrics')}
+
+    def setUp(self):
+        super().setUp()
+        db.session.add(Comment(post_id='test-post-id', body='Test comment'))
+        db.session.commit()
+
+    def tearDown(self):
+        atexit.unregister(self.app.extensions['metrics']._flush_at_exit)
+        super().tearDown()
+
+    def test_metrics(self):
+        self.client.get('/test-post-id')
+        self.client.get('/test-post-id')
+        self.client.get('/search?q=')
+        metrics = self.client.get('/metrics').get_data(as_text=True)
+
+        self.assertIn('# TYPE blog_requests_total counter', metrics)
+        self.assertIn('blog_requests_total{endpoint="main.post_comments",'
+                      'method="GET",status="200"} 2', metrics)
+        self.assertIn('blog_requests_total{endpoint="main.search",'
+                      'method="GET",status="400"} 1', metrics)
+        self.assertIn('blog_request_duration_seconds_count'
+                      '{endpoint="main.post_comments"} 2', metrics)
+        self.assertIn('blog_request_duration_seconds_bucket'
+                      '{endpoint="main.post_comments",le="+Inf"} 2', metrics)
+        self.assertIn('blog_thread_comments_bucket{le="1"} 2', metrics)
+        self.assertIn('blog_cache_hits_total{cache="thread_cache"} 1',
+                      metrics)
+        self.assertNotIn('endpoint="metrics"', metrics)
+
+    def test_shards_of_exited_threads_are_merged(self):
+        collector = self.app.extensions['metrics']
+        threads = [threading.Thread(target=collector.inc,
+                                    args=('blog_requests_total', ()))
+                   for _ in range(20)]
+        for thread in threads:
+            thread.start()
+            thread.join()
+        self.assertIn(['blog_requests_total', (), 20],
+                      collector.snapshot()['counters'])
+        # Only the shard of this thread is left
+        self.assertLessEqual(len(collector._shards), 1)
+
+    def test_metrics_of_other_processes(self):
+        self.client.get('/test-post-id')
+        metrics = self.app.extensions['metrics']
+        metrics.flush()
+        self.assertEqual(os.listdir(self.path('metrics')),
+                         [f'metrics-{os.getpid()}.json'])
+
+        # A worker process that has exited
+        snapshot = metrics.snapshot()
+        snapshot['pid'] = 2 ** 22 + 1
+        with open(os.path.join(self.path('metrics'),
+                               'metrics-other.json'), 'w') as file:
+            json.dump(snapshot, file)
+
+        text = self.client.get('/metrics').get_data(as_text=True)
+        self.assertIn('blog_requests_total{endpoint="main.post_comments",'
+                      'method="GET",status="200"} 2', text)
+        self.assertIn(f'blog_cache_entries{{cache="thread_cache",'
+                      f'pid="{os.getpid()}"}} 1', text)
+        self.assertNotIn(f'pid="{2 ** 22 + 1}"', text)
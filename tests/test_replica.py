@@ -0,0 +1,77 @@
+from app import db
+from app.models import Comment, User
+from app.utils.replica import read_replica
+from tests.base import AppTestCase
+
+
+class TestReadReplica(AppTestCase):
+    def settings(self):
+        replica = self.path('replica.db')
+        return {**super().settings(),
+                'SQLALCHEMY_BINDS': {'replica': f'sqlite:///{replica}'}}
+
+    def setUp(self):
+        super().setUp()
+        self.replica = db.engines['replica']
+        db.metadata.create_all(self.replica)
+
+    def tearDown(self):
+        db.metadata.drop_all(self.replica)
+        super().tearDown()
+
+    def _create_comment(self):
+        payload = {'post_id': 'test-post-id', 'body': 'Test comment'}
+        return self.client.post('/new', json=payload)
+
+    def test_reads_from_replica(self):
+        self.assertEqual(self._create_comment().status_code, 201)
+        self.assertEqual(Comment.query.count(), 1)
+
+        # The comment was written to the primary only
+        response = self.client.get('/test-post-id')
+        self.assertIn('message', response.get_json())
+        response = self.client.get('/counts?post_id=test-post-id')
+        self.assertEqual(response.get_json(), {'test-post-id': 0})
+
+        self.app.test_cli_runner().invoke(args=['comments',
+                                                'refresh-replica'])
+        response = self.client.get('/test-post-id')
+        self.assertEqual(len(response.get_json()), 1)
+        response = self.client.get('/counts?post_id=test-post-id')
+        self.assertEqual(response.get_json(), {'test-post-id': 1})
+
+    def test_stream_reads_from_replica(self):
+        user = User(username='admin', email='admin@email.com', is_admin=True)
+        user.set_password('admin_password')
+        db.session.add(user)
+        db.session.commit()
+        self.client.post('/login', json={'email': 'admin@email.com',
+                                         'password': 'admin_password'})
+        self._create_comment()
+
+        # The body is read after the view returned
+        response = self.client.get('/?stream=ndjson')
+        self.assertEqual(response.get_data(), b'')
+        self.app.test_cli_runner().invoke(args=['comments',
+                                                'refresh-replica'])
+        response = self.client.get('/?stream=ndjson')
+        self.assertEqual(len(response.get_data().splitlines()), 1)
+        # Writes of the next requests go to the primary again
+        self.assertEqual(self._create_comment().status_code, 201)
+        self.assertEqual(Comment.query.count(), 2)
+
+    def test_read_after_write_on_primary(self):
+        self._create_comment()
+
+        @read_replica
+        def write_then_read():
+            before = Comment.query.count()
+            db.session.add(Comment(post_id='test-post-id', body='Test'))
+            return before, Comment.query.count()
+
+        with self.app.test_request_context():
+            self.assertEqual(write_then_read(), (0, 2))
+            db.session.rollback()
+
+        # Outside of read-only views everything runs on the primary
+        self.assertEqual(Comment.query.count(), 1)
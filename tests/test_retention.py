@@ -0,0 +1,120 @@
+import sqlite3
+from datetime import datetime
+
+from sqlalchemy import text
+
+from app import db
+from app.models import Comment, Contact, PostMeta, User
+from settings import ProductionConfig, TestConfig
+from tests.base import AppTestCase
+
+
+class MaintenanceConfig(TestConfig):
+    SQLITE_PRAGMAS = ProductionConfig.SQLITE_PRAGMAS
+    RETENTION_BATCH_PAUSE = 0
+
+
+class TestMaintenance(AppTestCase):
+    config = MaintenanceConfig
+
+    def setUp(self):
+        super().setUp()
+        self.author = User(username='author', email='author@email.com')
+        self.reader = User(username='reader', email='reader@email.com')
+        root = Comment(post_id='test-post-id', body='Root',
+                       user=self.author)
+        reply = Comment(post_id='test-post-id', body='Reply',
+                        user=self.author, parent=root)
+        self.kept = [
+            Comment(post_id='test-post-id', body='Anonymous'),
+            Comment(post_id='test-post-id', body='Reader',
+                    user=self.reader),
+        ]
+        # Orphaned, but kept for the reply of another user
+        self.kept.append(Comment(post_id='other-post', body='Parent',
+                                 user=self.author))
+        self.kept.append(Comment(post_id='other-post', body='Answer',
+                                 user=self.reader, parent=self.kept[-1]))
+        db.session.add_all([root, reply, *self.kept])
+        old = datetime(2020, 1, 1)
+        db.session.add_all([
+            Contact(name='A', email='a@email.com', message='Old read',
+                    created_at=old, is_read=True),
+            Contact(name='B', email='b@email.com', message='Old unread',
+                    created_at=old),
+            Contact(name='C', email='c@email.com', message='New read',
+                    is_read=True),
+        ])
+        db.session.commit()
+        PostMeta.touch_many({'test-post-id': 4, 'other-post': 2})
+        self.kept = sorted(comment.body for comment in self.kept)
+        db.session.execute(text('DELETE FROM user WHERE id = :id'),
+                           {'id': self.author.id})
+        db.session.commit()
+
+    def tearDown(self):
+        # With foreign keys on, SQLite can not drop the comment table while
+        # replies cascade from rows of the same table
+        db.session.remove()
+        db.session.execute(text('DELETE FROM comment'))
+        db.session.commit()
+        super().tearDown()
+
+    def _run(self, *args):
+        result = self.app.test_cli_runner().invoke(
+            args=['maintenance', 'run', '--contacts-days', '30',
+                  '--comments-days', '0', '--batch-size', '1', *args])
+        self.assertEqual(result.exit_code, 0, result.output)
+        db.session.remove()
+        return result.output
+
+    def test_retention(self):
+        output = self._run('--vacuum', '--analyze')
+        self.assertIn('Deleted 1 contact messages and 2 comments', output)
+        self.assertIn('Reclaimed ', output)
+
+        self.assertEqual(sorted(comment.body for comment in Comment.query),
+                         self.kept)
+        self.assertEqual(
+            sorted(contact.message for contact in Contact.query),
+            ['New read', 'Old unread'])
+        self.assertEqual(PostMeta.get_counts(['test-post-id', 'other-post']),
+                         {'test-post-id': 2, 'other-post': 2})
+        # Removed comments are gone from the full-text index
+        self.assertEqual(db.session.execute(text(
+            "SELECT COUNT(*) FROM comment_fts WHERE comment_fts MATCH 'root'"
+        )).scalar(), 0)
+
+        output = self._run()
+        self.assertIn('Deleted 0 contact messages and 0 comments', output)
+
+    def test_archive(self):
+        archive = self.path('archive.db')
+        output = self._run('--archive', archive)
+        self.assertIn('Archived 1 contact messages and 2 comments', output)
+        self.assertEqual(Comment.query.count(), len(self.kept))
+
+        db.session.execute(text('ATTACH DATABASE :path AS archive'),
+                           {'path': archive})
+        self.assertEqual(sorted(db.session.execute(text(
+            'SELECT body FROM archive.comment')).scalars()),
+            ['Reply', 'Root'])
+        self.assertEqual(list(db.session.execute(text(
+            'SELECT message FROM archive.contact')).scalars()),
+            ['Old read'])
+        db.session.execute(text('DETACH DATABASE archive'))
+
+    def test_archive_created_before_a_migration(self):
+        archive = self.path('archive.db')
+        with sqlite3.connect(archive) as connection:
+            connection.execute('CREATE TABLE contact (id INTEGER, '
+                               'name VARCHAR, message TEXT)')
+        connection.close()
+        output = self._run('--archive', archive)
+        self.assertIn('Archived 1 contact messages and 2 comments', output)
+
+        with sqlite3.connect(archive) as connection:
+            self.assertEqual(connection.execute(
+                'SELECT message, is_read FROM contact').fetchall(),
+                [('Old read', 1)])
+        connection.close()
@@ -0,0 +1,104 @@
+import atexit
+import gzip
+import json
+import os
+
+from sqlalchemy import update
+
+from app import db
+from app.models import PostMeta
+from settings import TestConfig
+from tests.base import AppTestCase
+
+
+class SnapshotConfig(TestConfig):
+    SNAPSHOT_DELAY = 0.05
+
+
+class WriteSnapshotConfig(SnapshotConfig):
+    SNAPSHOT_ON_WRITE = True
+
+
+class TestSnapshots(AppTestCase):
+    config = None
+
+    def setUp(self):
+        super().setUp()
+        self.snapshots = self.path('snapshots')
+
+    def settings(self):
+        return {**super().settings(), 'SNAPSHOT_DIR': self.snapshots}
+
+    def tearDown(self):
+        if writer := self.app.extensions.get('snapshot_writer'):
+            writer.stop()
+            atexit.unregister(writer.stop)
+        super().tearDown()
+
+    def _create_comment(self, post_id, body):
+        response = self.client.post('/new', json={'post_id': post_id,
+                                                  'body': body})
+        self.assertEqual(response.status_code, 201)
+        return response.get_json()
+
+    def _snapshot(self, name):
+        path = os.path.join(self.snapshots, f'{name}.json')
+        with open(path, 'rb') as file:
+            data = file.read()
+        with gzip.open(f'{path}.gz') as file:
+            self.assertEqual(file.read(), data)
+        return json.loads(data)
+
+    def _export(self, *args):
+        result = self.app.test_cli_runner().invoke(
+            args=['comments', 'export-snapshots', *args])
+        self.assertEqual(result.exit_code, 0, result.output)
+        return result.output
+
+    def test_export_changed_posts(self):
+        self.create_app(SnapshotConfig)
+        self._create_comment('first-post', 'First')
+        self._create_comment('second/post', 'Second')
+        self.assertIn('Exported 2 snapshots', self._export())
+
+        snapshot = self._snapshot('first-post')
+        self.assertEqual(snapshot['post_id'], 'first-post')
+        self.assertEqual(snapshot['version'], 1)
+        self.assertEqual([comment['body'] for comment in
+                          snapshot['comments']], ['First'])
+        self.assertEqual(self._snapshot('second%2Fpost')['post_id'],
+                         'second/post')
+
+        # Only posts changed since the last export are written again
+        self.assertIn('Exported 0 snapshots', self._export())
+        self._create_comment('second/post', 'Another')
+        self.assertIn('Exported 1 snapshots', self._export())
+        self.assertEqual(len(self._snapshot('second%2Fpost')['comments']), 2)
+        self.assertIn('Exported 2 snapshots', self._export('--all'))
+
+    def test_snapshot_version_never_goes_back(self):
+        self.create_app(SnapshotConfig)
+        self._create_comment('test-post-id', 'Test comment')
+        # As recorded by an overlapping export of a newer version
+        db.session.execute(update(PostMeta).values(snapshot_version=5))
+        db.session.commit()
+        self.assertIn('Exported 1 snapshots', self._export('--all'))
+        self.assertEqual(db.session.get(PostMeta, 'test-post-id')
+                         .snapshot_version, 5)
+        self.assertEqual(sorted(os.listdir(self.snapshots)),
+                         ['test-post-id.json', 'test-post-id.json.gz'])
+
+    def test_write_hook(self):
+        self.create_app(WriteSnapshotConfig)
+        writer = self.app.extensions['snapshot_writer']
+        # The thread is started by the first write of the process
+        self.assertIsNone(writer._thread)
+        comment = self._create_comment('test-post-id', 'Test comment')
+        self.assertTrue(writer._thread.is_alive())
+        self._create_comment('test-post-id', 'Second comment')
+        # Stopping writes the queued snapshots
+        self.app.extensions['snapshot_writer'].stop()
+        snapshot = self._snapshot('test-post-id')
+        self.assertEqual(snapshot['version'], 2)
+        self.assertEqual(snapshot['comments'][0]['id'], comment['id'])
+        self.assertIn('Exported 0 snapshots', self._export())
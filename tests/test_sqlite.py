@@ -0,0 +1,35 @@
+from sqlalchemy import text
+
+from app import db
+from app.models import Comment, User
+from settings import ProductionConfig, TestConfig
+from tests.base import AppTestCase
+
+
+class PragmasConfig(TestConfig):
+    SQLITE_PRAGMAS = ProductionConfig.SQLITE_PRAGMAS
+    SQLALCHEMY_ENGINE_OPTIONS = ProductionConfig.SQLALCHEMY_ENGINE_OPTIONS
+
+
+class TestSQLitePragmas(AppTestCase):
+    config = PragmasConfig
+
+    def test_pragmas(self):
+        pragma = lambda name: db.session.execute(
+            text(f'PRAGMA {name}')).scalar()
+        self.assertEqual(pragma('journal_mode'), 'wal')
+        self.assertEqual(pragma('synchronous'), 1)
+        self.assertEqual(pragma('foreign_keys'), 1)
+        self.assertEqual(pragma('busy_timeout'), 5000)
+
+    def test_foreign_key_actions(self):
+        user = User(username='test', email='test@email.com')
+        db.session.add(user)
+        db.session.commit()
+        db.session.add(Comment(post_id='test-post-id', body='Test comment',
+                               user=user))
+        db.session.commit()
+
+        db.session.execute(text('DELETE FROM user'))
+        db.session.commit()
+        self.assertIsNone(Comment.query.one().user_id)
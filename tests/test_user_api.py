@@ -1,8 +1,13 @@
+import threading
 import unittest
 
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+
 from app import create_app, db
 from app.auth.tokens import create_token
 from app.models import User
+from app.utils.hashing import HashingOverloaded, PasswordHasher
 from settings import TestConfig
 
 
@@ -94,3 +99,112 @@ class TestUserAPI(unittest.TestCase):
             json={'email': 'testupdated', 'password':'test123updated'}
         )
         self.assertEqual(login_with_new_password_response.status_code, 200)
+
+    def _count_queries(self, url):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            response = self.client.get(url)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute',
+                         before_cursor_execute)
+        return response, len(statements)
+
+    def test_cached_user_skips_query(self):
+        self._login_user()
+        response, queries = self._count_queries('/user')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, 1)
+
+        response, queries = self._count_queries('/user')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, 0)
+        self.assertEqual(response.get_json()['email'], self.user.email)
+
+    def test_user_update_invalidates_cached_token(self):
+        self._login_user()
+        old_token = self.client.get_cookie('access').value
+        self.client.get('/user')
+
+        payload = {'username': 'testupdated',
+                   'email': 'testupdated@email.com'}
+        response = self.client.patch('/user-update', json=payload)
+        self.assertEqual(response.status_code, 200)
+        db.session.expire_all()
+        self.assertEqual(self.user.username, 'testupdated')
+
+        self.client.set_cookie('access', old_token)
+        response = self.client.get('/user')
+        self.assertEqual(response.status_code, 401)
+
+    def test_user_register_username_in_use(self):
+        payload = {
+            'username': 'test',
+            'email': 'john@email.com',
+            'password': 'test123',
+            'password_confirm': 'test123'
+        }
+        response = self.client.post('/register', json=payload)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['message'], 'Username is in use')
+
+    def test_login_rehashes_password(self):
+        self.user.password_hash = generate_password_hash('testpassword',
+                                                         'pbkdf2:sha256:500')
+        db.session.commit()
+        response = self._login_user()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(self.user.password_hash.startswith(
+            self.app.config['PASSWORD_HASH_METHOD'] + '$'))
+        self.assertTrue(self.user.check_password('testpassword'))
+
+    def test_password_hashing_overload(self):
+        hasher = PasswordHasher('pbkdf2:sha256:1000', workers=1,
+                                queue_depth=0)
+        started, release = threading.Event(), threading.Event()
+
+        def busy():
+            started.set()
+            release.wait()
+
+        worker = threading.Thread(target=hasher._run, args=(busy,))
+        worker.start()
+        started.wait()
+        try:
+            with self.assertRaises(HashingOverloaded):
+                hasher.hash('password')
+        finally:
+            release.set()
+            worker.join()
+        self.assertTrue(hasher.check(hasher.hash('password'), 'password'))
+        hasher.shutdown()
+
+    def test_password_hashing_timeout(self):
+        hasher = PasswordHasher('pbkdf2:sha256:1000', workers=1,
+                                queue_depth=0, timeout=0.01)
+        release = threading.Event()
+        try:
+            with self.assertRaises(HashingOverloaded):
+                hasher._run(release.wait)
+        finally:
+            release.set()
+        hasher.shutdown()
+
+    def test_needs_rehash_with_default_parameters(self):
+        hasher = PasswordHasher('pbkdf2', workers=1, queue_depth=0)
+        self.assertFalse(hasher.needs_rehash(hasher.hash('password')))
+        self.assertTrue(hasher.needs_rehash(
+            generate_password_hash('password', 'pbkdf2:sha256:1000')))
+        hasher.shutdown()
+
+    def test_password_hashing_overload_response(self):
+        self.app.extensions['password_hasher'] = PasswordHasher(
+            'pbkdf2:sha256:1000', workers=1, queue_depth=0)
+        self.app.extensions['password_hasher']._slots.acquire()
+        response = self._login_user()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
@@ -0,0 +1,78 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from app.models import Comment, PostMeta
+from settings import TestConfig
+from tests.base import AppTestCase
+
+
+class WriteBehindConfig(TestConfig):
+    COMMENT_WRITE_MODE = 'wait'
+    WRITE_BEHIND_INTERVAL = 0.05
+
+
+class AsyncWriteBehindConfig(WriteBehindConfig):
+    COMMENT_WRITE_MODE = 'async'
+
+
+class TestWriteBehind(AppTestCase):
+    config = None
+
+    def tearDown(self):
+        self.app.extensions['comment_writer'].stop()
+        super().tearDown()
+
+    def test_wait_for_commit(self):
+        self.create_app(WriteBehindConfig)
+        payload = {'post_id': 'test-post-id', 'body': 'Test comment'}
+        with ThreadPoolExecutor(4) as executor:
+            responses = list(executor.map(
+                lambda _: self.client.post('/new', json=payload), range(8)))
+        self.assertEqual({response.status_code for response in responses},
+                         {201})
+        self.assertEqual(Comment.query.count(), 8)
+        self.assertEqual(PostMeta.get_counts(['test-post-id']),
+                         {'test-post-id': 8})
+
+        payload = {'post_id': 'test-post-id', 'body': 'Reply',
+                   'parent_id': 1000}
+        response = self.client.post('/new', json=payload)
+        self.assertEqual(response.status_code, 400)
+
+    def test_accepted_with_provisional_id(self):
+        self.create_app(AsyncWriteBehindConfig)
+        payload = {'post_id': 'test-post-id', 'body': 'Test comment'}
+        response = self.client.post('/new', json=payload)
+        self.assertEqual(response.status_code, 202)
+        provisional_id = response.get_json()['provisional_id']
+
+        self.app.extensions['comment_writer'].results.get(
+            provisional_id).wait(5)
+        response = self.client.get(f'/pending/{provisional_id}')
+        self.assertEqual(response.get_json()['status'], 'created')
+        self.assertEqual(Comment.query.count(), 1)
+
+    def test_stop_flushes_queue(self):
+        self.create_app(AsyncWriteBehindConfig)
+        self.app.extensions['comment_writer'].interval = 10
+        payload = {'post_id': 'test-post-id', 'body': 'Test comment'}
+        for _ in range(3):
+            self.client.post('/new', json=payload)
+        self.app.extensions['comment_writer'].stop()
+        self.assertEqual(Comment.query.count(), 3)
+
+    def test_thread_started_per_process(self):
+        self.create_app(WriteBehindConfig)
+        writer = self.app.extensions['comment_writer']
+        self.assertIsNone(writer._thread)
+        payload = {'post_id': 'test-post-id', 'body': 'Test comment'}
+        self.assertEqual(self.client.post('/new', json=payload).status_code,
+                         201)
+        # As inherited by a worker forked after the first write
+        parent_thread, parent_queue = writer._thread, writer._queue
+        writer._pid = -1
+        self.assertEqual(self.client.post('/new', json=payload).status_code,
+                         201)
+        self.assertIsNot(writer._thread, parent_thread)
+        writer.stop()
+        parent_queue.put(None)
+        parent_thread.join()